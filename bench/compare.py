@@ -0,0 +1,68 @@
+"""
+Compare two results of pipeline.py and report regressions.
+
+Stage regresses if its wall time or memory peak grows by more than threshold
+(relative, 0.2 by default). Stages shorter than --min-sec are compared only by memory,
+as their timing is mostly noise. Exit code is 1 if there are regressions.
+
+Usage: python bench/compare.py BASE.json NEW.json [--threshold T] [--min-sec S]
+"""
+import argparse
+import json
+import sys
+
+def compare(base, new, threshold=0.2, min_sec=0.05):
+    """
+    Compare results of two runs
+        :param base: results of base run (as written by pipeline.py)
+        :param new: results of new run
+        :param threshold: allowed relative growth of time and memory
+        :param min_sec: minimal wall time of stage, which is compared by time
+        :return: list of rows (size, stage, base time, new time, base peak, new peak, regression description)
+    """
+    rows = []
+    for size, stages in new['sizes'].items():
+        base_stages = base['sizes'].get(size)
+        if base_stages is None:
+            continue
+        for stage, result in stages.items():
+            base_result = base_stages.get(stage)
+            if not isinstance(result, dict) or not isinstance(base_result, dict):
+                continue
+            problems = []
+            if max(base_result['wall_sec'], result['wall_sec']) >= min_sec and \
+                    result['wall_sec'] > base_result['wall_sec'] * (1 + threshold):
+                problems.append('time')
+            if result['peak_rss_mb'] > base_result['peak_rss_mb'] * (1 + threshold) and \
+                    result['peak_rss_mb'] - base_result['peak_rss_mb'] > 1:
+                problems.append('memory')
+            rows.append((size, stage, base_result['wall_sec'], result['wall_sec'],
+                base_result['peak_rss_mb'], result['peak_rss_mb'], ' '.join(problems)))
+    return rows
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('base', help='results of base run')
+    arg_parser.add_argument('new', help='results of new run')
+    arg_parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative growth')
+    arg_parser.add_argument('--min-sec', type=float, default=0.05, help='minimal wall time compared by time')
+    args = arg_parser.parse_args()
+    with open(args.base) as fin:
+        base = json.load(fin)
+    with open(args.new) as fin:
+        new = json.load(fin)
+
+    rows = compare(base, new, args.threshold, args.min_sec)
+    print(f'{"size":>8} {"stage":<24} {"base s":>9} {"new s":>9} {"ratio":>6} {"base MB":>9} {"new MB":>9}')
+    for size, stage, base_wall, wall, base_peak, peak, problems in rows:
+        ratio = wall / max(base_wall, 1e-9)
+        print(f'{size:>8} {stage:<24} {base_wall:9.3f} {wall:9.3f} {ratio:6.2f} {base_peak:9.1f} {peak:9.1f}'
+            + (f'  REGRESSION ({problems})' if problems else ''))
+    regressions = [row for row in rows if row[-1]]
+    if regressions:
+        print(f'{len(regressions)} regression(s)')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
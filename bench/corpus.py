@@ -0,0 +1,114 @@
+"""
+Deterministic generator of synthetic habrahabr posts for benchmarks.
+
+Posts have the same fields as posts saved by HabrHubSpider and realistic sizes:
+bodies of a few thousand characters of words with Zipf-like frequencies,
+and rating depending on hidden post quality, which also shows in its views,
+bookmarks, comments and in use of some "good" words. Post with given index
+is the same for any corpus size and seed, so smaller corpora are prefixes of bigger ones.
+
+Usage: python bench/corpus.py OUTPUT_DB COUNT [--seed SEED]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+
+import numpy as np
+
+from habrating import db
+
+VOCABULARY_SIZE = 50000
+# Mean count of words in post body (about 6000 characters)
+MEAN_BODY_WORDS = 700
+# Count of words, which are used more by good posts
+QUALITY_WORDS = 300
+
+_SYLLABLES = ['ба', 'ве', 'ги', 'до', 'жу', 'за', 'ки', 'ло', 'ме', 'ны', 'по', 'ру', 'са', 'ти', 'фо',
+    'ха', 'це', 'чи', 'ша', 'эк', 'юн', 'як', 'ст', 'пр', 'ин', 'ор', 'ал', 'ер']
+
+class Corpus:
+    """
+    Generator of synthetic posts
+    """
+    def __init__(self, seed=0, vocabulary_size=VOCABULARY_SIZE, mean_body_words=MEAN_BODY_WORDS):
+        """
+            :param seed: seed of corpus
+            :param vocabulary_size: count of distinct words
+            :param mean_body_words: mean count of words in post body
+        """
+        self.seed = seed
+        self.mean_body_words = mean_body_words
+        rng = np.random.default_rng([seed, 0])
+        syllables = np.array(_SYLLABLES)
+        lengths = rng.integers(2, 6, size=vocabulary_size)
+        words = {''.join(syllables[rng.integers(0, len(syllables), size=length)]) for length in lengths}
+        # Sorted before shuffle, so vocabulary doesn't depend on order of set
+        self.words = rng.permutation(np.array(sorted(words)))
+        ranks = np.arange(1, len(self.words) + 1)
+        self.word_probabilities = 1.0 / ranks ** 1.05
+        self.word_probabilities /= self.word_probabilities.sum()
+        self.quality_words = rng.choice(len(self.words), size=QUALITY_WORDS, replace=False)
+
+    def _text(self, rng, count, quality):
+        indices = rng.choice(len(self.words), size=count, p=self.word_probabilities)
+        # Good posts replace part of words by "good" ones, bad posts never do
+        good = rng.random(count) < max(quality, 0) * 0.05
+        indices[good] = rng.choice(self.quality_words, size=int(good.sum()))
+        return ' '.join(self.words[indices])
+
+    def post(self, index):
+        """
+        Generate post
+            :param index: index of post in corpus
+            :return: dict with fields of post saved by HabrHubSpider
+        """
+        rng = np.random.default_rng([self.seed, 1, index])
+        quality = rng.normal()
+        post = {}
+        post['url'] = f'https://habrahabr.ru/post/{100000 + index}/'
+        post['year'] = int(2012 + index % 7)
+        post['title'] = self._text(rng, int(rng.integers(3, 12)), quality)
+        post['body'] = self._text(rng, max(20, int(rng.lognormal(np.log(self.mean_body_words), 0.6))), quality)
+        post['body length'] = len(post['body'])
+        post['company rating'] = float(round(rng.exponential(50), 2)) if rng.random() < 0.3 else 0.0
+        post['rating'] = int(round(8 + 10 * quality + rng.normal(0, 4)))
+        post['comments'] = int(rng.poisson(20 * np.exp(0.4 * quality)))
+        post['views'] = int(rng.lognormal(9 + 0.5 * quality, 0.7))
+        post['bookmarks'] = int(rng.poisson(post['views'] * 0.005 * np.exp(0.5 * quality)))
+        post['author karma'] = float(round(rng.normal(20 + 10 * quality, 15), 1))
+        post['author rating'] = float(round(rng.exponential(30), 1))
+        post['author followers'] = int(rng.exponential(40))
+        return post
+
+    def posts(self, count, start=0):
+        """
+        Generate posts
+            :param count: count of posts
+            :param start: index of first post
+        """
+        for index in range(start, start + count):
+            yield self.post(index)
+
+    def write_db(self, path_to_file, count):
+        """
+        Write posts into new data file (as parser.save_hub_to_db would do)
+            :param path_to_file: path to data file
+            :param count: count of posts
+        """
+        db.init_db(path_to_file)
+        with open(path_to_file, 'ab') as fout:
+            for post in self.posts(count):
+                db.append_db(post, path_to_file, fout)
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('output', help='path to new data file')
+    arg_parser.add_argument('count', type=int, help='count of posts')
+    arg_parser.add_argument('--seed', type=int, default=0)
+    args = arg_parser.parse_args()
+    Corpus(args.seed).write_db(args.output, args.count)
+
+if __name__ == '__main__':
+    main()
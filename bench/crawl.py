@@ -0,0 +1,115 @@
+"""
+Benchmark of crawler throughput against local stand-in of habrahabr (see habr_server.py).
+
+Crawls the whole (first) stand-in hub by parser.save_hub_to_db once for every combination of
+scrapy concurrency, autothrottle and retry settings and reports pages/sec (all served
+responses, including failed ones) and articles/sec (posts saved to store) of crawl stage.
+Every crawl runs in its own process and directory, so it starts with empty response cache.
+
+Usage: python bench/crawl.py [--concurrency N ...] [--autothrottle off on] [--retries N ...]
+    [--start-delay SEC] [--output FILE] [--work-dir DIR] [site options of habr_server.py]
+"""
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+
+import habr_server
+from pipeline import environment
+
+def run_crawl(hub, base_url, crawler_settings):
+    """
+    Crawl hub into store in current directory
+        :return: record of crawl stage
+    """
+    from habrating import metrics, parser
+    records = []
+    metrics.sinks.append(records.append)
+    parser.save_hub_to_db(hub, 'bench.store', base_url=base_url, crawler_settings=crawler_settings)
+    return next(record for record in records if record['stage'] == 'crawl')
+
+def crawler_settings(concurrency, autothrottle, retries, start_delay):
+    "Return scrapy settings of measured combination"
+    return {
+        'CONCURRENT_REQUESTS': concurrency,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': concurrency,
+        'AUTOTHROTTLE_ENABLED': autothrottle,
+        'AUTOTHROTTLE_START_DELAY': start_delay,
+        'AUTOTHROTTLE_TARGET_CONCURRENCY': concurrency,
+        'RETRY_TIMES': retries
+    }
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--concurrency', type=int, nargs='+', default=[4, 16, 64],
+        help='values of CONCURRENT_REQUESTS (and of CONCURRENT_REQUESTS_PER_DOMAIN)')
+    arg_parser.add_argument('--autothrottle', choices=['off', 'on'], nargs='+', default=['off', 'on'],
+        help='values of AUTOTHROTTLE_ENABLED')
+    arg_parser.add_argument('--retries', type=int, nargs='+', default=[10], help='values of RETRY_TIMES')
+    arg_parser.add_argument('--start-delay', type=float, default=0.1, help='AUTOTHROTTLE_START_DELAY in seconds')
+    arg_parser.add_argument('--work-dir', help='directory of crawled stores, temporary by default')
+    arg_parser.add_argument('--output', default='crawl.json', help='path to JSON with results')
+    habr_server.add_site_arguments(arg_parser)
+    arg_parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.run:
+        # Child process: crawl with given settings and pass crawl stage record to parent
+        run = json.loads(args.run)
+        print(json.dumps(run_crawl(args.hub[0], run['base_url'], run['settings'])))
+        return
+
+    report = {
+        'environment': environment(),
+        'parameters': {key: getattr(args, key) for key in
+            ('hub', 'posts', 'overlap', 'authors', 'seed', 'recorded', 'latency', 'jitter', 'error_rate',
+            'start_delay')},
+        'runs': []
+    }
+    server = habr_server.make_server(args).start()
+    print(f'{"concurrency":>11} {"autothrottle":>12} {"retries":>7} {"wall s":>8} {"pages/s":>8} '
+        f'{"articles/s":>10} {"articles":>8} {"errors":>6}')
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            work_dir = os.path.abspath(args.work_dir or tmp)
+            combinations = itertools.product(args.concurrency, args.autothrottle, args.retries)
+            for index, (concurrency, autothrottle, retries) in enumerate(combinations):
+                settings = crawler_settings(concurrency, autothrottle == 'on', retries, args.start_delay)
+                run_dir = os.path.join(work_dir, f'run{index}')
+                os.makedirs(run_dir, exist_ok=True)
+                served_before = server.snapshot()
+                command = [sys.executable, os.path.abspath(__file__), '--hub', args.hub[0],
+                    '--run', json.dumps({'base_url': server.base_url, 'settings': settings})]
+                # Progress bar goes to stdout too, record of crawl is the last line
+                output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True, cwd=run_dir).stdout
+                record = json.loads(output.strip().splitlines()[-1])
+                served = {kind: count - served_before.get(kind, 0) for kind, count in server.snapshot().items()}
+                pages = sum(served.values())
+                errors = sum(count for kind, count in served.items() if kind.isdigit())
+                wall = max(record['wall_sec'], 1e-9)
+                run = {
+                    'settings': settings,
+                    'wall_sec': record['wall_sec'],
+                    'cpu_sec': record['cpu_sec'] + record['children_cpu_sec'],
+                    'pages': pages,
+                    'served': served,
+                    'articles': record['items'],
+                    'pages_per_sec': pages / wall,
+                    'articles_per_sec': record['items'] / wall
+                }
+                report['runs'].append(run)
+                print(f'{concurrency:>11} {autothrottle:>12} {retries:>7} {run["wall_sec"]:8.2f} '
+                    f'{run["pages_per_sec"]:8.1f} {run["articles_per_sec"]:10.1f} {run["articles"]:>8} {errors:>6}')
+    finally:
+        server.stop()
+    with open(args.output, 'w') as fout:
+        json.dump(report, fout, indent=2)
+    print(f'Results are saved to {args.output}')
+
+if __name__ == '__main__':
+    main()
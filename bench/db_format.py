@@ -0,0 +1,118 @@
+"""
+Benchmark of data file formats on vectorized synthetic hub.
+
+Vectorizes synthetic hub (see corpus.py) into plain data file (stream of pickled posts, as
+cvt_text_db_to_vec_db writes by default) and rewrites it in block format (see habrating.blockfile)
+with every given codec. Reports on-disk size of every file and time of reading all its posts
+by db.iter_db with every given count of decompressing threads. Before every read pages of
+the file are dropped from page cache (posix_fadvise), so reads are cold unless --warm is given.
+As read time of block file is mostly decompression, while plain file is mostly read from disk,
+for every codec reports storage bandwidth below which block file is read faster than plain one.
+
+Usage: python bench/db_format.py [--posts N] [--codecs zlib lzma ...] [--block-size N] [--workers N ...]
+    [--repeat N] [--warm] [--work-dir DIR] [--output FILE]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+
+from corpus import Corpus
+from pipeline import environment
+
+def drop_cache(path):
+    "Drop pages of file from page cache, return False if it is not supported"
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+def measure_read(path, workers, repeat, warm):
+    "Return best time in seconds of reading all posts of data file"
+    from habrating import db
+    best = None
+    for _ in range(repeat):
+        if not warm:
+            drop_cache(path)
+        start = time.perf_counter()
+        for _ in db.iter_db(path, workers=workers):
+            pass
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--posts', type=int, default=2000, help='count of posts of synthetic hub')
+    arg_parser.add_argument('--codecs', nargs='+', default=['zlib', 'lzma', 'bz2'], help='codecs of block files')
+    arg_parser.add_argument('--block-size', type=int, default=256, help='count of posts in block')
+    arg_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='counts of decompressing threads')
+    arg_parser.add_argument('--repeat', type=int, default=3, help='count of reads of every file')
+    arg_parser.add_argument('--warm', action='store_true', help='keep files in page cache between reads')
+    arg_parser.add_argument('--sparse', action='store_true', help='vectorize into sparse rows')
+    arg_parser.add_argument('--work-dir', help='directory of data files, temporary by default')
+    arg_parser.add_argument('--output', default='db_format.json', help='path to JSON with results')
+    args = arg_parser.parse_args()
+
+    from habrating import db
+    report = {
+        'environment': environment(),
+        'parameters': {key: getattr(args, key) for key in ('posts', 'codecs', 'block_size', 'workers', 'repeat',
+            'warm', 'sparse')},
+        'formats': {}
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = os.path.abspath(args.work_dir or tmp)
+        os.makedirs(work_dir, exist_ok=True)
+        text_path = os.path.join(work_dir, 'hub.pickle')
+        plain_path = os.path.join(work_dir, 'vec_hub.pickle')
+        Corpus().write_db(text_path, args.posts)
+        db.cvt_text_db_to_vec_db(text_path, plain_path, os.path.join(work_dir, 'space_hub.pickle'), sparse=args.sparse)
+        paths = {'plain': plain_path}
+        for codec in args.codecs:
+            paths[codec] = os.path.join(work_dir, f'vec_hub.{codec}.pickle')
+            start = time.perf_counter()
+            db.save_db(db.iter_db(plain_path), paths[codec], args.block_size, codec)
+            report['formats'][codec] = {'write_sec': time.perf_counter() - start}
+        report['formats']['plain'] = {}
+        report['cold'] = not args.warm and drop_cache(plain_path)
+
+        print(f'{"format":<8} {"size MB":>9} {"ratio":>6} ' + ' '.join(f'{f"read s ({w})":>12}' for w in args.workers)
+            + f' {"break-even MB/s":>16}')
+        plain_size = os.path.getsize(plain_path)
+        for name, path in paths.items():
+            result = report['formats'][name]
+            result['size_bytes'] = os.path.getsize(path)
+            result['ratio'] = plain_size / result['size_bytes']
+            # Plain file is read by one thread whatever count of workers is
+            workers = args.workers if name != 'plain' else [1]
+            result['read_sec'] = {workers_count: measure_read(path, workers_count, args.repeat, args.warm)
+                for workers_count in workers}
+            result['posts_per_sec'] = {workers_count: args.posts / seconds
+                for workers_count, seconds in result['read_sec'].items()}
+            break_even = ''
+            if name != 'plain':
+                # Plain read time grows by plain_size / bandwidth, block one by size / bandwidth
+                extra_sec = min(result['read_sec'].values()) - report['formats']['plain']['read_sec'][1]
+                saved_mb = (plain_size - result['size_bytes']) / 2**20
+                result['break_even_mb_per_sec'] = saved_mb / extra_sec if extra_sec > 0 else None
+                break_even = 'any' if extra_sec <= 0 else f'{result["break_even_mb_per_sec"]:.0f}'
+            print(f'{name:<8} {result["size_bytes"] / 2**20:9.1f} {result["ratio"]:6.1f} '
+                + ' '.join(f'{result["read_sec"][w]:12.3f}' if w in result['read_sec'] else f'{"":>12}'
+                for w in args.workers) + f' {break_even:>16}')
+    print('Reads are ' + ('cold' if report['cold'] else 'warm (page cache is kept)'))
+    with open(args.output, 'w') as fout:
+        json.dump(report, fout, indent=2)
+    print(f'Results are saved to {args.output}')
+
+if __name__ == '__main__':
+    main()
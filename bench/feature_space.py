@@ -0,0 +1,101 @@
+"""
+Comparison of word spaces of habrating models on a stored hub db:
+    count    - CountVectorizer vocabularies fitted on train posts (default of model_from_db)
+    hashing  - HashingVectorizer, which needs no fit pass
+
+For every space reports time of fit and vectorization, training time, mean absolute error
+of predicted rating on held out posts and sizes of serialized vectorizers and model file.
+With --reduction every space is also measured with given reduction of features
+(see HabrHubRatingRegressor.fit_reduced), training time includes fit of reduction.
+
+Usage: python bench/feature_space.py HUB_DB [--test-fraction F] [--trees N] [--dense]
+       [--reduction select|svd] [--reduced-features N]
+"""
+import argparse
+import json
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+
+import numpy as np
+from sklearn.utils import shuffle
+
+from habrating import db, model, utils
+
+def vectorize(posts, body_vectorizer, title_vectorizer, sparse, batch_size=1000):
+    "Return X and y for copies of posts (posts are left as text)"
+    vectorized = []
+    for batch in utils.batches((dict(post) for post in posts), batch_size):
+        db.vectorize_posts(batch, body_vectorizer, title_vectorizer, sparse)
+        vectorized.extend(batch)
+    return db.cvt_to_DataFrames(vectorized)
+
+def run_space(feature_space, train, test, trees, sparse, reduction=None, reduced_features=1000):
+    """
+    Train and evaluate model with given word space and optional reduction of features
+        :return: dict with timings, error and sizes
+    """
+    start = time.perf_counter()
+    if feature_space == 'count':
+        body_vectorizer, title_vectorizer = db._fit_text_transformers(train)
+    else:
+        body_vectorizer, title_vectorizer = db._hashing_text_transformers()
+    fit_time = time.perf_counter() - start
+    start = time.perf_counter()
+    X_train, y_train = vectorize(train, body_vectorizer, title_vectorizer, sparse)
+    X_test, y_test = vectorize(test, body_vectorizer, title_vectorizer, sparse)
+    vectorize_time = time.perf_counter() - start
+
+    hub = model.HabrHubRatingRegressor('bench')
+    hub.estimator.set_params(n_estimators=trees, verbose=0, random_state=0)
+    hub.set_transformers(body_vectorizer, title_vectorizer)
+    start = time.perf_counter()
+    if reduction is None:
+        hub.fit(X_train, y_train)
+    else:
+        hub.fit_reduced(X_train, y_train, reduction, reduced_features)
+    train_time = time.perf_counter() - start
+    mae = float(np.mean(np.abs(hub.predict(X_test) - y_test)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = os.path.join(tmp, 'bench.hubmodel.mmap')
+        hub.save_mapped(model_path)
+        model_size = os.path.getsize(model_path)
+    return {
+        'fit_sec': fit_time,
+        'vectorize_sec': vectorize_time,
+        'vectorize_posts_per_sec': (len(train) + len(test)) / vectorize_time,
+        'train_sec': train_time,
+        'features': hub._reduce(X_train[:1]).shape[1],
+        'mae': mae,
+        'vectorizers_bytes': len(pickle.dumps((body_vectorizer, title_vectorizer))),
+        'model_file_bytes': model_size
+    }
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('db', help='text hub db (as made by parser.save_hub_to_db)')
+    arg_parser.add_argument('--test-fraction', type=float, default=0.2, help='part of posts held out for error')
+    arg_parser.add_argument('--trees', type=int, default=100, help='count of trees of forest')
+    arg_parser.add_argument('--dense', action='store_true', help='use dense features instead of sparse ones')
+    arg_parser.add_argument('--reduction', choices=['select', 'svd'], help='also measure spaces with reduction')
+    arg_parser.add_argument('--reduced-features', type=int, default=1000, help='count of features after reduction')
+    args = arg_parser.parse_args()
+
+    posts = shuffle(list(db.iter_db(args.db)), random_state=0)
+    test_size = max(1, int(len(posts) * args.test_fraction))
+    train, test = posts[test_size:], posts[:test_size]
+    results = {'posts': len(posts), 'test_posts': len(test)}
+    for feature_space in ['count', 'hashing']:
+        results[feature_space] = run_space(feature_space, train, test, args.trees, not args.dense)
+        if args.reduction:
+            results[f'{feature_space}+{args.reduction}'] = run_space(feature_space, train, test, args.trees,
+                not args.dense, args.reduction, args.reduced_features)
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+"""
+Local stand-in of habrahabr for offline crawler benchmarks.
+
+Serves hub listing, article and author pages with markup extracted by HabrHubSpider.
+Pages are either synthetic (rendered from posts of corpus.py) or recorded (pages of
+habrating response cache, e.g. .habrating_cache after a real crawl, with links rewritten
+to the stand-in). Every response may be delayed and may fail with 503 with given
+probability, to imitate slow or overloaded site.
+
+Point crawls to it by base_url argument of parser.save_hub_to_db or by HABR_BASE_URL
+environment variable.
+
+Usage: python bench/habr_server.py [--port 8765] [--hub HUB ...] [--posts N] [--overlap F] [--authors N]
+    [--latency SEC] [--jitter SEC] [--error-rate P] [--recorded CACHE_DIR]
+"""
+import argparse
+import collections
+import html
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+
+from habrating import cache
+
+# Count of posts on one listing page, as on habrahabr
+PAGE_POSTS = 10
+
+_MONTHS = ['января', 'февраля', 'марта', 'апреля', 'мая', 'июня', 'июля', 'августа', 'сентября',
+    'октября', 'ноября', 'декабря']
+_LISTING_RE = re.compile(r'^/hub/([^/]+)/all/page(\d+)/?$')
+_ARTICLE_RE = re.compile(r'^/post/(\d+)/?$')
+_AUTHOR_RE = re.compile(r'^/users/author(\d+)/?$')
+
+def _habr_number(value):
+    "Format non-negative number as habrahabr does, e.g. 3200 -> '3,2k'"
+    if value >= 1000000:
+        return f'{value / 1000000:.1f}m'.replace('.', ',')
+    if value >= 1000:
+        return f'{value / 1000:.1f}k'.replace('.', ',')
+    return str(value).replace('.', ',')
+
+class SyntheticSite:
+    """
+    Pages of hubs, rendered from posts of synthetic corpus. Post with index i
+    is at /post/{100000 + i}/ and is written by author{i % authors}. Hub number j
+    lists posts from j * posts * (1 - overlap), so neighbour hubs share overlap part of posts
+    """
+    def __init__(self, hubs=('bench',), posts=1000, authors=100, seed=0, overlap=0.0):
+        """
+            :param hubs: names of hubs of site
+            :param posts: count of posts of every hub
+            :param authors: count of distinct authors
+            :param seed: seed of corpus
+            :param overlap: part of posts of hub, which are listed by next hub too
+        """
+        from corpus import Corpus
+        self.hubs = list(hubs)
+        self.posts = posts
+        self.step = max(1, int(posts * (1 - overlap)))
+        self.total = self.step * (len(self.hubs) - 1) + posts
+        self.authors = authors
+        self.corpus = Corpus(seed)
+
+    def page(self, path, base_url):
+        """
+        Render page
+            :param path: path of requested url
+            :param base_url: root of stand-in server
+            :return: page body or None if there is no such page
+        """
+        match = _LISTING_RE.match(path)
+        if match and match.group(1) in self.hubs:
+            return self._listing(match.group(1), int(match.group(2)))
+        match = _ARTICLE_RE.match(path)
+        if match and 0 <= int(match.group(1)) - 100000 < self.total:
+            return self._article(int(match.group(1)) - 100000)
+        match = _AUTHOR_RE.match(path)
+        if match and int(match.group(1)) < self.authors:
+            return self._author(int(match.group(1)))
+        return None
+
+    def _listing(self, hub, number):
+        pages = max(1, -(-self.posts // PAGE_POSTS))
+        if number > pages:
+            return None
+        first = (number - 1) * PAGE_POSTS
+        offset = self.hubs.index(hub) * self.step
+        links = ''.join(f'<h2><a class="post__title_link" href="/post/{100000 + index}/">Post {index}</a></h2>\n'
+            for index in range(offset + first, offset + min(first + PAGE_POSTS, self.posts)))
+        pagination = f'<a class="toggle-menu__item-link toggle-menu__item-link_pagination ' \
+            f'toggle-menu__item-link_bordered" href="/hub/{hub}/all/page{pages}/">Последняя</a>\n'
+        if number < pages:
+            pagination += f'<a id="next_page" href="/hub/{hub}/all/page{number + 1}/">Туда</a>\n'
+        return f'<html><body>\n{links}{pagination}</body></html>'
+
+    def _article(self, index):
+        post = self.corpus.post(index)
+        rating = f'+{post["rating"]}' if post['rating'] >= 0 else f'–{-post["rating"]}'
+        company = ''
+        if post['company rating']:
+            value = f'{post["company rating"]:.2f}'.replace('.', ',')
+            company = f'<sup class="page-header__stats-value page-header__stats-value_branding">{value}</sup>\n'
+        return f'''<html><body>
+{company}<span class="post__time">{index % 28 + 1} {_MONTHS[index % 12]} {post["year"]} в 10:00</span>
+<h1 class="post__title post__title_full"><span class="post__title-text">{html.escape(post["title"])}</span></h1>
+<div class="post__text post__text-html js-mediator-article">{html.escape(post["body"])}</div>
+<span class="voting-wjt__counter voting-wjt__counter_positive">{rating}</span>
+<strong class="comments-section__head-counter">{post["comments"]}</strong>
+<span class="post-stats__views-count">{_habr_number(post["views"])}</span>
+<span class="bookmark__counter js-favs_count">{post["bookmarks"]}</span>
+<span class="user-info__nickname user-info__nickname_small">author{index % self.authors}</span>
+</body></html>'''
+
+    def _author(self, number):
+        post = self.corpus.post(number)
+        counters = ''.join(f'<div class="stacked-counter__value">{_habr_number(abs(value))}</div>\n'
+            for value in (post['author karma'], post['author rating'], post['author followers']))
+        return f'<html><body>\n{counters}</body></html>'
+
+class RecordedSite:
+    """
+    Pages recorded in habrating response cache. Page at path is looked up as url of every
+    origin with this path, links to origins in pages are rewritten to stand-in server
+    """
+    def __init__(self, cache_dir, origins=('https://habrahabr.ru', 'https://habr.com')):
+        """
+            :param cache_dir: directory of response cache
+            :param origins: roots of recorded site
+        """
+        # Recorded pages never expire
+        self.cache = cache.ResponseCache(cache_dir, ttl=collections.defaultdict(lambda: float('inf')))
+        self.origins = origins
+
+    def page(self, path, base_url):
+        for origin in self.origins:
+            for url in (origin + path, origin + path.rstrip('/'), origin + path.rstrip('/') + '/'):
+                entry = self.cache.get(url)
+                if entry is not None and entry['status'] == 200:
+                    body = entry['body'].decode('utf-8', errors='replace')
+                    for link_origin in self.origins:
+                        body = body.replace(link_origin, base_url)
+                    return body
+        return None
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        path = self.path.split('?')[0]
+        delay, fail = server.next_response()
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            status, body = 503, b'Service Unavailable'
+        else:
+            page = server.site.page(path, server.base_url)
+            status, body = (404, b'Not Found') if page is None else (200, page.encode('utf-8'))
+        server.count(cache.page_class(path) if status == 200 else str(status))
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server of stand-in site
+    """
+    daemon_threads = True
+
+    def __init__(self, site, port=0, latency=0.0, jitter=0.0, error_rate=0.0, seed=0):
+        """
+            :param site: SyntheticSite or RecordedSite
+            :param port: port on localhost, 0 picks free one
+            :param latency: delay of every response in seconds
+            :param jitter: maximal random addition to delay in seconds
+            :param error_rate: probability of 503 response
+            :param seed: seed of random delays and errors
+        """
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.site = site
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.base_url = f'http://127.0.0.1:{self.server_address[1]}'
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        # page class (or error status) -> count of served responses
+        self.stats = collections.Counter()
+        self._thread = None
+
+    def next_response(self):
+        "Return delay and failure flag of next response"
+        with self._lock:
+            return self.latency + self._random.uniform(0, self.jitter), self._random.random() < self.error_rate
+
+    def count(self, kind):
+        with self._lock:
+            self.stats[kind] += 1
+
+    def snapshot(self):
+        "Return copy of counters of served responses"
+        with self._lock:
+            return dict(self.stats)
+
+    def start(self):
+        "Serve in background thread"
+        self._thread = threading.Thread(target=self.serve_forever, name='StandInServer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self._thread.join()
+        self.server_close()
+
+def add_site_arguments(arg_parser):
+    "Add arguments of stand-in site and server to argparse parser"
+    arg_parser.add_argument('--hub', nargs='+', default=['bench'], help='names of synthetic hubs')
+    arg_parser.add_argument('--posts', type=int, default=1000, help='count of synthetic posts of every hub')
+    arg_parser.add_argument('--overlap', type=float, default=0.0, help='part of posts shared by neighbour hubs')
+    arg_parser.add_argument('--authors', type=int, default=100, help='count of synthetic authors')
+    arg_parser.add_argument('--seed', type=int, default=0, help='seed of corpus, delays and errors')
+    arg_parser.add_argument('--recorded', metavar='CACHE_DIR', help='serve pages recorded in response cache instead')
+    arg_parser.add_argument('--latency', type=float, default=0.0, help='delay of every response in seconds')
+    arg_parser.add_argument('--jitter', type=float, default=0.0, help='maximal random addition to delay')
+    arg_parser.add_argument('--error-rate', type=float, default=0.0, help='probability of 503 response')
+
+def make_server(args, port=0):
+    "Create (not started) stand-in server by parsed arguments of add_site_arguments"
+    if args.recorded:
+        site = RecordedSite(args.recorded)
+    else:
+        site = SyntheticSite(args.hub, args.posts, args.authors, args.seed, args.overlap)
+    return StandInServer(site, port, args.latency, args.jitter, args.error_rate, args.seed)
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--port', type=int, default=8765, help='port on localhost')
+    add_site_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    server = make_server(args, args.port)
+    print(f'Serving {args.recorded or args.hub} at {server.base_url}, stop with Ctrl+C')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(dict(server.stats))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Benchmark of article extraction on saved article pages.
+
+Pages are article pages of habrating response cache (saved by crawls) or, by default,
+synthetic ones of habr_server.py, wrapped into page chrome of real page size (menu,
+sidebar and comments with their own voting counters). Reports articles per second
+per core (by cpu time of single process) of html parsing, of extraction of post fields
+from parsed tree and of both. With --scrapy also measures extraction through scrapy
+response, as HabrHubSpider does.
+
+Usage: python bench/parse.py [--cache-dir DIR] [--pages N] [--comments N] [--repeat N] [--scrapy] [--output FILE]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+
+import habr_server
+from pipeline import environment
+
+def _chrome(index, comments):
+    menu = ''.join(f'<li class="nav-links__item"><a class="nav-links__item-link" href="/hub/hub{item}/">'
+        f'Хаб {item}</a></li>' for item in range(150))
+    sidebar = ''.join(f'<div class="content-list__item"><a class="post-info__title" href="/post/{item}/">'
+        f'Статья {item}</a><span class="post-stats__views-count">{item}</span></div>' for item in range(30))
+    thread = ''.join(f'<div class="comment"><div class="comment__head"><a class="user-info" href="/users/user{item}/">'
+        f'<span class="user-info__nickname user-info__nickname_comment">user{item}</span></a>'
+        f'<time class="comment__date-time">вчера в 1{item % 10}:00</time></div>'
+        f'<div class="comment__message">комментарий {item} к статье {index} <code>x = {item}</code> и текст</div>'
+        f'<div class="voting-wjt"><span class="voting-wjt__counter voting-wjt__counter_positive">+{item % 7}</span>'
+        f'</div></div>' for item in range(comments))
+    return f'<ul class="nav-links">{menu}</ul>', f'<div class="sidebar">{sidebar}</div><div class="comments">{thread}</div>'
+
+def synthetic_pages(count, comments):
+    "Return bodies of synthetic article pages"
+    site = habr_server.SyntheticSite(posts=count)
+    pages = []
+    for index in range(count):
+        header, footer = _chrome(index, comments)
+        page = site.page(f'/post/{100000 + index}/', '')
+        page = page.replace('<body>', f'<body>{header}', 1).replace('</body>', f'{footer}</body>', 1)
+        pages.append((f'https://habrahabr.ru/post/{100000 + index}/', page.encode('utf-8')))
+    return pages
+
+def cached_pages(cache_dir, count):
+    "Return bodies of article pages of response cache"
+    import pickle
+    from habrating import cache
+    pages = []
+    for directory, _, names in os.walk(cache_dir):
+        for name in names:
+            try:
+                with open(os.path.join(directory, name), 'rb') as fin:
+                    entry = pickle.load(fin)
+            except Exception:
+                continue
+            if isinstance(entry, dict) and entry.get('status') == 200 and cache.page_class(entry['url']) == 'article':
+                pages.append((entry['url'], entry['body']))
+                if len(pages) == count:
+                    return pages
+    return pages
+
+def measure(function, pages, repeat):
+    "Return articles per second of cpu time of function called for every page"
+    start = time.process_time()
+    for _ in range(repeat):
+        for url, body in pages:
+            function(url, body)
+    return len(pages) * repeat / max(time.process_time() - start, 1e-9)
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--cache-dir', help='response cache with saved article pages, synthetic pages by default')
+    arg_parser.add_argument('--pages', type=int, default=200, help='count of pages')
+    arg_parser.add_argument('--comments', type=int, default=50, help='count of comments of synthetic page')
+    arg_parser.add_argument('--repeat', type=int, default=5, help='count of passes over pages')
+    arg_parser.add_argument('--scrapy', action='store_true', help='measure extraction through scrapy response too')
+    arg_parser.add_argument('--output', default='parse.json', help='path to JSON with results')
+    args = arg_parser.parse_args()
+
+    from habrating import extractor
+    if args.cache_dir:
+        pages = cached_pages(args.cache_dir, args.pages)
+    else:
+        pages = synthetic_pages(args.pages, args.comments)
+    if not pages:
+        sys.exit(f'no article pages in {args.cache_dir}')
+    trees = {url: extractor.parse_html(body) for url, body in pages}
+
+    results = {
+        'parse': measure(lambda url, body: extractor.parse_html(body), pages, args.repeat),
+        'extract': measure(lambda url, body: extractor.extract_post(trees[url], url), pages, args.repeat),
+        'parse and extract': measure(lambda url, body: extractor.extract_post(extractor.parse_html(body), url),
+            pages, args.repeat)
+    }
+    if args.scrapy:
+        from scrapy.http import HtmlResponse
+        from habrating import parser
+        spider = parser.HabrHubSpider('', None)
+        results['scrapy response'] = measure(
+            lambda url, body: spider.extract_post(HtmlResponse(url, body=body, encoding='utf-8')), pages, args.repeat)
+
+    mean_size = sum(len(body) for _, body in pages) / len(pages)
+    print(f'{len(pages)} pages of {mean_size / 1024:.1f}KB on average')
+    for name, rate in results.items():
+        print(f'{name:<20} {rate:10.1f} articles/sec per core')
+    report = {
+        'environment': environment(),
+        'parameters': {'cache_dir': args.cache_dir, 'pages': len(pages), 'comments': args.comments,
+            'repeat': args.repeat, 'mean_page_kb': mean_size / 1024},
+        'articles_per_sec': results
+    }
+    with open(args.output, 'w') as fout:
+        json.dump(report, fout, indent=2)
+    print(f'Results are saved to {args.output}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Benchmark of habrating pipeline stages on synthetic corpora (see corpus.py).
+
+For every corpus size measures (as habrating.metrics stages) wall and cpu time and peak memory
+(growth of resident memory of process during stage, sampled by background thread) of:
+    load_db, _fit_text_transformers, cvt_text_db_to_vec_db, cvt_to_DataFrames, fit,
+    predict_by_posts, save, load, save_mapped and load (mapped)
+Every size runs in its own process, which also reports its peak resident memory.
+Results are written as JSON, compare two results with compare.py.
+
+Usage: python bench/pipeline.py [--sizes N ...] [--output FILE] [--trees N] [--dense] [--work-dir DIR]
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+
+from corpus import Corpus
+
+# Count of posts predicted by one predict_by_posts call
+PREDICT_POSTS = 1000
+def measure(results, stage, items, function, *args, **kwargs):
+    """
+    Call function as metrics stage and put record of stage into results
+        :param results: dict of results of stages
+        :param stage: name of stage
+        :param items: count of processed items (e.g. posts)
+        :return: result of function
+    """
+    from habrating import metrics
+    gc.collect()
+    with metrics.stage(stage, items) as measured:
+        value = function(*args, **kwargs)
+    results[stage] = measured.record
+    print(f'{items:>8} {stage:<24} {measured.record["wall_sec"]:9.3f}s {measured.record["peak_rss_mb"]:10.1f}MB',
+        file=sys.stderr)
+    return value
+
+def run_size(size, seed, trees, sparse, work_dir):
+    """
+    Measure all stages on corpus of given size
+        :return: dict with results of stages
+    """
+    from habrating import db, model
+    text_path = os.path.join(work_dir, f'corpus-{seed}-{size}.pickle')
+    if not os.path.exists(text_path):
+        # Generated corpus is kept in work dir, so it may be reused by next runs
+        Corpus(seed).write_db(text_path + '.tmp', size)
+        os.replace(text_path + '.tmp', text_path)
+    vec_path = os.path.join(work_dir, f'vec-{seed}-{size}.pickle')
+    space_path = os.path.join(work_dir, f'space-{seed}-{size}.pickle')
+    model_path = os.path.join(work_dir, f'model-{seed}-{size}.hubmodel')
+
+    results = {}
+    posts = measure(results, 'load_db', size, db.load_db, text_path)
+    del posts
+    measure(results, '_fit_text_transformers', size, db._fit_text_transformers, text_path)
+    measure(results, 'cvt_text_db_to_vec_db', size, db.cvt_text_db_to_vec_db, text_path, vec_path, space_path,
+        sparse=sparse)
+    vectorized = db.load_db(vec_path)
+    X, y = measure(results, 'cvt_to_DataFrames', size, db.cvt_to_DataFrames, vectorized)
+    del vectorized
+
+    hub = model.HabrHubRatingRegressor('bench')
+    hub.estimator.set_params(n_estimators=trees, verbose=0, random_state=0)
+    hub.set_transformers(*db.load_hub_vectorizers(space_path))
+    measure(results, 'fit', size, hub.fit, X, y)
+    del X, y
+
+    posts = list(Corpus(seed).posts(min(size, PREDICT_POSTS)))
+    measure(results, 'predict_by_posts', len(posts), hub.predict_by_posts, posts)
+    measure(results, 'save', 1, hub.save, model_path)
+    measure(results, 'load', 1, model.load_model, model_path)
+    measure(results, 'save_mapped', 1, hub.save_mapped, model_path + '.mmap')
+    measure(results, 'load_mapped', 1, model.load_model, model_path + '.mmap')
+    results['model_file_mb'] = os.path.getsize(model_path) / 2**20
+    results['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+    return results
+
+def environment():
+    "Return description of environment of benchmark"
+    import numpy, scipy, sklearn
+    return {
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'scipy': scipy.__version__,
+        'sklearn': sklearn.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='corpus sizes')
+    arg_parser.add_argument('--seed', type=int, default=0, help='seed of corpus')
+    arg_parser.add_argument('--trees', type=int, default=10, help='count of trees of forest')
+    arg_parser.add_argument('--dense', action='store_true', help='use dense features instead of sparse ones')
+    arg_parser.add_argument('--work-dir', help='directory for corpora and intermediate files, temporary by default')
+    arg_parser.add_argument('--output', default='pipeline.json', help='path to JSON with results')
+    arg_parser.add_argument('--run-size', type=int, help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.run_size:
+        # Child process: measure one size and pass results to parent
+        results = run_size(args.run_size, args.seed, args.trees, not args.dense, args.work_dir)
+        print(json.dumps(results))
+        return
+
+    report = {
+        'environment': environment(),
+        'parameters': {'seed': args.seed, 'trees': args.trees, 'dense': args.dense},
+        'sizes': {}
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = os.path.abspath(args.work_dir or tmp)
+        os.makedirs(work_dir, exist_ok=True)
+        for size in args.sizes:
+            command = [sys.executable, os.path.abspath(__file__), '--run-size', str(size), '--seed', str(args.seed),
+                '--trees', str(args.trees), '--work-dir', work_dir]
+            if args.dense:
+                command.append('--dense')
+            # Progress bars of stages go to stdout too, results are the last line
+            output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True, cwd=work_dir).stdout
+            report['sizes'][str(size)] = json.loads(output.strip().splitlines()[-1])
+    with open(args.output, 'w') as fout:
+        json.dump(report, fout, indent=2)
+    print(f'Results are saved to {args.output}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Startup time benchmark of habrating.
+
+Every measurement runs in a fresh interpreter in an empty temporary directory,
+so nothing is imported or preloaded in advance:
+    window      - import of habrating.gui until main window is shown
+    prediction  - import of habrating.model until first direct text prediction is done
+                  with given model (measured only if --model is set)
+
+Usage: python bench/startup.py [--model FILE] [--repeat N]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src')
+
+# Modules, which should not be loaded by measured scenario
+HEAVY_MODULES = ['scrapy', 'twisted', 'billiard', 'lxml', 'aiohttp', 'progressbar', 'sklearn.ensemble']
+
+_WINDOW_SCRIPT = '''
+import time
+start = time.perf_counter()
+from PyQt5.QtWidgets import QApplication
+from habrating import gui
+app = QApplication([])
+window = gui.MainWindow()
+window.show()
+app.processEvents()
+elapsed = time.perf_counter() - start
+'''
+
+_PREDICTION_SCRIPT = '''
+import time
+start = time.perf_counter()
+from habrating import db, model
+hub_model = model.load_model(MODEL_PATH)
+post = {key: 0 for key in db.FEATURE_KEYS}
+post.update({'title': 'Заголовок', 'body': 'Текст статьи', 'body length': 12, 'rating': 0})
+hub_model.predict_by_posts([post])
+elapsed = time.perf_counter() - start
+'''
+
+_REPORT = '''
+import json, sys
+print(json.dumps({'elapsed': elapsed, 'loaded': [name for name in HEAVY_MODULES if name in sys.modules]}))
+'''
+
+def run_scenario(script, repeat, env):
+    """
+    Run script in fresh interpreters
+        :param script: python code, which sets 'elapsed' variable
+        :param repeat: count of runs
+        :param env: environment of interpreters
+        :return: dict with median time of scenario, median time of whole process and loaded heavy modules
+    """
+    code = f'HEAVY_MODULES = {HEAVY_MODULES!r}\n' + script + _REPORT
+    elapsed, total = [], []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as cwd:
+            start = time.perf_counter()
+            output = subprocess.run([sys.executable, '-c', code], env=env, cwd=cwd,
+                check=True, capture_output=True, text=True).stdout
+            total.append(time.perf_counter() - start)
+        result = json.loads(output.strip().splitlines()[-1])
+        elapsed.append(result['elapsed'])
+    return {
+        'import_to_ready_sec': statistics.median(elapsed),
+        'process_sec': statistics.median(total),
+        'heavy_modules_loaded': result['loaded']
+    }
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--model', help='model file for prediction scenario')
+    arg_parser.add_argument('--repeat', type=int, default=5, help='count of runs of every scenario')
+    args = arg_parser.parse_args()
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.abspath(SRC_DIR), env.get('PYTHONPATH')]))
+    if 'DISPLAY' not in env and 'WAYLAND_DISPLAY' not in env:
+        env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+    results = {'window': run_scenario(_WINDOW_SCRIPT, args.repeat, env)}
+    if args.model:
+        script = f'MODEL_PATH = {os.path.abspath(args.model)!r}\n' + _PREDICTION_SCRIPT
+        results['prediction'] = run_scenario(script, args.repeat, env)
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
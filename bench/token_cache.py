@@ -0,0 +1,66 @@
+"""
+Benchmark of vectorizer re-fits with and without token cache (see habrating.tokencache).
+
+Converts synthetic hub (see corpus.py) to vectorized data file by db.cvt_text_db_to_vec_db once
+for every given pair of cutoff and body vocabulary size, the way one tries vectorizer settings:
+first by tokenizing texts every time, then by token counts cached next to text data file
+(the first conversion counts tokens and writes cache). Reports time of every conversion and
+checks that both ways give the same features.
+
+Usage: python bench/token_cache.py [--posts N] [--settings CUTOFF:TEXT_MAX_SIZE ...] [--output FILE]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+
+from corpus import Corpus
+from pipeline import environment
+
+def convert(text_path, work_dir, cutoff, text_max_size, token_cache):
+    """
+    Vectorize text data file with given vocabulary settings
+        :return: seconds of conversion and features of posts
+    """
+    from habrating import db
+    vec_path = os.path.join(work_dir, 'vec_hub.pickle')
+    start = time.perf_counter()
+    db.cvt_text_db_to_vec_db(text_path, vec_path, os.path.join(work_dir, 'space_hub.pickle'), sparse=True,
+        token_cache=token_cache, fit_params={'cutoff': cutoff, 'text_max_size': text_max_size})
+    elapsed = time.perf_counter() - start
+    return elapsed, db.cvt_db_to_DataFrames(vec_path)
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--posts', type=int, default=2000, help='count of posts of synthetic hub')
+    arg_parser.add_argument('--settings', nargs='+', default=['2:20000', '5:20000', '2:5000', '10:2000'],
+        help='pairs of cutoff and body vocabulary size')
+    arg_parser.add_argument('--output', default='token_cache.json', help='path to JSON with results')
+    args = arg_parser.parse_args()
+
+    settings = [tuple(int(value) for value in pair.split(':')) for pair in args.settings]
+    report = {'environment': environment(), 'parameters': {'posts': args.posts, 'settings': settings}, 'runs': []}
+    with tempfile.TemporaryDirectory() as work_dir:
+        text_path = os.path.join(work_dir, 'hub.pickle')
+        Corpus().write_db(text_path, args.posts)
+        for cutoff, text_max_size in settings:
+            tokenized_sec, (X_tokenized, y_tokenized) = convert(text_path, work_dir, cutoff, text_max_size, False)
+            cached_sec, (X_cached, y_cached) = convert(text_path, work_dir, cutoff, text_max_size, True)
+            same = (X_tokenized != X_cached).nnz == 0 and (y_tokenized == y_cached).all()
+            report['runs'].append({'cutoff': cutoff, 'text_max_size': text_max_size, 'tokenized_sec': tokenized_sec,
+                'cached_sec': cached_sec, 'same_features': bool(same)})
+    print(f'{"cutoff":>6} {"text size":>9} {"tokenized s":>12} {"cached s":>9} {"same":>5}')
+    for run in report['runs']:
+        print(f'{run["cutoff"]:>6} {run["text_max_size"]:>9} {run["tokenized_sec"]:12.2f} {run["cached_sec"]:9.2f} '
+            f'{str(run["same_features"]):>5}')
+    print('The first cached conversion counts tokens and writes cache')
+    with open(args.output, 'w') as fout:
+        json.dump(report, fout, indent=2)
+    print(f'Results are saved to {args.output}')
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,8 @@ import logging
 logger = logging.getLogger(__name__)
 logger.setLevel('DEBUG')
 
-# Log file
-fileh = logging.FileHandler('habrating.log')
+# Log file, opened on first record
+fileh = logging.FileHandler('habrating.log', delay=True)
 fileh.setLevel('DEBUG')
 fileh.setFormatter(logging.Formatter("[%(asctime)s][%(filename)s:%(funcName)s:%(lineno)s]%(levelname)s: %(message)s","%H:%M:%S"))
 
@@ -1,4 +1,20 @@
 import sys
+
+if len (sys.argv) > 1 and sys.argv[1] == 'serve':
+    from habrating import server
+    sys.exit (server.main (sys.argv[2:]))
+
+if len (sys.argv) > 1 and sys.argv[1] == 'build':
+    # python -m habrating build HUB [HUB ...] [--crawl-workers N] [--fit-workers N] [--n-jobs N]
+    from habrating import batch
+    sys.exit (batch.main (sys.argv[2:]))
+
+if len (sys.argv) > 1 and sys.argv[1] == 'convert':
+    # python -m habrating convert MODEL [MAPPED_MODEL]
+    from habrating import model
+    print (model.convert_model (*sys.argv[2:4]))
+    sys.exit (0)
+
 from habrating import gui
 
 sys.exit (gui.run_gui ())
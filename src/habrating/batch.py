@@ -0,0 +1,150 @@
+import argparse
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from . import logger, metrics
+
+# Default path of summary of batch build
+SUMMARY_FILE = 'habrating_build_summary.json'
+
+def _crawl_hub(hub_name, incremental):
+    """
+    Crawl hub into its text db (in process of crawl pool)
+        :return: record of crawl stage and count of posts in db
+    """
+    from . import parser, store
+    text_db_path = f"{hub_name}.pickle"
+    with metrics.stage('batch crawl', hub=hub_name) as crawl_stage:
+        if not parser.save_hub_to_db(hub_name, text_db_path, start_index=1, operations=5, incremental=incremental):
+            # Partially crawled hub must not be fitted
+            raise RuntimeError(f'crawl of {hub_name} was interrupted')
+    with store.PostStore(text_db_path) as post_store:
+        return crawl_stage.record, len(post_store)
+
+def _fit_hub(hub_name, options):
+    """
+    Make model of crawled hub and save it with default path (in process of fit pool)
+        :return: record of fit stage
+    """
+    from . import model
+    with metrics.stage('batch fit', hub=hub_name) as fit_stage:
+        hub = model.model_from_db(hub_name, f"{hub_name}.pickle", start_index=2, operations=5, **options)
+        with metrics.stage('save'):
+            hub.save()
+    return fit_stage.record
+
+def make_and_save_models_from_hubs(hub_names, crawl_workers=1, fit_workers=1, n_jobs=None, incremental=False,
+        sparse=False, feature_space='count', reduction=None, summary_path=SUMMARY_FILE):
+    """
+    Create models of many hubs and save them with default paths. Crawls run on pool of
+    crawl_workers processes and fits on pool of fit_workers processes, every hub is fitted
+    as soon as its crawl ends, so crawls of next hubs overlap with fits of previous ones.
+    Crawls share response cache and persisted author stats, so article or author page
+    already fetched by crawl of another hub is not fetched again (with more than one crawl
+    worker, page requested by two crawls at the same time may still be fetched twice).
+    Failed hub (including interrupted crawl) doesn't stop build of others
+        :param hub_names: names of target hubs
+        :param crawl_workers: count of simultaneous crawls
+        :param fit_workers: count of simultaneous fits
+        :param n_jobs: count of threads fitting every forest, by default cores are divided between fit workers
+        :param incremental: if True, crawl only posts missing in existing hub dbs
+        :param sparse: if True, use scipy.sparse features (see model.model_from_db)
+        :param feature_space: 'count' or 'hashing' (see model.model_from_db)
+        :param reduction: None, 'select' or 'svd' (see model.model_from_db)
+        :param summary_path: path to JSON summary of build, None to not write it
+        :return: summary, dict with build times of hubs
+    """
+    from billiard import Pool
+    if n_jobs is None:
+        n_jobs = max(1, (os.cpu_count() or 1) // fit_workers)
+    options = {'sparse': sparse, 'feature_space': feature_space, 'reduction': reduction, 'n_jobs': n_jobs}
+    hub_names = list(dict.fromkeys(hub_names))
+    hubs = {hub_name: {} for hub_name in hub_names}
+
+    with metrics.stage('batch build', len(hub_names)) as build_stage:
+        # Fit workers are forked before crawl pool starts its threads
+        pool = Pool(fit_workers)
+        try:
+            fits = {}
+            # Every crawl forks its crawler process, which is safe only from a process without other
+            # threads, so crawls run on main threads of spawned (not forked) processes
+            with ProcessPoolExecutor(crawl_workers, mp_context=multiprocessing.get_context('spawn')) as crawlers:
+                crawls = {crawlers.submit(_crawl_hub, hub_name, incremental): hub_name for hub_name in hub_names}
+                for crawl in as_completed(crawls):
+                    hub_name = crawls[crawl]
+                    try:
+                        crawl_record, posts = crawl.result()
+                    except Exception as e:
+                        logger.warning(f'crawl of {hub_name} failed: {repr(e)}')
+                        hubs[hub_name]['error'] = repr(e)
+                        continue
+                    hubs[hub_name].update(start=crawl_record['start'], crawl_sec=crawl_record['wall_sec'], posts=posts)
+                    fits[hub_name] = pool.apply_async(_fit_hub, (hub_name, options))
+            for hub_name, fit in fits.items():
+                try:
+                    fit_record = fit.get()
+                except Exception as e:
+                    logger.warning(f'fit of {hub_name} failed: {repr(e)}')
+                    hubs[hub_name]['error'] = repr(e)
+                    continue
+                hub = hubs[hub_name]
+                crawl_end = hub['start'] + hub['crawl_sec']
+                hub.update(fit_sec=fit_record['wall_sec'], wait_sec=max(0.0, fit_record['start'] - crawl_end),
+                    build_sec=fit_record['start'] + fit_record['wall_sec'] - hub['start'])
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    summary = {
+        'wall_sec': build_stage.record['wall_sec'],
+        'crawl_workers': crawl_workers,
+        'fit_workers': fit_workers,
+        'n_jobs': n_jobs,
+        'hubs': hubs
+    }
+    for hub_name, hub in hubs.items():
+        if 'error' in hub:
+            logger.info(f'build of {hub_name} failed: {hub["error"]}')
+        else:
+            logger.info(f'build of {hub_name}: {hub["build_sec"]:.1f}s ({hub["posts"]} posts, '
+                f'crawl {hub["crawl_sec"]:.1f}s, wait {hub["wait_sec"]:.1f}s, fit {hub["fit_sec"]:.1f}s)')
+    if summary_path is not None:
+        with open(summary_path, 'w') as fout:
+            json.dump(summary, fout, indent=2)
+    return summary
+
+def main(argv):
+    """
+    Build models of many hubs
+        :param argv: command line arguments (after 'build')
+        :return: exit code
+    """
+    arg_parser = argparse.ArgumentParser(prog='python -m habrating build',
+        description='Crawl hubs and build their models with shared crawl and fit pools')
+    arg_parser.add_argument('hubs', nargs='+', help='names of hubs')
+    arg_parser.add_argument('--crawl-workers', type=int, default=1, help='count of simultaneous crawls')
+    arg_parser.add_argument('--fit-workers', type=int, default=1, help='count of simultaneous fits')
+    arg_parser.add_argument('--n-jobs', type=int, help='count of threads fitting every forest')
+    arg_parser.add_argument('--incremental', action='store_true', help='crawl only posts missing in hub dbs')
+    arg_parser.add_argument('--sparse', action='store_true', help='use sparse features')
+    arg_parser.add_argument('--feature-space', choices=['count', 'hashing'], default='count')
+    arg_parser.add_argument('--reduction', choices=['select', 'svd'])
+    arg_parser.add_argument('--summary', default=SUMMARY_FILE, help='path to JSON summary of build')
+    args = arg_parser.parse_args(argv)
+
+    summary = make_and_save_models_from_hubs(args.hubs, args.crawl_workers, args.fit_workers, args.n_jobs,
+        args.incremental, args.sparse, args.feature_space, args.reduction, args.summary)
+    print(f'{"hub":<24} {"posts":>7} {"crawl s":>8} {"wait s":>7} {"fit s":>7} {"build s":>8}')
+    for hub_name, hub in summary['hubs'].items():
+        if 'error' in hub:
+            print(f'{hub_name:<24} failed: {hub["error"]}')
+        else:
+            print(f'{hub_name:<24} {hub["posts"]:>7} {hub["crawl_sec"]:8.1f} {hub["wait_sec"]:7.1f} '
+                f'{hub["fit_sec"]:7.1f} {hub["build_sec"]:8.1f}')
+    print(f'Total {summary["wall_sec"]:.1f}s, summary is saved to {args.summary}')
+    return 1 if any('error' in hub for hub in summary['hubs'].values()) else 0
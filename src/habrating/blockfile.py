@@ -0,0 +1,193 @@
+import os
+import pickle
+import struct
+from collections import deque
+
+MAGIC = b'HUBBLK1\n'
+
+# Default count of posts packed into one compressed block
+BLOCK_SIZE = 256
+# Footer is offset of pickled block index
+_FOOTER = struct.Struct('<Q')
+
+def _codec(name):
+    """
+    Get compress and decompress functions of codec
+        :param name: 'zlib', 'lzma', 'bz2' (stdlib) or 'zstd', 'lz4' (need zstandard or lz4 package)
+        :return: compress and decompress functions
+    """
+    if name == 'zlib':
+        import zlib
+        return (lambda data: zlib.compress(data, 6)), zlib.decompress
+    if name == 'lzma':
+        import lzma
+        return (lambda data: lzma.compress(data, preset=1)), lzma.decompress
+    if name == 'bz2':
+        import bz2
+        return bz2.compress, bz2.decompress
+    if name == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError('codec zstd needs zstandard package') from None
+        return zstandard.ZstdCompressor(level=3).compress, zstandard.ZstdDecompressor().decompress
+    if name == 'lz4':
+        try:
+            import lz4.frame
+        except ImportError:
+            raise ValueError('codec lz4 needs lz4 package') from None
+        return lz4.frame.compress, lz4.frame.decompress
+    raise ValueError(f'unknown codec {name}')
+
+def is_block_file(path):
+    """
+    Check if data file is in block format
+        :param path: path to data file
+    """
+    try:
+        with open(path, 'rb') as fin:
+            return fin.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+def compress_block(posts, codec='zlib'):
+    """
+    Pack posts into one compressed block
+        :param posts: list of posts
+        :param codec: name of codec
+        :return: block bytes
+    """
+    compress, _ = _codec(codec)
+    return compress(pickle.dumps(posts, protocol=pickle.HIGHEST_PROTOCOL))
+
+def start_file(path):
+    "Create empty block file, blocks are appended to it and then finish_file writes its index"
+    with open(path, 'wb') as fout:
+        fout.write(MAGIC)
+
+def append_block(fout, block):
+    """
+    Append compressed block to block file opened for append
+        :return: offset and length of block in file
+    """
+    offset = fout.seek(0, os.SEEK_END)
+    fout.write(block)
+    return offset, len(block)
+
+def finish_file(path, codec, blocks):
+    """
+    Write block index of block file
+        :param path: path to block file
+        :param codec: name of codec of blocks
+        :param blocks: list of (offset, length, count of posts) of blocks in order of posts
+    """
+    with open(path, 'ab') as fout:
+        index_offset = fout.seek(0, os.SEEK_END)
+        pickle.dump({'codec': codec, 'blocks': blocks}, fout)
+        fout.write(_FOOTER.pack(index_offset))
+
+class BlockWriter:
+    """
+    Writer of data file in block format: posts are packed by block_size into blocks,
+    compressed independently, so they can be decompressed in parallel, and file ends
+    with index of blocks
+    """
+    def __init__(self, path, block_size=BLOCK_SIZE, codec='zlib'):
+        """
+            :param path: path to new data file
+            :param block_size: count of posts in block
+            :param codec: name of codec (see _codec)
+        """
+        _codec(codec)
+        self.path = path
+        self.block_size = block_size
+        self.codec = codec
+        self.blocks = []
+        self._posts = []
+        start_file(path)
+        self._fout = open(path, 'ab')
+
+    def append(self, post):
+        self._posts.append(post)
+        if len(self._posts) >= self.block_size:
+            self._flush()
+
+    def _flush(self):
+        if self._posts:
+            offset, length = append_block(self._fout, compress_block(self._posts, self.codec))
+            self.blocks.append((offset, length, len(self._posts)))
+            self._posts = []
+
+    def close(self):
+        if self._fout is None:
+            return
+        self._flush()
+        self._fout.close()
+        self._fout = None
+        finish_file(self.path, self.codec, self.blocks)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_index(path):
+    """
+    Read block index of block file
+        :param path: path to block file
+        :return: dict with codec name and list of (offset, length, count of posts) of blocks
+    """
+    with open(path, 'rb') as fin:
+        fin.seek(-_FOOTER.size, os.SEEK_END)
+        index_offset, = _FOOTER.unpack(fin.read(_FOOTER.size))
+        fin.seek(index_offset)
+        return pickle.load(fin)
+
+def _read_block(path, codec, offset, length):
+    # Read and decompress block, file reads and decompression of stdlib codecs release GIL
+    _, decompress = _codec(codec)
+    with open(path, 'rb') as fin:
+        fin.seek(offset)
+        return decompress(fin.read(length))
+
+def iter_blocks(path, workers=1, pool='thread'):
+    """
+    Iterate over posts of block file by blocks. With more than one worker, next blocks are
+    read and decompressed on pool while the current one is used, up to 2*workers blocks
+    in flight; blocks are unpickled by caller and come in order of file
+        :param path: path to block file
+        :param workers: count of workers decompressing blocks
+        :param pool: 'thread' or 'process' pool of workers
+        :return: iterator over lists of posts
+    """
+    index = read_index(path)
+    tasks = [(path, index['codec'], offset, length) for offset, length, _ in index['blocks']]
+    if workers <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield pickle.loads(_read_block(*task))
+    elif pool in ('thread', 'process'):
+        if pool == 'thread':
+            from concurrent.futures import ThreadPoolExecutor
+            executor = ThreadPoolExecutor(workers)
+            submit, result = (lambda *task: executor.submit(_read_block, *task)), lambda future: future.result()
+        else:
+            from billiard import Pool
+            executor = Pool(workers)
+            submit, result = (lambda *task: executor.apply_async(_read_block, task)), lambda future: future.get()
+        try:
+            pending = deque()
+            for task in tasks:
+                if len(pending) >= 2*workers:
+                    yield pickle.loads(result(pending.popleft()))
+                pending.append(submit(*task))
+            while pending:
+                yield pickle.loads(result(pending.popleft()))
+        finally:
+            if pool == 'thread':
+                executor.shutdown(cancel_futures=True)
+            else:
+                executor.terminate()
+                executor.join()
+    else:
+        raise ValueError(f'unknown pool {pool}')
@@ -0,0 +1,164 @@
+import hashlib
+import os
+import pickle
+import re
+import tempfile
+import time
+import zlib
+from urllib.parse import urlparse
+
+# Directory of cache shared by all crawlers and article fetcher
+CACHE_DIR = '.habrating_cache'
+
+# Time to live of cached pages by page class, in seconds
+TTL = {
+    'listing': 30*60,
+    'article': 7*24*60*60,
+    'author': 24*60*60,
+    'other': 60*60
+}
+
+_ARTICLE_PATH_RE = re.compile(r'/\d+/?$')
+
+# Headers, which describe body as received, not decoded body kept in cache
+_ENCODING_HEADERS = ('content-encoding', 'content-length')
+
+def page_class(url):
+    """
+    Classify habrahabr page by its url
+        :param url: page url
+        :return: one of TTL keys
+    """
+    path = urlparse(url).path
+    if path.startswith('/hub/'):
+        return 'listing'
+    if path.startswith('/users/'):
+        return 'author'
+    if _ARTICLE_PATH_RE.search(path):
+        return 'article'
+    return 'other'
+
+def _header_name(name):
+    return (name.decode('latin-1') if isinstance(name, bytes) else name).lower()
+
+def _header_values(headers, name):
+    """
+    Get values of header
+        :param headers: dict of headers with str or bytes names, values are str, bytes or
+        lists of them (as in scrapy Headers)
+        :param name: lowercase header name
+        :return: list of str values
+    """
+    values = []
+    for key, value in headers.items():
+        if _header_name(key) == name:
+            for item in value if isinstance(value, (list, tuple)) else [value]:
+                values.append(item.decode('latin-1') if isinstance(item, bytes) else item)
+    return values
+
+def _decompress(encoding, body):
+    if encoding in ('gzip', 'x-gzip'):
+        # Handles concatenated gzip members too
+        return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(body)
+    if encoding == 'deflate':
+        # Some servers send raw deflate stream without zlib header
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    if encoding == 'br':
+        try:
+            import brotli
+        except ImportError:
+            raise ValueError('content encoding br needs brotli package') from None
+        return brotli.decompress(body)
+    if encoding == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError('content encoding zstd needs zstandard package') from None
+        return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    if encoding == 'identity':
+        return body
+    raise ValueError(f'unknown content encoding {encoding}')
+
+def decode_body(body, headers):
+    """
+    Decode response body as received by its Content-Encoding header. Cache keeps decoded
+    bodies only, so scrapy, which caches responses before decompressing them, decodes them first
+        :param body: response body bytes as received
+        :param headers: response headers (see _header_values)
+        :return: decoded body bytes
+    """
+    encodings = [encoding.strip().lower() for value in _header_values(headers, 'content-encoding')
+        for encoding in value.split(',') if encoding.strip()]
+    # Encodings are listed in order they were applied
+    for encoding in reversed(encodings):
+        try:
+            body = _decompress(encoding, body)
+        except (zlib.error, OSError) as e:
+            raise ValueError(f'broken {encoding} body: {repr(e)}') from None
+    return body
+
+class ResponseCache:
+    """
+    On-disk cache of HTTP responses keyed by url, with time to live by page class
+    """
+    def __init__(self, cache_dir=None, ttl=None):
+        """
+            :param cache_dir: cache directory, CACHE_DIR by default
+            :param ttl: dict with time to live by page class, TTL by default
+        """
+        self.cache_dir = cache_dir or CACHE_DIR
+        self.ttl = ttl or TTL
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, url):
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def get(self, url):
+        """
+        Get cached response
+            :param url: requested url
+            :return: dict with 'url', 'status', 'headers' and 'body' (decoded) fields or None if not
+            cached or expired
+        """
+        try:
+            with open(self._path(url), 'rb') as fin:
+                entry = pickle.load(fin)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            entry = None
+        # Entries with Content-Encoding are written before bodies were decoded, whether their
+        # body is encoded is unknown
+        if (entry is None or time.time() - entry['time'] > self.ttl[page_class(url)]
+                or _header_values(entry['headers'], 'content-encoding')):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, url, body, status=200, headers=None, response_url=None):
+        """
+        Store response in cache
+            :param url: requested url
+            :param body: decoded response body bytes (see decode_body)
+            :param status: response HTTP status
+            :param headers: response headers, Content-Encoding and Content-Length are dropped
+            :param response_url: url of response, if differs from requested one (after redirect)
+        """
+        path = self._path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {
+            'url': response_url or url,
+            'status': status,
+            'headers': {name: value for name, value in (headers or {}).items()
+                if _header_name(name) not in _ENCODING_HEADERS},
+            'body': body,
+            'time': time.time()
+        }
+        # Write to temporary file first, so concurrent readers never see partial entry
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as fout:
+            pickle.dump(entry, fout)
+        os.replace(fout.name, path)
@@ -1,10 +1,15 @@
-import asyncio
+import contextlib
+import os
 import pickle
-import progressbar
 import numpy as np
-from sklearn.feature_extraction.text import CountVectorizer
+from collections import deque
+from scipy import sparse as sp
 
+from . import blockfile
 from . import logger
+from . import metrics
+from . import store
+from . import tokencache
 from . import utils
 
 def init_db(path_to_file):
@@ -16,6 +21,7 @@ def init_db(path_to_file):
     try:
         file = open(path_to_file, 'wb')
         file.close()
+        _remove_index(path_to_file)
     except Exception as e:
         logger.warning(f'error: {repr(e)}')
 
@@ -34,99 +40,388 @@ def append_db(data, path_to_file, open_stream = None):
     except Exception as e:
         logger.warning(f'error: {repr(e)}')
 
-def save_db(data, path_to_file):
+def save_db(data, path_to_file, block_size=None, codec='zlib'):
     """
     Save all post into data file
         :param data: array with parsed post data
         :param path_to_file: path to data file
+        :param block_size: if set, save data file in block format (see blockfile module)
+        with block_size posts in every compressed block
+        :param codec: codec of blocks, e.g. 'zlib' or 'lzma' (see blockfile._codec)
     """
     try:
-        with open(path_to_file, 'wb') as fout:
-            for post in data:
-                append_db(post, None, open_stream=fout)
+        if block_size:
+            with blockfile.BlockWriter(path_to_file, block_size, codec) as writer:
+                for post in data:
+                    writer.append(post)
+        else:
+            with open(path_to_file, 'wb') as fout:
+                for post in data:
+                    append_db(post, None, open_stream=fout)
+        _remove_index(path_to_file)
     except Exception as e:
         logger.warning(f'error: {repr(e)}')
 
-def load_db(path_to_file):
+def _remove_index(path_to_file):
+    # Data file was rewritten, so offsets in its store index are no longer valid
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path_to_file + store.INDEX_SUFFIX)
+
+# Numeric post fields in order of model features (the order HabrHubSpider emits them)
+FEATURE_KEYS = ['year', 'body length', 'company rating', 'comments', 'views', 'bookmarks',
+    'author karma', 'author rating', 'author followers']
+
+class DbShards:
+    """
+    Header of a logical data file, whose posts are stored in several shard files
+    """
+    def __init__(self, shards):
+        """
+            :param shards: names of shard files, relative to the directory of the header file
+        """
+        self.shards = shards
+
+def iter_db(path_to_file, batch_size=None, workers=1):
+    """
+    Lazily iterate over parsed data from data file, keeping only
+    the current post (or batch of posts) in memory. Sharded data files
+    are read transparently as one data file, and bodies kept in shared
+    article store are read from it
+        :param path_to_file: path to data file
+        :param batch_size: if set, yield lists of up to batch_size posts instead of single posts
+        :param workers: count of threads decompressing next blocks of data files in block format
+    """
+    posts = resolve_bodies(_iter_posts(path_to_file, workers), path_to_file)
+    if batch_size is None:
+        yield from posts
+    else:
+        yield from utils.batches(posts, batch_size)
+
+def _iter_posts(path_to_file, workers=1):
+    if blockfile.is_block_file(path_to_file):
+        for block in blockfile.iter_blocks(path_to_file, workers):
+            yield from block
+        return
+    if os.path.exists(path_to_file + store.INDEX_SUFFIX):
+        # Indexed store may contain replaced records, so read only live ones
+        with store.PostStore(path_to_file) as post_store:
+            yield from post_store
+        return
+    with open(path_to_file, 'rb') as fin:
+        for index, post in enumerate(_iter_pickle_stream(fin)):
+            if index == 0 and isinstance(post, DbShards):
+                shards_dir = os.path.dirname(path_to_file)
+                for shard in post.shards:
+                    yield from _iter_posts(os.path.join(shards_dir, shard), workers)
+            else:
+                yield post
+
+def resolve_bodies(posts, path_to_file):
+    """
+    Replace references to bodies in shared article store (see store.ArticleStore) by bodies
+        :param posts: iterable of posts of data file
+        :param path_to_file: path to data file, whose directory holds its article store
+    """
+    article_store = None
+    try:
+        for post in posts:
+            if isinstance(post.get('body'), store.BodyRef):
+                if article_store is None:
+                    article_store = store.ArticleStore(store.article_store_path(path_to_file))
+                post['body'] = article_store.get(post['body'])
+            yield post
+    finally:
+        if article_store is not None:
+            article_store.close()
+
+def share_bodies(path_to_file):
+    """
+    Move bodies of data file to article store shared with other data files of its directory
+        :param path_to_file: path to data file
+        :return: count of bodies, which were not in article store yet
+    """
+    block_file = blockfile.is_block_file(path_to_file)
+    posts = load_db(path_to_file)
+    with store.ArticleStore(store.article_store_path(path_to_file)) as article_store:
+        known = len(article_store)
+        for post in posts:
+            post['body'] = article_store.put(post['body'])
+        added = len(article_store) - known
+    if block_file:
+        save_db(posts, path_to_file, blockfile.BLOCK_SIZE, blockfile.read_index(path_to_file)['codec'])
+    else:
+        save_db(posts, path_to_file)
+    return added
+
+def _iter_pickle_stream(fin):
+    while True:
+        try:
+            yield pickle.load(fin)
+        except EOFError:
+            break
+
+def load_db(path_to_file, workers=1):
     """
     Load all parsed data from data file
         :param path_to_file: path to data file
+        :param workers: count of threads decompressing blocks of data files in block format
     """
     try:
-        with open(path_to_file,'rb') as fin:
-            data = []
-            loaded = 0
-            bar = progressbar.ProgressBar(
-                widgets=
-                    [
-                    '[Loading db]',
-                    progressbar.Counter(format='[loaded %s entries]')
-                    ],
-                maxval=progressbar.UnknownLength)
-            bar.start()
-            while True:
-                try:
-                    data.append(pickle.load(fin))
-                    loaded += 1
-                    bar.update(loaded)
-                except EOFError:
-                    break 
+        data = []
+        with metrics.stage('load') as load_stage:
+            bar = utils.get_bar(None, title='[Loading db]').start()
+            for post in iter_db(path_to_file, workers=workers):
+                data.append(post)
+                bar.update(len(data))
             bar.finish()
-            logger.info(f'load {len(data)} posts data')
-            return data
+            load_stage.items = len(data)
+        return data
     except Exception as e:
         logger.warning(f'error: {repr(e)}')
 
 def _fit_text_transformers(data, cutoff=2, text_max_size=20000, title_max_size=500):
     """
     Create word space from parsed article data
-        :param data: list of article texts
+        :param data: list of parsed posts, path to data file to stream posts from,
+        or token counts of data file (see tokencache.token_counts), so texts are not tokenized
         :param cutoff: minimal entries count for a word to go to dict
         :param max_size: maximal dimension of word space. If equals -1, dimension unlimied
         :return: dict mapping word to its index in word space vector
     """
-    textes = [post['body'] for post in data]
-    titles = [post['title'] for post in data]
+    from sklearn.feature_extraction.text import CountVectorizer
+    if isinstance(data, tokencache.TokenCounts):
+        return data.fit_vectorizers(cutoff, text_max_size, title_max_size)
+    if isinstance(data, str):
+        # Stream the file once per field instead of holding all texts at once
+        textes = (post['body'] for post in iter_db(data))
+        titles = (post['title'] for post in iter_db(data))
+    else:
+        textes = [post['body'] for post in data]
+        titles = [post['title'] for post in data]
     body_transformer = CountVectorizer(max_features=text_max_size, dtype=np.int8, min_df=cutoff)
     title_transformer = CountVectorizer(max_features=title_max_size, dtype=np.int8, min_df=cutoff)
     body_transformer.fit(textes)
     title_transformer.fit(titles)
     return body_transformer, title_transformer
 
-def vectorize_post(post, body_vectorizer, title_vectorizer):
+def _hashing_text_transformers(text_size=2**15, title_size=2**9):
+    """
+    Create word space by hashing of words: it needs no fit pass over posts
+    and its state is only a few parameters
+        :param text_size: dimension of post body word space
+        :param title_size: dimension of post title word space
+        :return: vectorizers for post body and title
+    """
+    from sklearn.feature_extraction.text import HashingVectorizer
+    # Plain word counts, as CountVectorizer gives
+    body_transformer = HashingVectorizer(n_features=text_size, dtype=np.int8, alternate_sign=False, norm=None)
+    title_transformer = HashingVectorizer(n_features=title_size, dtype=np.int8, alternate_sign=False, norm=None)
+    return body_transformer, title_transformer
+
+def make_text_transformers(data, feature_space='count', fit_params=None):
+    """
+    Create vectorizers for post body and title
+        :param data: list of parsed posts, path to data file to stream posts from or its token counts
+        :param feature_space: 'count' to fit vocabularies of words on data, 'hashing' to hash words
+        into fixed size spaces (data is not read then)
+        :param fit_params: dict of cutoff, text_max_size and title_max_size of vocabularies
+        (see _fit_text_transformers), defaults if None
+    """
+    if feature_space == 'count':
+        return _fit_text_transformers(data, **(fit_params or {}))
+    if feature_space == 'hashing':
+        return _hashing_text_transformers()
+    raise ValueError(f'unknown feature space {feature_space}')
+
+def vectorize_post(post, body_vectorizer, title_vectorizer, sparse=False):
     """
     Vectorize post title and data
         :param post: post parsed data
         :param body_vectorizer: trained vectorizer for post body
         :param title_vectorizer: trained vectorizer for post title
+        :param sparse: if True, keep vectors as scipy.sparse CSR rows instead of dense arrays
+    """
+    vectorize_posts([post], body_vectorizer, title_vectorizer, sparse)
+
+def vectorize_posts(posts, body_vectorizer, title_vectorizer, sparse=False, token_counts=None, first=0):
+    """
+    Vectorize titles and data of a batch of posts with one transform call per field
+        :param posts: list of post parsed data
+        :param body_vectorizer: trained vectorizer for post body
+        :param title_vectorizer: trained vectorizer for post title
+        :param sparse: if True, keep vectors as scipy.sparse CSR rows instead of dense arrays
+        :param token_counts: token counts of data file of posts (see tokencache.token_counts),
+        to take counts of words from instead of tokenizing texts again
+        :param first: index of the first of posts in data file
     """
-    post['body'] = body_vectorizer.transform([post['body']]).toarray()[0]
-    post['title'] = title_vectorizer.transform([post['title']]).toarray()[0]
+    if token_counts is None:
+        bodies = body_vectorizer.transform([post['body'] for post in posts])
+        titles = title_vectorizer.transform([post['title'] for post in posts])
+    else:
+        bodies = token_counts.body.transform(body_vectorizer, first, first + len(posts))
+        titles = token_counts.title.transform(title_vectorizer, first, first + len(posts))
+    if not sparse:
+        bodies = bodies.toarray()
+        titles = titles.toarray()
+    for post, body, title in zip(posts, bodies, titles):
+        post['body'] = body
+        post['title'] = title
 
 def cvt_text_db_to_vec_db(path_to_text_file, path_to_vectorize_file, path_to_words_space_file,
-        operations=2, start_index=1):
+        operations=2, start_index=1, sparse=False, batch_size=1000, workers=1, feature_space='count',
+        block_size=None, codec='zlib', token_cache=True, fit_params=None):
     """
-    Read all data from hub data file, transform each post data text
+    Stream all data from hub data file, transform each post data text
     to vector in word spaces and save result as new data file.
         :param path_to_text_file: path to text data file
         :param path_to_vectorize_file: path to new data file with vectorize hub data
-	    :param disable_words_limit: if True, then disable limit on words space
+        :param path_to_words_space_file: path to file for trained vectorizers
+        :param sparse: if True, store post vectors as scipy.sparse CSR rows
+        :param feature_space: 'count' to fit vocabularies of words on text data file first,
+        'hashing' to hash words into fixed size spaces without fit pass
+        :param batch_size: count of posts vectorized by one transform call
+        :param workers: count of worker processes. If more than 1, posts are vectorized in parallel
+        and stored in shard files next to path_to_vectorize_file, which becomes their header.
+        With token cache, posts are vectorized by this process and workers only write shards
+        :param block_size: if set, store vectorized posts in block format (see save_db) with block_size
+        posts in every block. Shard files of parallel vectorization are in block format then too,
+        with one block per batch of batch_size posts
+        :param codec: codec of blocks
+        :param token_cache: if True and feature_space is 'count', vocabularies are selected and posts
+        are vectorized by token counts of text data file, cached next to it (see tokencache.token_counts),
+        so texts are tokenized only once for every content of text data file
+        :param fit_params: parameters of vocabularies (see make_text_transformers)
     """
-    all_data = load_db(path_to_text_file)
     print(f'[{start_index}/{operations}]')
-    print('Long sklearn operation without any verbose output')
-    body_vectorizer, title_vectorizer = _fit_text_transformers(all_data)
+    token_counts = None
+    if feature_space == 'count':
+        if token_cache:
+            print('Counting words of bodies and titles or loading cached counts (no progress output)')
+            with metrics.stage('token counts') as counts_stage:
+                token_counts = tokencache.token_counts(path_to_text_file)
+                counts_stage.items = len(token_counts)
+        print('Fitting word vocabularies of bodies and titles (no progress output)')
+    with metrics.stage('fit vectorizers', feature_space=feature_space):
+        body_vectorizer, title_vectorizer = make_text_transformers(token_counts or path_to_text_file, feature_space,
+            fit_params)
     print(f'[{start_index+1}/{operations}]')
-    bar = utils.get_bar(len(all_data)).start()
-    with open(path_to_vectorize_file,'wb') as fout:
-        for index, post in enumerate(all_data):
-            vectorize_post(post, body_vectorizer, title_vectorizer)
-            append_db(post, path_to_vectorize_file, fout)
-            bar.update(index)
-    bar.finish()
+    with metrics.stage('vectorize', workers=workers, sparse=sparse) as vectorize_stage:
+        bar = utils.get_bar(None).start()
+        if workers > 1:
+            count = _vectorize_db_parallel(path_to_text_file, path_to_vectorize_file,
+                body_vectorizer, title_vectorizer, sparse, batch_size, workers, bar, codec if block_size else None,
+                token_counts)
+        else:
+            count = 0
+            if block_size:
+                writer = blockfile.BlockWriter(path_to_vectorize_file, block_size, codec)
+                append = writer.append
+            else:
+                writer = open(path_to_vectorize_file,'wb')
+                append = lambda post: append_db(post, path_to_vectorize_file, writer)
+            with writer:
+                for batch in iter_db(path_to_text_file, batch_size):
+                    vectorize_posts(batch, body_vectorizer, title_vectorizer, sparse, token_counts, count)
+                    for post in batch:
+                        append(post)
+                    count += len(batch)
+                    bar.update(count)
+        bar.finish()
+        vectorize_stage.items = count
 
     save_hub_vectorizers(path_to_words_space_file, body_vectorizer, title_vectorizer)
 
+_worker_state = {}
+
+def _init_vectorize_worker(shard_paths, shard_counter, body_vectorizer, title_vectorizer, sparse, codec):
+    # Every worker process claims its own shard file, so workers never write to the same file
+    with shard_counter.get_lock():
+        shard_index = shard_counter.value
+        shard_counter.value += 1
+    _worker_state['shard'] = shard_index
+    _worker_state['fout'] = open(shard_paths[shard_index], 'ab')
+    _worker_state['vectorizers'] = (body_vectorizer, title_vectorizer)
+    _worker_state['sparse'] = sparse
+    _worker_state['codec'] = codec
+
+def _vectorize_batch_to_shard(batch, vectorized=False):
+    """
+    Vectorize batch (unless it is vectorized already) and append it to shard file of worker
+        :return: count of posts, and for shards in block format index of shard and (offset, length,
+        count of posts) of written block
+    """
+    if not vectorized:
+        body_vectorizer, title_vectorizer = _worker_state['vectorizers']
+        vectorize_posts(batch, body_vectorizer, title_vectorizer, _worker_state['sparse'])
+    fout = _worker_state['fout']
+    block = None
+    if _worker_state['codec']:
+        offset, length = blockfile.append_block(fout, blockfile.compress_block(batch, _worker_state['codec']))
+        block = (_worker_state['shard'], (offset, length, len(batch)))
+    else:
+        for post in batch:
+            append_db(post, None, fout)
+    fout.flush()
+    return len(batch), block
+
+def _vectorize_db_parallel(path_to_text_file, path_to_vectorize_file, body_vectorizer, title_vectorizer,
+        sparse, batch_size, workers, bar, codec=None, token_counts=None):
+    """
+    Vectorize text data file on worker processes into shard files and write header
+    of the sharded data file to path_to_vectorize_file
+        :param codec: if set, shard files are in block format with blocks compressed by codec
+        :param token_counts: if set, batches are vectorized by token counts of text data file
+        here (it is only slicing of counts) and workers only write them
+        :return: count of vectorized posts
+    """
+    from billiard import Pool, Value
+    shard_names = [f'{os.path.basename(path_to_vectorize_file)}.part{index}' for index in range(workers)]
+    shard_paths = [os.path.join(os.path.dirname(path_to_vectorize_file), name) for name in shard_names]
+    for shard_path in shard_paths:
+        init_db(shard_path)
+        if codec:
+            blockfile.start_file(shard_path)
+
+    count = 0
+    shard_blocks = [[] for _ in shard_paths]
+    def collect(result):
+        posts, block = result
+        if block is not None:
+            shard_blocks[block[0]].append(block[1])
+        return posts
+
+    pending = deque()
+    pool = Pool(workers, initializer=_init_vectorize_worker,
+        initargs=(shard_paths, Value('i', 0), body_vectorizer, title_vectorizer, sparse, codec))
+    try:
+        read = 0
+        for batch in iter_db(path_to_text_file, batch_size):
+            if token_counts is not None:
+                vectorize_posts(batch, body_vectorizer, title_vectorizer, sparse, token_counts, read)
+            read += len(batch)
+            # Bound count of batches in flight, so the text db is not read into memory ahead of workers
+            if len(pending) >= 2*workers:
+                count += collect(pending.popleft().get())
+                bar.update(count)
+            pending.append(pool.apply_async(_vectorize_batch_to_shard, (batch, token_counts is not None)))
+        while pending:
+            count += collect(pending.popleft().get())
+            bar.update(count)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    if codec:
+        # Blocks of a shard are in order of offsets, as its worker appended them
+        for shard_path, blocks in zip(shard_paths, shard_blocks):
+            blockfile.finish_file(shard_path, codec, sorted(blocks))
+    with open(path_to_vectorize_file, 'wb') as fout:
+        pickle.dump(DbShards(shard_names), fout)
+    return count
+
 def save_hub_vectorizers(file_path, body_vectorizer, title_vectorizer):
     """
     Save title and body vectorizers into one file
@@ -148,20 +443,54 @@ def load_hub_vectorizers(vectorizers_file_path):
         title_vectorizer = pickle.load(fin)
     return body_vectorizer, title_vectorizer
 
-def cvt_db_to_DataFrames(path_to_db):
+def cvt_db_to_DataFrames(path_to_db, batch_size=1000, workers=1):
     """
     Load saved vectorized parsed data and convert to X and y for model training
         :param path_to_db: path to saved data
+        :param batch_size: count of posts held as python objects at once while building X
+        :param workers: count of threads decompressing blocks of data files in block format
+    """
+    X_parts, y_parts = [], []
+    for X, y in iter_DataFrames(path_to_db, batch_size, workers):
+        X_parts.append(X)
+        y_parts.append(y)
+    if sp.issparse(X_parts[0]):
+        X = sp.vstack(X_parts, format='csr')
+    else:
+        X = np.concatenate(X_parts)
+    return X, np.concatenate(y_parts)
+
+def iter_DataFrames(path_to_db, batch_size=1000, workers=1):
+    """
+    Stream saved vectorized parsed data as X and y chunks of up to batch_size posts
+        :param path_to_db: path to saved data
+        :param batch_size: count of posts in one chunk
+        :param workers: count of threads decompressing blocks of data files in block format
     """
-    data = load_db(path_to_db)
-    return cvt_to_DataFrames(data)
+    for batch in iter_db(path_to_db, batch_size, workers):
+        yield cvt_to_DataFrames(batch)
+
+def _feature_keys(post):
+    # Fixed order makes features independent of order of post dict keys (e.g. in posts made by GUI)
+    keys = [key for key in FEATURE_KEYS if key in post]
+    keys += [key for key in post.keys() if key not in keys and key not in ['rating', 'body', 'title', 'url']]
+    return keys
 
 def cvt_to_DataFrames(data):
     """
-    Convert array of vectorize parsed post data to X (features data) and y (target data)
+    Convert array of vectorize parsed post data to X (features data) and y (target data).
+    If posts were vectorized in sparse mode, X is a scipy.sparse CSR matrix
         :param data: array of vectorize parsed post data
     """
-    feature_keys = [key for key in data[0].keys() if key not in ['rating', 'body', 'title']]
+    feature_keys = _feature_keys(data[0])
+    y = np.asarray([d['rating'] for d in data], dtype=np.float32)
+    if sp.issparse(data[0]['body']):
+        features = np.asarray([[d[key] for key in feature_keys] for d in data], dtype=np.float32)
+        X = sp.hstack([
+            sp.vstack([d['body'] for d in data]),
+            sp.vstack([d['title'] for d in data]),
+            sp.csr_matrix(features)
+        ], format='csr', dtype=np.float32)
+        return X, y
     X = [np.concatenate([d['body'], d['title'], [d[key] for key in feature_keys]]) for d in data]
-    y = [d['rating'] for d in data]
-    return np.asarray(X, dtype=np.float32), np.asarray(y,dtype=np.float32)
+    return np.asarray(X, dtype=np.float32), y
@@ -0,0 +1,154 @@
+import datetime
+import re
+from lxml import etree
+
+# Class of post elements -> post field, extracted from text of the first such element
+_POST_FIELDS = {
+    ('span', 'post__time'): 'time',
+    ('span', 'post__title-text'): 'title',
+    ('div', 'post__text post__text-html js-mediator-article'): 'body',
+    ('sup', 'page-header__stats-value page-header__stats-value_branding'): 'company rating',
+    ('strong', 'comments-section__head-counter'): 'comments',
+    ('span', 'post-stats__views-count'): 'views',
+    ('span', 'bookmark__counter js-favs_count'): 'bookmarks',
+    ('span', 'user-info__nickname user-info__nickname_small'): 'author'
+}
+_POST_TAGS = sorted({tag for tag, _ in _POST_FIELDS})
+_TITLE_PARENT_CLASS = 'post__title post__title_full'
+_RATING_CLASS = 'voting-wjt__counter'
+_AUTHOR_COUNTERS_XPATH = etree.XPath('//div[contains(@class, "stacked-counter__value")]/text()')
+_AUTHOR_STATUS_XPATH = etree.XPath('//sup[@class="author-info__status"]/text()')
+# Text of article body without code, tails of code elements are text of article
+_BODY_TEXT_XPATH = etree.XPath('.//text()[not(ancestor::code)]')
+
+_COUNT_RE = re.compile(r'([0-9]+\,[0-9]|[0-9]+)(k|m)?')
+_COUNT_MULTIPLIERS = {None: 1, 'k': 1000, 'm': 1000000}
+
+_HTML_PARSER = etree.HTMLParser(encoding='utf-8')
+
+def parse_html(body):
+    """
+    Parse html page
+        :param body: page body (bytes in utf-8)
+        :return: html tree of page
+    """
+    return etree.fromstring(body, _HTML_PARSER)
+
+def normalize_views_count(views_string):
+    """
+    Transform views count (given as a string) from
+    habrahabr's format to an integer
+    Example: '3k' -> 3000, '10' -> 10, '3,2k' -> 3200
+        :param views_string: view count in habr's format
+        :return: views count
+        :rtype: int
+    """
+    r = _COUNT_RE.search(views_string)
+    # if number part of string is float, replace ',' to '.' (different float notation)
+    num_part = float(r.group(1).replace(',', '.'))
+    try:
+        return int(num_part*_COUNT_MULTIPLIERS[r.group(2)])
+    except ValueError:
+        return None
+
+def normalize_rating(rating_string):
+    """
+    Transform rating representation to number
+        :param rating_string: string with rating
+    """
+    return int(rating_string.replace('–', '-'))
+
+def normalize_company_rating(company_rating_string):
+    if company_rating_string is None:
+        return 0.0
+    return float(company_rating_string.replace(',', '.').replace(' ', ''))
+
+def year_from_date(date_string):
+    """
+    Get year of post from its date in habr's format, e.g. '5 марта 2017 в 10:00' or 'вчера в 10:00'
+        :param date_string: date of post
+    """
+    is_writed_yesterday = 'вчера' in date_string
+    is_writed_today = 'сегодня' in date_string
+    is_writed_in_this_year = date_string.split(' ')[2] == 'в'
+    if is_writed_in_this_year or is_writed_today or is_writed_yesterday:
+        return datetime.datetime.now().year
+    return int(date_string.split(' ')[2])
+
+def body_to_text(body):
+    """
+    Transform html tree of article body to plain normalize text (ignoring code)
+        :param body: html tree of article body
+        :return: plain text of article
+        :rtype: string
+    """
+    return ''.join(_BODY_TEXT_XPATH(body)).lower()
+
+def _first_text(element):
+    # First text node inside element, as '::text' css selector gives
+    if element.text is not None:
+        return element.text
+    for child in element:
+        if child.tail is not None:
+            return child.tail
+    return None
+
+def extract_post(root, url):
+    """
+    Extract post data, except author stats, from article page
+        :param root: html tree of article page
+        :param url: article url, used as article key in post store
+        :return: post data and nickname of post author
+    """
+    # One pass over elements of post tags (it is faster than query per field, as every query
+    # walks the whole page), the first element of every field in document order wins
+    found = {}
+    for element in root.iter(*_POST_TAGS):
+        class_name = element.get('class')
+        if class_name is None:
+            continue
+        field = _POST_FIELDS.get((element.tag, class_name))
+        if field is None:
+            if element.tag != 'span' or _RATING_CLASS not in class_name:
+                continue
+            field = 'rating'
+        elif field == 'title' and not any(parent.get('class') == _TITLE_PARENT_CLASS
+                for parent in element.iterancestors('h1')):
+            continue
+        if field not in found:
+            found[field] = element
+
+    def text(field):
+        return _first_text(found[field]) if field in found else None
+
+    post = {}
+    post['url'] = url
+    # TODO year filter
+    post['year'] = year_from_date(text('time').lstrip())
+    post['title'] = text('title')
+    post['body'] = body_to_text(found['body'])
+    post['body length'] = len(post['body'])
+    post['company rating'] = normalize_company_rating(text('company rating'))
+    post['rating'] = normalize_rating(text('rating'))
+    post['comments'] = int(text('comments'))
+    post['views'] = normalize_views_count(text('views'))
+    post['bookmarks'] = int(text('bookmarks'))
+    return post, text('author')
+
+def extract_author_stats(root):
+    """
+    Extract author karma, rating and followers from author page
+        :param root: html tree of author page
+        :return: dict with author stats post fields
+    """
+    author_parameters = _AUTHOR_COUNTERS_XPATH(root)
+    if len(author_parameters) == 3:
+        return {
+            'author karma': normalize_views_count(author_parameters[0]),
+            'author rating': normalize_views_count(author_parameters[1]),
+            'author followers': normalize_views_count(author_parameters[2])
+        }
+    author_status = _AUTHOR_STATUS_XPATH(root)
+    if author_status and author_status[0] == 'read-only':
+        return {'author karma': 0, 'author rating': 0, 'author followers': 0}
+    raise RuntimeError(f'problem with tags of data showings: {author_parameters}, {author_status}')
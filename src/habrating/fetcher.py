@@ -0,0 +1,121 @@
+import asyncio
+import atexit
+import threading
+import time
+from urllib.parse import urljoin
+import aiohttp
+
+from . import cache
+from . import extractor
+from . import logger
+
+class ArticleFetcher:
+    """
+    Long-lived in-process fetcher, which downloads and parses many articles concurrently.
+    It runs its own asyncio event loop in a background thread and keeps one pool of
+    HTTP connections for all calls. Extraction is done by extractor module (as in spiders),
+    pages go through shared response cache and author stats are memoized between calls
+    """
+    def __init__(self, concurrency=16, timeout=30, retries=3):
+        """
+            :param concurrency: maximal count of simultaneous connections
+            :param timeout: total timeout of one HTTP request in seconds
+            :param retries: count of retries of failed HTTP request
+        """
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.cache = cache.ResponseCache()
+        # author -> (time of request, future with author stats)
+        self._authors = {}
+        self._session = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='ArticleFetcher', daemon=True)
+        self._thread.start()
+
+    def parse_articles(self, urls):
+        """
+        Download and parse articles concurrently
+            :param urls: article urls
+            :return: list of parsed post data, in order of urls
+        """
+        return asyncio.run_coroutine_threadsafe(self.parse_articles_async(urls), self._loop).result()
+
+    def submit(self, urls):
+        """
+        Start parsing of articles without waiting for result
+            :param urls: article urls
+            :return: concurrent.futures.Future with list of parsed post data
+        """
+        return asyncio.run_coroutine_threadsafe(self.parse_articles_async(urls), self._loop)
+
+    async def parse_articles_async(self, urls):
+        return await asyncio.gather(*[self._parse_article(url) for url in urls])
+
+    def close(self):
+        "Close connections and stop event loop of fetcher"
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+            self._session = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    async def _get_session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.concurrency)
+            self._session = aiohttp.ClientSession(connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def _fetch(self, url):
+        "Return url of response (after redirects) and its html tree"
+        entry = self.cache.get(url)
+        # Crawls cache redirects too, they are fetched again here
+        if entry is not None and entry['status'] == 200:
+            return entry['url'], extractor.parse_html(entry['body'])
+        session = await self._get_session()
+        for attempt in range(self.retries + 1):
+            try:
+                async with session.get(url) as response:
+                    response.raise_for_status()
+                    body = await response.read()
+                    self.cache.put(url, body, response.status, dict(response.headers), str(response.url))
+                    return str(response.url), extractor.parse_html(body)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.retries:
+                    raise
+                logger.info(f'retry {url} after {repr(e)}')
+
+    async def _parse_article(self, url):
+        response_url, root = await self._fetch(url)
+        post, author = extractor.extract_post(root, response_url)
+        # Author page is on the same site as the article
+        post.update(await self._author_stats(author, urljoin(response_url, f'/users/{author}')))
+        return post
+
+    async def _author_stats(self, author, author_url):
+        # Concurrent articles of the same author share one in-flight request
+        requested = self._authors.get(author)
+        if requested is None or time.time() - requested[0] > cache.TTL['author']:
+            requested = (time.time(), asyncio.ensure_future(self._fetch_author_stats(author_url)))
+            self._authors[author] = requested
+        try:
+            return await requested[1]
+        except Exception:
+            self._authors.pop(author, None)
+            raise
+
+    async def _fetch_author_stats(self, author_url):
+        return extractor.extract_author_stats((await self._fetch(author_url))[1])
+
+_shared_fetcher = None
+_shared_fetcher_lock = threading.Lock()
+
+def get_fetcher():
+    "Return fetcher shared inside current process, creating it on first call"
+    global _shared_fetcher
+    with _shared_fetcher_lock:
+        if _shared_fetcher is None:
+            _shared_fetcher = ArticleFetcher()
+            atexit.register(_shared_fetcher.close)
+        return _shared_fetcher
@@ -1,13 +1,12 @@
 import sys
 import os
 import platform
-from PyQt5.QtCore import Qt, QCoreApplication
+import time
+from PyQt5.QtCore import Qt, QCoreApplication, QObject, QRunnable, QThreadPool, pyqtSignal
 from PyQt5.QtWidgets import QApplication, QMainWindow, QFileDialog
 from PyQt5 import uic
 
 from . import logger
-from . import model
-from . import db
 
 def run_gui ():
     """
@@ -19,6 +18,58 @@ def run_gui ():
     window.show ()
     return app.exec_ ()
     
+def load_model (filename):
+    """
+    Load model from file. Modules for prediction (with numpy and sklearn) are imported
+    on first call, so window shows up before them
+        :param filename: path to model file
+    """
+    from . import model
+    return model.load_model (filename)
+
+class JobSignals (QObject):
+    # result and elapsed time in seconds
+    finished = pyqtSignal (object, float)
+    failed = pyqtSignal (object)
+
+class Job (QRunnable):
+    """
+    Function call, which runs on worker thread pool and reports back through signals.
+    Cancelled job never emits its signals
+    """
+    def __init__ (self, function, *args):
+        """
+            :param function: called as function (job, *args), so it can register cancel callbacks
+        """
+        super (Job, self).__init__ ()
+        self.function = function
+        self.args = args
+        self.signals = JobSignals ()
+        self.cancelled = False
+        self.cancel_callbacks = []
+
+    def on_cancel (self, callback):
+        "Register callback, which interrupts job work on cancel"
+        self.cancel_callbacks.append (callback)
+        if self.cancelled:
+            callback ()
+
+    def cancel (self):
+        self.cancelled = True
+        for callback in self.cancel_callbacks:
+            callback ()
+
+    def run (self):
+        start = time.perf_counter ()
+        try:
+            result = self.function (self, *self.args)
+        except Exception as e:
+            if not self.cancelled:
+                self.signals.failed.emit (e)
+            return
+        if not self.cancelled:
+            self.signals.finished.emit (result, time.perf_counter () - start)
+
 class MainWindow (QMainWindow):
     def __init__ (self):
         super (MainWindow, self).__init__ ()
@@ -39,6 +90,13 @@ class MainWindow (QMainWindow):
         self.predict_button.clicked.connect (self.on_predict_clicked)
         self.tab_widget.currentChanged.connect (self.on_tab_switched)
         
+        # Model loading and predictions run on worker threads, so window never freezes
+        self.thread_pool = QThreadPool.globalInstance ()
+        self.model = None
+        self.load_job = None
+        self.predict_job = None
+        self.predict_button_text = self.predict_button.text ()
+        
         #filename = QFileDialog.getOpenFileName (self, "Select model for prediction", "", "Model files (*.hubmodel)")
         #logger.info ("Selected model file " + filename[0])
         #self.model = model.load_model (filename[0])
@@ -54,9 +112,8 @@ class MainWindow (QMainWindow):
         self.model_selector.addItems (filenames)
         self.model_selector.itemSelectionChanged.connect (self.on_model_selected)
         if len (filenames) == 1:
+            # Preload the only model in background
             self.model_selector.setCurrentRow (0)
-        else:
-            self.model = None
         
     def get_int_from_field (self, field):
         text = field.text ()
@@ -70,50 +127,82 @@ class MainWindow (QMainWindow):
             return float (text)
         return float (field.placeholderText ())
         
-    def predict_url (self, url):
+    def predict_url (self, hub_model, url, job = None):
         """
         Predict rating by URL to article
+            :param hub_model: model selected when prediction was started
             :param url: self-descriptive
+            :param job: if set, cancelling of this job interrupts article download
             :return: estimate rating
         """
+        # Crawling modules (with scrapy) are imported only when URL is predicted
+        from . import fetcher
         logger.info(f"url = {url}")
-        return self.model.predict_by_urls ([url])[0]
+        future = fetcher.get_fetcher ().submit ([url])
+        if job is not None:
+            job.on_cancel (future.cancel)
+        return hub_model.predict_by_posts (future.result ())[0]
     
-    def predict_direct (self, data):
+    def predict_direct (self, hub_model, data):
         """
         Predict rating by directly fed article
+            :param hub_model: model selected when prediction was started
             :param data: dict in default format (with 'title', 'body', etc. fields)
             :return: estimate rating
         """
-        return self.model.predict_by_posts ([data])[0]
+        return hub_model.predict_by_posts ([data])[0]
         
     def on_model_selected (self):
-        try:
-            filename = self.model_selector.currentItem ().text ()
-            logger.info ("Selected " + filename)
-            self.model = model.load_model (filename)
-        except:
-            logger.warn ("Failed selecting model " + filename)
-            self.statusbar.showMessage ("Не удалось загрузить модель!")
+        filename = self.model_selector.currentItem ().text ()
+        logger.info ("Selected " + filename)
+        if self.load_job:
+            self.load_job.cancel ()
+        self.model = None
+        self.statusbar.showMessage (f"Loading model {filename}...")
+        job = Job (lambda job: load_model (filename))
+        job.signals.finished.connect (lambda loaded_model, elapsed: self.on_model_loaded (job, loaded_model, elapsed))
+        job.signals.failed.connect (lambda e: self.on_model_failed (job, filename, e))
+        self.load_job = job
+        self.thread_pool.start (job)
+
+    def on_model_loaded (self, job, loaded_model, elapsed):
+        # Signal of cancelled or replaced job may be delivered after a new job has started
+        if job is not self.load_job:
+            return
+        self.model = loaded_model
+        self.load_job = None
+        logger.info (f"Model of {loaded_model.hub_name} loaded in {elapsed:.2f}s")
+        self.statusbar.showMessage (f"Model loaded in {elapsed:.1f}s. Ready")
+
+    def on_model_failed (self, job, filename, e):
+        if job is not self.load_job:
+            return
+        self.load_job = None
+        logger.warn ("Failed selecting model " + filename + ": " + repr (e))
+        self.statusbar.showMessage ("Не удалось загрузить модель!")
         
     def on_predict_clicked (self):
+        if self.predict_job:
+            # Button works as "Cancel" while prediction is running
+            self.predict_job.cancel ()
+            self.on_predict_done ("Cancelled")
+            return
         if not self.model:
-            self.statusbar.showMessage ("No model selected!")
+            if self.load_job:
+                self.statusbar.showMessage ("Model is still loading, wait a second...")
+            else:
+                self.statusbar.showMessage ("No model selected!")
             return
-        url = self.url_field.text ()
-        self.statusbar.showMessage ("I'm thinking, wait a minute...")
+        # Another model may be selected while job runs, job keeps the current one
+        hub_model = self.model
         if self.tab_widget.currentIndex () == 0:
-            try:
-                logger.info (f"predicting by url {url}")
-                if not url:
-                    self.statusbar.showMessage ("No input")
-                    return
-                score = self.predict_url (url)
-                self.result_field.setText (f"You will get {int (round (score))} point(s)")
-                self.statusbar.showMessage ("Done!")
-            except Exception as e:
-                logger.exception(e)
-                self.statusbar.showMessage ("Error while predicting! (invalid URL or connection failure)")
+            url = self.url_field.text ()
+            logger.info (f"predicting by url {url}")
+            if not url:
+                self.statusbar.showMessage ("No input")
+                return
+            job = Job (lambda job: self.predict_url (hub_model, url, job))
+            error_message = "Error while predicting! (invalid URL or connection failure)"
         else:
             try:
                 logger.info (f"predicting by direct feed")
@@ -132,13 +221,36 @@ class MainWindow (QMainWindow):
                 data['author karma'] = self.get_float_from_field (self.akarma_edit)
                 data['author followers'] = self.get_int_from_field (self.asubs_edit)
                 data['year'] = self.get_int_from_field (self.year_edit)
-                logger.info (f"Input post: {data}")
-                score = self.predict_direct (data)
-                self.result_field.setText (f"You will get {int (round (score))} point(s)")
-                self.statusbar.showMessage ("Done!")
             except ValueError as e:
                 logger.exception(e)
                 self.statusbar.showMessage ("Wrong input! Make sure you write numbers in additional fields")
+                return
+            logger.info (f"Input post: {data}")
+            job = Job (lambda job: self.predict_direct (hub_model, data))
+            error_message = "Error while predicting!"
+        job.signals.finished.connect (lambda score, elapsed: self.on_predicted (job, score, elapsed))
+        job.signals.failed.connect (lambda e: self.on_predict_failed (job, e, error_message))
+        self.predict_job = job
+        self.predict_button.setText ("Cancel")
+        self.statusbar.showMessage ("I'm thinking, wait a minute...")
+        self.thread_pool.start (job)
+
+    def on_predicted (self, job, score, elapsed):
+        if job is not self.predict_job:
+            return
+        self.result_field.setText (f"You will get {int (round (score))} point(s)")
+        self.on_predict_done (f"Done in {elapsed:.1f}s!")
+
+    def on_predict_failed (self, job, e, message):
+        if job is not self.predict_job:
+            return
+        logger.error (message, exc_info = e)
+        self.on_predict_done (message)
+
+    def on_predict_done (self, message):
+        self.predict_job = None
+        self.predict_button.setText (self.predict_button_text)
+        self.statusbar.showMessage (message)
 
     def change_tab_size (self, new_size):
         # Update widgets layout
@@ -0,0 +1,186 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, memory and children cpu time are not measured there
+    resource = None
+
+from . import logger
+
+# Machine-readable metrics file, one JSON record of stage per line
+METRICS_FILE = 'habrating_metrics.jsonl'
+
+# Interval of sampling of resident memory in seconds
+RSS_INTERVAL = 0.01
+
+_MB = 2**20
+
+def current_rss():
+    "Return resident memory of process in bytes (peak one, where current is unknown)"
+    try:
+        with open('/proc/self/statm') as fin:
+            return int(fin.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        if resource is None:
+            return 0
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 2**10
+
+def _children_cpu():
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+class RssPeak:
+    """
+    Context manager, which tracks peak resident memory of process on background thread.
+    Unlike tracemalloc, it doesn't slow measured code down and sees memory allocated by C extensions
+    """
+    def __enter__(self):
+        self.start = self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='RssPeak', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(RSS_INTERVAL):
+            self.peak = max(self.peak, current_rss())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+    def growth(self):
+        "Return growth of peak resident memory over its value at start, in bytes"
+        return self.peak - self.start
+
+_local = threading.local()
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+class Stage:
+    """
+    Measured stage of pipeline (see stage function). After exit its record is in record field
+    """
+    def __init__(self, name, items=None, **fields):
+        self.name = name
+        self.items = items
+        self.fields = fields
+        self.parent = None
+        self.record = None
+
+    @property
+    def path(self):
+        "Names of enclosing stages and of this one, joined by '/'"
+        return self.name if self.parent is None else f'{self.parent.path}/{self.name}'
+
+    def __enter__(self):
+        stack = _stack()
+        self.parent = stack[-1] if stack else None
+        if self.parent is not None:
+            self.fields = {**self.parent.fields, **self.fields}
+        stack.append(self)
+        logger.info(f'stage {self.path} started')
+        self._traced_start = None
+        if tracemalloc.is_tracing():
+            # Peak of enclosing stage is saved before it is reset for this one
+            current, peak = tracemalloc.get_traced_memory()
+            if self.parent is not None and self.parent._traced_start is not None:
+                self.parent._traced_peak = max(self.parent._traced_peak, peak)
+            tracemalloc.reset_peak()
+            self._traced_start = self._traced_peak = current
+        self._rss = RssPeak().__enter__()
+        self._start_time = time.time()
+        self._children_cpu = _children_cpu()
+        self._cpu = time.process_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        children_cpu = _children_cpu() - self._children_cpu
+        self._rss.__exit__()
+        record = {
+            'stage': self.name,
+            'path': self.path,
+            'start': self._start_time,
+            'wall_sec': wall,
+            'cpu_sec': cpu,
+            'children_cpu_sec': children_cpu,
+            'peak_rss_mb': self._rss.growth() / _MB,
+            'items': self.items,
+            'items_per_sec': self.items / max(wall, 1e-9) if self.items is not None else None,
+            'failed': exc_type is not None
+        }
+        if self._traced_start is not None and tracemalloc.is_tracing():
+            self._traced_peak = max(self._traced_peak, tracemalloc.get_traced_memory()[1])
+            record['traced_peak_mb'] = (self._traced_peak - self._traced_start) / _MB
+            if self.parent is not None and self.parent._traced_start is not None:
+                self.parent._traced_peak = max(self.parent._traced_peak, self._traced_peak)
+        record.update(self.fields)
+        _stack().pop()
+        self.record = record
+        for sink in list(sinks):
+            try:
+                sink(record)
+            except Exception as e:
+                logger.warning(f'error: {repr(e)}')
+        return False
+
+def stage(name, items=None, **fields):
+    """
+    Measure named stage of pipeline: wall and cpu time (of process and of its finished children),
+    growth of peak resident memory, peak of memory traced by tracemalloc (if it is tracing,
+    e.g. with PYTHONTRACEMALLOC=1) and count of processed items. Use as
+
+        with metrics.stage('vectorize') as vectorize_stage:
+            ...
+            vectorize_stage.items = count
+
+    Stages may be nested, nested ones inherit fields of enclosing ones. On exit (also by exception)
+    record of stage is passed to every sink
+        :param name: name of stage
+        :param items: count of processed items, may be set later by items field of stage
+        :param fields: extra fields of record (e.g. hub name)
+    """
+    return Stage(name, items, **fields)
+
+def log_sink(record):
+    "Sink writing stage records to habrating log"
+    message = (f'stage {record["path"]} {"failed" if record["failed"] else "done"}: '
+        f'{record["wall_sec"]:.2f}s wall, {record["cpu_sec"]:.2f}s cpu, '
+        f'{record["children_cpu_sec"]:.2f}s cpu of subprocesses, peak RSS +{record["peak_rss_mb"]:.1f}MB')
+    if 'traced_peak_mb' in record:
+        message += f', traced peak {record["traced_peak_mb"]:.1f}MB'
+    if record['items'] is not None:
+        message += f', {record["items"]} items ({record["items_per_sec"]:.1f}/sec)'
+    logger.info(message)
+
+class FileSink:
+    """
+    Sink appending stage records to file as JSON lines
+    """
+    def __init__(self, path):
+        """
+            :param path: path to metrics file
+        """
+        self.path = path
+        self.lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self.lock, open(self.path, 'a', encoding='utf-8') as fout:
+            fout.write(line)
+
+# Callables receiving record of every finished stage. May be changed to plug in other sinks
+sinks = [log_sink, FileSink(METRICS_FILE)]
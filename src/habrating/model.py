@@ -1,46 +1,150 @@
 import pickle
-import asyncio
 import platform
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.utils import shuffle
+import numpy as np
 
-from . import db, parser
+from . import db, logger, metrics, modelfile, utils
 
+def _new_forest(n_estimators=100, n_jobs=-1):
+    from sklearn.ensemble import RandomForestRegressor
+    return RandomForestRegressor(n_estimators = n_estimators, n_jobs=n_jobs, verbose=2)
+
+def _default_model_path(hub_name):
+    # Hub name with extention .hubmodel32 or .hubmodel64 (according computer architecture)
+    arch = platform.architecture()[0].replace('bit','')
+    return hub_name+'.hubmodel'+arch
 
 class HabrHubRatingRegressor:
-    def __init__(self, hub_name):
+    def __init__(self, hub_name, n_jobs=-1):
         """
         Create new rating regressor
             :param hub_name: name of hub for rating regression
+            :param n_jobs: count of threads fitting forest, -1 to use all cores
         """
-        self.estimator = RandomForestRegressor(n_estimators = 100, n_jobs=-1, verbose=2)
+        self._estimator = None
         self.hub_name = hub_name
+        self.n_jobs = n_jobs
         self.text_transformer = None
         self.title_transformer = None
-        
+        # Optional reduction of features between vectorization and estimator (see reducers module)
+        self.reducer = None
+
+    @property
+    def estimator(self):
+        "Regressor of model. New one is created on first access, so loading a model never imports sklearn.ensemble"
+        if self._estimator is None:
+            self._estimator = _new_forest(n_jobs=self.n_jobs)
+        return self._estimator
+
+    @estimator.setter
+    def estimator(self, estimator):
+        self._estimator = estimator
 
     def fit(self, X_train, y_train):
         """
         Fit model
-            :param X_train: features for training
+            :param X_train: features for training (dense array or scipy.sparse matrix)
             :pararm y_train: answers for training
         """
-        self.estimator.fit(X_train, y_train)
+        self.estimator.fit(self._reduce(X_train), y_train)
+
+    def fit_reduced(self, X_train, y_train, reduction, n_features=1000, mae_tolerance=None, validation_part=0.1):
+        """
+        Fit reduction of features and then model on reduced features. Transformers must be set already
+            :param X_train: features for training (dense array or scipy.sparse matrix)
+            :param y_train: answers for training
+            :param reduction: 'select' or 'svd' (see reducers.fit_reducer)
+            :param n_features: count of features after reduction
+            :param mae_tolerance: if set, validation_part of training data is held out and reduced model is kept
+            only if its mean absolute error is at most (1 + mae_tolerance) times the error of model fitted
+            on full features, otherwise the latter one is kept
+            :param validation_part: part of training data held out for error check (data must be shuffled)
+        """
+        from . import reducers
+        text_columns = self.text_transformer.transform(['']).shape[1] + self.title_transformer.transform(['']).shape[1]
+        if mae_tolerance is None:
+            self.reducer = reducers.fit_reducer(X_train, y_train, reduction, n_features, text_columns)
+            self.fit(X_train, y_train)
+            return
+        from sklearn.base import clone
+        valid_size = max(1, int(X_train.shape[0] * validation_part))
+        X_valid, y_valid = X_train[:valid_size], y_train[:valid_size]
+        X_train, y_train = X_train[valid_size:], y_train[valid_size:]
+
+        full_estimator = clone(self.estimator).fit(X_train, y_train)
+        full_mae = np.mean(np.abs(full_estimator.predict(X_valid) - y_valid))
+        reducer = reducers.fit_reducer(X_train, y_train, reduction, n_features, text_columns)
+        reduced_estimator = clone(self.estimator).fit(reducer.transform(X_train), y_train)
+        reduced_mae = np.mean(np.abs(reduced_estimator.predict(reducer.transform(X_valid)) - y_valid))
+        logger.info(f'MAE of full model {full_mae:.3f}, of model with {reduction} reduction {reduced_mae:.3f}')
+        if reduced_mae <= full_mae * (1 + mae_tolerance):
+            self.estimator, self.reducer = reduced_estimator, reducer
+        else:
+            logger.warning(f'{reduction} reduction increases MAE from {full_mae:.3f} to {reduced_mae:.3f}, '
+                'model keeps full features')
+            self.estimator, self.reducer = full_estimator, None
+
+    def _reduce(self, X):
+        if self.reducer is None:
+            return X
+        return self.reducer.transform(X)
+
+    def partial_fit(self, X_train, y_train, n_estimators=10):
+        """
+        Grow model by new trees fitted on a chunk of training data, keeping trees fitted before.
+        Prediction is the mean of all trees, so chunk weight is proportional to count of its trees
+            :param X_train: features of chunk (dense array or scipy.sparse matrix)
+            :param y_train: answers of chunk
+            :param n_estimators: count of new trees
+        """
+        if isinstance(self.estimator, modelfile.MappedForest):
+            # Mapped forest can't be refitted, so new trees are fitted apart and appended to it
+            forest = _new_forest(n_estimators, self.n_jobs)
+            forest.fit(self._reduce(X_train), y_train)
+            self.estimator = self.estimator.extend(modelfile.MappedForest.from_estimator(forest))
+            return
+        fitted = len(getattr(self.estimator, 'estimators_', []))
+        warm_start = self.estimator.warm_start
+        self.estimator.set_params(n_estimators=fitted + n_estimators, warm_start=True)
+        try:
+            self.estimator.fit(self._reduce(X_train), y_train)
+        finally:
+            # Saved model must not keep warm start, or its later fit would keep old trees
+            self.estimator.set_params(warm_start=warm_start)
+
+    def partial_fit_posts(self, posts, batch_size=5000, n_estimators=10):
+        """
+        Grow model by trees fitted on parsed posts batch by batch, so only one batch is held
+        in memory and posts may be streamed from db. Transformers must be set already
+            :param posts: iterable of parsed post data
+            :param batch_size: count of posts in one training chunk
+            :param n_estimators: count of trees fitted on every chunk
+            :return: count of used posts
+        """
+        count = 0
+        bar = utils.get_bar(None, title='[Training]').start()
+        for batch in utils.batches(posts, batch_size):
+            db.vectorize_posts(batch, self.text_transformer, self.title_transformer, sparse=True)
+            X, y = db.cvt_to_DataFrames(batch)
+            self.partial_fit(X, y, n_estimators)
+            count += len(batch)
+            bar.update(count)
+        bar.finish()
+        return count
 
     def predict(self, X):
         """
         Predict answer from features
-            :param X: features data
+            :param X: features data (dense array or scipy.sparse matrix)
         """
-        return self.estimator.predict(X)
+        return self.estimator.predict(self._reduce(X))
 
     def predict_by_urls(self, urls):
         """
         Predict rating from urls
             :param urls: array of url from target hub (must equals to model hub name)
         """
-        loop = asyncio.get_event_loop()
-        posts = list(map(lambda url: parser.parse_article(url), urls))
+        from . import fetcher
+        posts = fetcher.get_fetcher().parse_articles(urls)
         return self.predict_by_posts(posts)
 
     def predict_by_posts(self, posts):
@@ -48,8 +152,8 @@ class HabrHubRatingRegressor:
         Predict rating by posts data
             :param posts: array of parsed post data
         """
-        for post in posts:
-            db.vectorize_post(post, self.text_transformer, self.title_transformer)
+        # Sparse rows give the same features as dense ones, so both kinds of models accept them
+        db.vectorize_posts(posts, self.text_transformer, self.title_transformer, sparse=True)
         X, _ = db.cvt_to_DataFrames(posts)
         y_predict = self.predict(X)
         return y_predict
@@ -68,21 +172,41 @@ class HabrHubRatingRegressor:
             .hubmodel64 (according computer architecture)
         """
         if file_path is None:
-            arch = platform.architecture()[0].replace('bit','')
-            file_path = self.hub_name+'.hubmodel'+arch
+            file_path = _default_model_path(self.hub_name)
         with open(file_path,'wb') as fout:
             pickle.dump(self.estimator,fout)
             pickle.dump(self.hub_name,fout)
             pickle.dump(self.text_transformer, fout)
             pickle.dump(self.title_transformer, fout)
+            pickle.dump(self.reducer, fout)
+
+    def save_mapped(self, file_path = None):
+        """
+        Save model data to file in memory-mappable format (see modelfile module)
+            :param file_path: path to model file. Default name is hub name with extention .hubmodel32.mmap or
+            .hubmodel64.mmap (according computer architecture)
+        """
+        if file_path is None:
+            file_path = _default_model_path(self.hub_name)+'.mmap'
+        modelfile.save(file_path, self.hub_name, self.estimator, self.text_transformer, self.title_transformer,
+            self.reducer)
 
     def load(self, file_path):
-        "Load model data from file"
+        "Load model data from file (pickled or memory-mappable one)"
+        if modelfile.is_mapped_model(file_path):
+            (self.hub_name, self.estimator, self.text_transformer, self.title_transformer,
+                self.reducer) = modelfile.load(file_path)
+            return
         with open(file_path,'rb') as fin:
             self.estimator = pickle.load(fin)
             self.hub_name = pickle.load(fin)
             self.text_transformer = pickle.load(fin)
             self.title_transformer = pickle.load(fin)
+            try:
+                self.reducer = pickle.load(fin)
+            except EOFError:
+                # Model file saved before reduction of features was introduced
+                self.reducer = None
 
 def load_model(file_path):
     """
@@ -93,50 +217,169 @@ def load_model(file_path):
     model.load(file_path)
     return model
 
-def model_from_db(hub_name, text_db_path, start_index=1, operations=4):
+def convert_model(src_path, dst_path = None):
+    """
+    Convert pickled .hubmodelXX file to memory-mappable model file
+        :param src_path: path to pickled model file
+        :param dst_path: path to new model file, src_path with '.mmap' suffix by default
+        :return: path to new model file
+    """
+    if dst_path is None:
+        dst_path = src_path + '.mmap'
+    load_model(src_path).save_mapped(dst_path)
+    return dst_path
+
+def model_from_db(hub_name, text_db_path, start_index=1, operations=4, sparse=False, workers=1, feature_space='count',
+        reduction=None, reduced_features=1000, mae_tolerance=None, n_jobs=-1, block_size=None):
     """
     Make model from file with text parsed posts data 
         :param hub_name: name of target hub
         :param text_db_path: path to file with text parsed posts data
         :param start_index: start index for progress message
         :param operations: count of all operations in progress messages
+        :param sparse: if True, keep features as scipy.sparse matrices from vectorization through training
+        :param workers: count of processes for vectorization of text db
+        :param feature_space: 'count' (fitted vocabularies) or 'hashing' (hashed words, no fit pass,
+        wide word space, so best used with sparse=True)
+        :param reduction: None to train on all features, 'select' or 'svd' to reduce them
+        to reduced_features first (see HabrHubRatingRegressor.fit_reduced)
+        :param reduced_features: count of features after reduction
+        :param mae_tolerance: allowed relative increase of MAE by reduction (see HabrHubRatingRegressor.fit_reduced)
+        :param n_jobs: count of threads fitting forest, -1 to use all cores
+        :param block_size: if set, vectorized db is saved in compressed block format with
+        block_size posts per block (see db.save_db) and its blocks are decompressed by workers threads
     """
+    from sklearn.utils import shuffle
     vec_db_path = f"vec_{hub_name}.pickle"
     space_db_path = f"space_{hub_name}.pickle"
-    db.cvt_text_db_to_vec_db(text_db_path, vec_db_path, space_db_path, start_index=start_index, operations=operations)
+    db.cvt_text_db_to_vec_db(text_db_path, vec_db_path, space_db_path,
+        start_index=start_index, operations=operations, sparse=sparse, workers=workers, feature_space=feature_space,
+        block_size=block_size)
     space_text, space_title = db.load_hub_vectorizers(space_db_path)
     print(f'[{start_index+2}/{operations}]')
-    X, y = db.cvt_db_to_DataFrames(vec_db_path)
-    X, y = shuffle(X,y)
-    hub = HabrHubRatingRegressor(hub_name)
-    print(f'[{start_index+3}/{operations}]')
-    hub.fit(X,y)
+    with metrics.stage('build matrix', hub=hub_name) as matrix_stage:
+        X, y = db.cvt_db_to_DataFrames(vec_db_path, workers=workers)
+        matrix_stage.items = X.shape[0]
+    with metrics.stage('shuffle', X.shape[0], hub=hub_name):
+        X, y = shuffle(X,y)
+    hub = HabrHubRatingRegressor(hub_name, n_jobs)
     hub.set_transformers(space_text, space_title)
+    print(f'[{start_index+3}/{operations}]')
+    with metrics.stage('fit', X.shape[0], hub=hub_name, reduction=reduction):
+        if reduction is None:
+            hub.fit(X,y)
+        else:
+            hub.fit_reduced(X, y, reduction, reduced_features, mae_tolerance)
     return hub
 
-def make_and_save_model_from_db(hub_name, text_db_path):
+def model_from_db_incremental(hub_name, text_db_path, batch_size=5000, trees_per_batch=10, feature_space='count'):
+    """
+    Make model from file with text parsed posts data out of core: posts are streamed from file
+    and every batch of them grows the forest by its own trees (see HabrHubRatingRegressor.partial_fit_posts)
+        :param hub_name: name of target hub
+        :param text_db_path: path to file with text parsed posts data
+        :param batch_size: count of posts in one training chunk
+        :param trees_per_batch: count of trees fitted on every chunk
+        :param feature_space: 'count' (vocabularies are fitted by a streaming pass over file first)
+        or 'hashing' (see model_from_db)
+    """
+    print('[1/2]')
+    hub = HabrHubRatingRegressor(hub_name)
+    with metrics.stage('fit vectorizers', hub=hub_name, feature_space=feature_space):
+        hub.set_transformers(*db.make_text_transformers(text_db_path, feature_space))
+    print('[2/2]')
+    with metrics.stage('fit', hub=hub_name, incremental=True) as fit_stage:
+        fit_stage.items = hub.partial_fit_posts(db.iter_db(text_db_path), batch_size, trees_per_batch)
+    return hub
+
+def update_model(model_path, posts, batch_size=5000, trees_per_batch=10):
+    """
+    Add new posts to existing model file without retraining: model grows by trees fitted on them
+    with its own transformers, and is saved back in format of the file (pickled or memory-mappable)
+        :param model_path: path to model file
+        :param posts: iterable of new parsed post data
+        :param batch_size: count of posts in one training chunk
+        :param trees_per_batch: count of trees fitted on every chunk
+        :return: count of added posts
+    """
+    hub = load_model(model_path)
+    with metrics.stage('fit', hub=hub.hub_name, incremental=True) as fit_stage:
+        count = fit_stage.items = hub.partial_fit_posts(posts, batch_size, trees_per_batch)
+    if count == 0:
+        return 0
+    with metrics.stage('save', hub=hub.hub_name):
+        if modelfile.is_mapped_model(model_path):
+            hub.save_mapped(model_path)
+        else:
+            hub.save(model_path)
+    logger.info(f'add {count} posts to model {model_path}')
+    return count
+
+def update_model_from_hub(hub_name, model_path=None, trees_per_batch=10):
+    """
+    Crawl posts published in hub since last crawl and add them to existing model
+        :param hub_name: name of target hub
+        :param model_path: path to model file, default path of hub model by default
+        :param trees_per_batch: count of trees fitted on every chunk of new posts
+        :return: count of added posts
+    """
+    from . import parser, store
+    if model_path is None:
+        model_path = _default_model_path(hub_name)
+    text_db_path = f"{hub_name}.pickle"
+    with store.PostStore(text_db_path) as post_store:
+        known = len(post_store)
+    parser.save_hub_to_db(hub_name, text_db_path, start_index=1, operations=2, incremental=True)
+    print('[2/2]')
+    # Store keeps posts in order of appending, so the new ones follow the known ones
+    with store.PostStore(text_db_path) as post_store:
+        new_posts = db.resolve_bodies(post_store.range(known, None), text_db_path)
+        return update_model(model_path, new_posts, trees_per_batch=trees_per_batch)
+
+def make_and_save_model_from_db(hub_name, text_db_path, sparse=False, workers=1, feature_space='count', reduction=None,
+        n_jobs=-1):
     """
     Create mode from db and save with default path
         :param hub_name: name of target hub
         :param text_db_path: path to text db
+        :param sparse: if True, use scipy.sparse features (see model_from_db)
+        :param workers: count of processes for vectorization of text db
+        :param feature_space: 'count' or 'hashing' (see model_from_db)
+        :param reduction: None, 'select' or 'svd' (see model_from_db)
+        :param n_jobs: count of threads fitting forest, -1 to use all cores
     """
-    hub = model_from_db(hub_name,text_db_path)
-    hub.save()
+    with metrics.stage('build', hub=hub_name):
+        hub = model_from_db(hub_name,text_db_path, sparse=sparse, workers=workers, feature_space=feature_space,
+            reduction=reduction, n_jobs=n_jobs)
+        with metrics.stage('save'):
+            hub.save()
 
-def model_from_hub(hub_name):
+def model_from_hub(hub_name, sparse=False, incremental=False, feature_space='count', reduction=None):
     """
     Create model from hub
         :param hub_name: name of target hub
-        :param threads_count: count of loaded threads
+        :param sparse: if True, use scipy.sparse features (see model_from_db)
+        :param incremental: if True, crawl only posts missing in existing hub db
+        :param feature_space: 'count' or 'hashing' (see model_from_db)
+        :param reduction: None, 'select' or 'svd' (see model_from_db)
     """
+    from . import parser
     text_db_path = f"{hub_name}.pickle"
-    parser.save_hub_to_db(hub_name, text_db_path, start_index=1, operations=5)
-    return model_from_db(hub_name, text_db_path, start_index=2, operations=5)
+    parser.save_hub_to_db(hub_name, text_db_path, start_index=1, operations=5, incremental=incremental)
+    return model_from_db(hub_name, text_db_path, start_index=2, operations=5, sparse=sparse, feature_space=feature_space,
+        reduction=reduction)
 
-def make_and_save_model_from_hub(hub_name):
+def make_and_save_model_from_hub(hub_name, sparse=False, incremental=False, feature_space='count', reduction=None):
     """
     Create model from hub and save with default path
         :param hub_name: name of target hub
+        :param sparse: if True, use scipy.sparse features (see model_from_db)
+        :param incremental: if True, crawl only posts missing in existing hub db
+        :param feature_space: 'count' or 'hashing' (see model_from_db)
+        :param reduction: None, 'select' or 'svd' (see model_from_db)
     """
-    hub = model_from_hub(hub_name)
-    hub.save()
+    with metrics.stage('build', hub=hub_name):
+        hub = model_from_hub(hub_name, sparse=sparse, incremental=incremental, feature_space=feature_space,
+            reduction=reduction)
+        with metrics.stage('save'):
+            hub.save()
@@ -0,0 +1,243 @@
+import json
+import os
+import struct
+import numpy as np
+from scipy import sparse as sp
+
+from . import reducers
+
+MAGIC = b'HUBMMAP\n'
+VERSION = 1
+
+# Arrays in file are aligned to this count of bytes
+_ALIGNMENT = 64
+# Count of rows of sparse features converted to dense array at once during prediction
+_PREDICT_CHUNK = 256
+
+class MappedForest:
+    """
+    Regression forest, whose trees are stored as flat arrays (possibly memory-mapped).
+    Predicts the same values as RandomForestRegressor it was made from
+    """
+    def __init__(self, children_left, children_right, feature, threshold, value, roots):
+        """
+            :param children_left: index of left child of every node of all trees, -1 for leaves
+            :param children_right: index of right child of every node of all trees, -1 for leaves
+            :param feature: feature used for split in every node
+            :param threshold: split threshold of every node
+            :param value: predicted value of every node
+            :param roots: index of root node of every tree
+        """
+        self.children_left = children_left
+        self.children_right = children_right
+        self.feature = feature
+        self.threshold = threshold
+        self.value = value
+        self.roots = roots
+
+    @classmethod
+    def from_estimator(cls, estimator):
+        """
+        Flatten trees of fitted RandomForestRegressor into one set of arrays
+            :param estimator: fitted RandomForestRegressor
+        """
+        lefts, rights, features, thresholds, values, roots = [], [], [], [], [], []
+        offset = 0
+        for tree_estimator in estimator.estimators_:
+            tree = tree_estimator.tree_
+            roots.append(offset)
+            is_leaf = tree.children_left == -1
+            lefts.append(np.where(is_leaf, -1, tree.children_left + offset))
+            rights.append(np.where(is_leaf, -1, tree.children_right + offset))
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(tree.threshold)
+            values.append(tree.value[:, 0, 0])
+            offset += tree.node_count
+        return cls(np.concatenate(lefts).astype('<i4'), np.concatenate(rights).astype('<i4'),
+            np.concatenate(features).astype('<i4'), np.concatenate(thresholds).astype('<f8'),
+            np.concatenate(values).astype('<f8'), np.asarray(roots, dtype='<i4'))
+
+    def extend(self, other):
+        """
+        Return forest with trees of both forests, predicting mean value of all their trees
+            :param other: MappedForest with new trees
+        """
+        shift = len(self.value)
+        def shifted(children):
+            return np.where(children == -1, -1, children + shift).astype('<i4')
+        return MappedForest(np.concatenate([self.children_left, shifted(other.children_left)]),
+            np.concatenate([self.children_right, shifted(other.children_right)]),
+            np.concatenate([self.feature, other.feature]), np.concatenate([self.threshold, other.threshold]),
+            np.concatenate([self.value, other.value]), np.concatenate([self.roots, other.roots + shift]).astype('<i4'))
+
+    def arrays(self):
+        "Return dict with all arrays of forest"
+        return {
+            'children_left': self.children_left,
+            'children_right': self.children_right,
+            'feature': self.feature,
+            'threshold': self.threshold,
+            'value': self.value,
+            'roots': self.roots
+        }
+
+    def predict(self, X):
+        """
+        Predict answer from features
+            :param X: features data (dense array or scipy.sparse matrix)
+        """
+        predictions = []
+        for start in range(0, X.shape[0], _PREDICT_CHUNK):
+            chunk = X[start:start + _PREDICT_CHUNK]
+            if sp.issparse(chunk):
+                chunk = chunk.toarray()
+            predictions.append(self._predict_dense(np.asarray(chunk, dtype=np.float32)))
+        return np.concatenate(predictions)
+
+    def _predict_dense(self, X):
+        # Walk all trees for all rows at once, until every (row, tree) pair reaches a leaf
+        rows = np.arange(X.shape[0])[:, None]
+        nodes = np.broadcast_to(self.roots, (X.shape[0], len(self.roots))).copy()
+        while True:
+            left = self.children_left[nodes]
+            is_split = left != -1
+            if not is_split.any():
+                break
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(is_split, np.where(go_left, left, self.children_right[nodes]), nodes)
+        return self.value[nodes].mean(axis=1)
+
+def _vectorizer_params(vectorizer):
+    params = vectorizer.get_params()
+    params.pop('vocabulary', None)
+    params['dtype'] = np.dtype(params['dtype']).name
+    return params
+
+def _vectorizer_to_arrays(vectorizer):
+    # Vectorizer loaded from model file has only vocabulary parameter until first transform
+    vocabulary = getattr(vectorizer, 'vocabulary_', None) or vectorizer.vocabulary
+    terms = sorted(vocabulary, key=vocabulary.get)
+    encoded = [term.encode('utf-8') for term in terms]
+    offsets = np.zeros(len(encoded) + 1, dtype='<i8')
+    np.cumsum([len(term) for term in encoded], out=offsets[1:])
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return _vectorizer_params(vectorizer), data, offsets
+
+def _vectorizer_from_arrays(params, data, offsets):
+    from sklearn.feature_extraction.text import CountVectorizer
+    raw = data.tobytes()
+    vocabulary = {raw[offsets[i]:offsets[i + 1]].decode('utf-8'): i for i in range(len(offsets) - 1)}
+    return CountVectorizer(vocabulary=vocabulary, **_restore_params(params))
+
+def _restore_params(params):
+    params = dict(params)
+    params['dtype'] = np.dtype(params['dtype']).type
+    params['ngram_range'] = tuple(params['ngram_range'])
+    return params
+
+def _hashing_vectorizer(params):
+    from sklearn.feature_extraction.text import HashingVectorizer
+    return HashingVectorizer(**_restore_params(params))
+
+def save(file_path, hub_name, estimator, text_transformer, title_transformer, reducer=None):
+    """
+    Save fitted model parts in memory-mappable format
+        :param file_path: path to model file
+        :param hub_name: name of model hub
+        :param estimator: fitted RandomForestRegressor or MappedForest
+        :param text_transformer: vectorizer for post body (CountVectorizer or HashingVectorizer)
+        :param title_transformer: vectorizer for post title (CountVectorizer or HashingVectorizer)
+        :param reducer: optional reduction of features (see reducers module)
+    """
+    if not isinstance(estimator, MappedForest):
+        estimator = MappedForest.from_estimator(estimator)
+    arrays = {'forest/' + name: array for name, array in estimator.arrays().items()}
+    from sklearn.feature_extraction.text import HashingVectorizer
+    vectorizers = {}
+    for name, vectorizer in [('body', text_transformer), ('title', title_transformer)]:
+        if isinstance(vectorizer, HashingVectorizer):
+            # Hashing vectorizer has no vocabulary, its parameters are its whole state
+            vectorizers[name] = {'kind': 'hashing', 'params': _vectorizer_params(vectorizer)}
+            continue
+        params, data, offsets = _vectorizer_to_arrays(vectorizer)
+        vectorizers[name] = {'kind': 'count', 'params': params}
+        arrays[f'{name}/terms'] = data
+        arrays[f'{name}/offsets'] = offsets
+
+    # Place arrays after header, so offsets are known before header is written
+    header = {'hub_name': hub_name, 'vectorizers': vectorizers, 'arrays': {}}
+    if reducer is not None:
+        header['reducer'] = {'kind': reducer.kind}
+        arrays.update({'reducer/' + name: array for name, array in reducer.arrays().items()})
+    def layout(header_size):
+        offset = _align(len(MAGIC) + 8 + header_size)
+        for name, array in arrays.items():
+            header['arrays'][name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+            offset = _align(offset + array.nbytes)
+        return json.dumps(header).encode('utf-8')
+    encoded_header = layout(0)
+    # Header length affects offsets, which affect header length: repeat until stable
+    while True:
+        new_header = layout(len(encoded_header))
+        if len(new_header) == len(encoded_header):
+            encoded_header = new_header
+            break
+        encoded_header = new_header
+
+    # Model file may be mapped by running processes (or by the model being saved),
+    # so it is replaced by a new file instead of being rewritten in place
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'wb') as fout:
+        fout.write(MAGIC)
+        fout.write(struct.pack('<II', VERSION, len(encoded_header)))
+        fout.write(encoded_header)
+        for name, array in arrays.items():
+            fout.write(b'\0' * (header['arrays'][name]['offset'] - fout.tell()))
+            fout.write(np.ascontiguousarray(array).tobytes())
+    os.replace(tmp_path, file_path)
+
+def _align(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+def is_mapped_model(file_path):
+    """
+    Check if file is model in memory-mappable format
+        :param file_path: path to model file
+    """
+    with open(file_path, 'rb') as fin:
+        return fin.read(len(MAGIC)) == MAGIC
+
+def load(file_path):
+    """
+    Load model in memory-mappable format. Arrays are mapped from file, not read,
+    so loading is almost instant and processes share one copy of model in page cache
+        :param file_path: path to model file
+        :return: hub name, MappedForest, body vectorizer, title vectorizer and reduction of features (or None)
+    """
+    mapped = np.memmap(file_path, dtype=np.uint8, mode='r')
+    if mapped[:len(MAGIC)].tobytes() != MAGIC:
+        raise ValueError(f'{file_path} is not memory-mappable model file')
+    version, header_size = struct.unpack('<II', mapped[len(MAGIC):len(MAGIC) + 8].tobytes())
+    if version != VERSION:
+        raise ValueError(f'unsupported version {version} of model file {file_path}')
+    header = json.loads(mapped[len(MAGIC) + 8:len(MAGIC) + 8 + header_size].tobytes().decode('utf-8'))
+    arrays = {}
+    for name, info in header['arrays'].items():
+        dtype = np.dtype(info['dtype'])
+        count = int(np.prod(info['shape']))
+        arrays[name] = np.frombuffer(mapped, dtype=dtype, count=count, offset=info['offset']).reshape(info['shape'])
+
+    forest = MappedForest(**{name: arrays['forest/' + name] for name in
+        ['children_left', 'children_right', 'feature', 'threshold', 'value', 'roots']})
+    vectorizers = []
+    for name in ['body', 'title']:
+        info = header['vectorizers'][name]
+        if info.get('kind', 'count') == 'hashing':
+            vectorizers.append(_hashing_vectorizer(info['params']))
+        else:
+            vectorizers.append(_vectorizer_from_arrays(info['params'], arrays[f'{name}/terms'], arrays[f'{name}/offsets']))
+    reducer = None
+    if 'reducer' in header:
+        reducer = reducers.from_arrays(header['reducer']['kind'],
+            {name[len('reducer/'):]: array for name, array in arrays.items() if name.startswith('reducer/')})
+    return header['hub_name'], forest, vectorizers[0], vectorizers[1], reducer
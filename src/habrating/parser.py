@@ -1,18 +1,31 @@
 import scrapy
-import datetime
+import time
 import re
 import contextlib
 import os
 import pickle
 from scrapy.crawler import CrawlerProcess, Settings
 from billiard import Process
-from lxml.html import document_fromstring
-from urllib.request import urlopen
 from scrapy import signals
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
 from tempfile import NamedTemporaryFile
 
+from . import cache
+from . import extractor
+from . import logger
+from . import metrics
+from . import store
 from . import utils
 
+CHECKPOINT_SUFFIX = '.crawl'
+
+_normalize_views_count = extractor.normalize_views_count
+
+# Root of crawled site. HABR_BASE_URL environment variable points crawls elsewhere,
+# e.g. to local stand-in server of bench/habr_server.py
+BASE_URL = os.environ.get('HABR_BASE_URL', 'https://habrahabr.ru')
+
 class CrawlerThread(Process):
     def __init__(self, spider, settings, *args):
         Process.__init__(self)
@@ -25,151 +38,251 @@ class CrawlerThread(Process):
         process.crawl(self.spider, *self.args)
         process.start()
 
+class ResponseCacheStorage:
+    """
+    Storage for scrapy HttpCacheMiddleware, backed by shared habrating response cache
+    """
+    def __init__(self, settings):
+        self.cache = cache.ResponseCache(settings.get('HABR_CACHE_DIR'))
+
+    def open_spider(self, spider):
+        pass
+
+    def close_spider(self, spider):
+        logger.info(f'response cache of {spider.name} crawl: {self.cache.hits} hits, {self.cache.misses} misses')
+
+    def retrieve_response(self, spider, request):
+        entry = self.cache.get(request.url)
+        if entry is None:
+            return None
+        headers = Headers(entry['headers'])
+        respcls = responsetypes.from_args(headers=headers, url=entry['url'], body=entry['body'])
+        return respcls(url=entry['url'], headers=headers, status=entry['status'], body=entry['body'])
+
+    def store_response(self, spider, request, response):
+        # HttpCacheMiddleware gets responses before HttpCompressionMiddleware decompresses them
+        try:
+            body = cache.decode_body(response.body, dict(response.headers))
+        except ValueError as e:
+            logger.warning(f'response of {request.url} is not cached: {e}')
+            return
+        self.cache.put(request.url, body, response.status, dict(response.headers), response.url)
+
+def _crawler_settings(**settings):
+    """
+    Return settings for CrawlerThread with shared response cache enabled
+        :param settings: additional scrapy settings
+    """
+    return Settings(dict({
+        'LOG_LEVEL': 'ERROR',
+        'RETRY_TIMES': 10,
+        'HTTPCACHE_ENABLED': True,
+        'HTTPCACHE_STORAGE': 'habrating.parser.ResponseCacheStorage',
+        'HTTPCACHE_IGNORE_HTTP_CODES': [403, 404, 408, 429, 500, 502, 503, 504],
+        'HABR_CACHE_DIR': cache.CACHE_DIR,
+        'HABR_AUTHORS_FILE': os.path.join(cache.CACHE_DIR, 'authors.pickle')
+    }, **settings))
+
+class PostStorePipeline:
+    """
+    Item pipeline, which appends every scraped post to PostStore at POST_STORE_PATH setting.
+    If ARTICLE_STORE_PATH setting is set, post body is put to shared article store there
+    and post keeps only reference to it
+    """
+    def __init__(self, path_to_file, article_store_path=None):
+        self.path = path_to_file
+        self.article_store_path = article_store_path
+        self.post_store = None
+        self.article_store = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings.get('POST_STORE_PATH'), crawler.settings.get('ARTICLE_STORE_PATH'))
+
+    def open_spider(self, spider):
+        self.post_store = store.PostStore(self.path)
+        if self.article_store_path is not None:
+            self.article_store = store.ArticleStore(self.article_store_path)
+
+    def close_spider(self, spider):
+        self.post_store.close()
+        if self.article_store is not None:
+            self.article_store.close()
+
+    def process_item(self, item, spider):
+        post = dict(item)
+        if self.article_store is not None:
+            post['body'] = self.article_store.put(post['body'])
+        self.post_store.append(post)
+        return item
+
 class HabrHubSpider(scrapy.Spider):
-    def __init__(self, hub_name, bar):
+    def __init__(self, hub_name, bar, known_keys=None, stop_on_known=False, base_url=None):
+        """
+            :param hub_name: name of crawled hub
+            :param bar: progress bar, updated on every scraped post. If None, bar is created
+            with count of hub articles, when the first listing page shows count of pages
+            :param known_keys: store keys of already saved articles, which are not crawled again
+            :param stop_on_known: if True, stop pagination on listing page with only known articles.
+            Listing pages are followed one by one then, otherwise all of them are requested at once
+            :param base_url: root of crawled site, BASE_URL by default
+        """
         self.name = hub_name
-        self.start_urls = [f'https://habrahabr.ru/hub/{hub_name}/all/page1']
+        self.base_url = base_url or BASE_URL
+        self.start_urls = [f'{self.base_url}/hub/{hub_name}/all/page1']
         self.bar = bar
+        self.known_keys = known_keys or set()
+        self.stop_on_known = stop_on_known
+        # author -> his karma, rating and followers, resolved during crawl
+        self.authors = {}
+        # author -> posts waiting for in-flight request of author page
+        self.pending_authors = {}
+        self.authors_file = None
+        # Count of listing pages and of articles on one of them, known after the first one
+        self.last_page = None
+        self.page_size = None
 
     @classmethod
     def from_crawler(cls, crawler, *args, **kwargs):
         spider = super(HabrHubSpider, cls).from_crawler(crawler, *args, **kwargs)
         crawler.signals.connect(spider.finish_bar, signals.spider_closed)
         crawler.signals.connect(spider.increment_bar, signals.item_scraped)
+        spider.load_authors(crawler.settings.get('HABR_AUTHORS_FILE'))
+        crawler.signals.connect(spider.save_authors, signals.spider_closed)
         return spider
 
-    def finish_bar(self):
-        self.bar.finish()
-
-    def increment_bar(self):
-        self.bar.update(self.bar.currval+1)
-
-    def __normalize_rating(self, rating_string):
+    def load_authors(self, authors_file):
         """
-        Transform rating representation to number
-            :param rating_string: string with rating
+        Load author stats, persisted by previous crawls and not older than author pages TTL
+            :param authors_file: path to persisted author stats, None disables persistence
         """
-        if '–' in rating_string:
-            rating_string = rating_string.replace('–','-')
-        return int(rating_string)
-
-    def __normalize_company_rating(self, company_rating_string):
-        if company_rating_string is None:
-            return 0.0
-        else:
-            return float(company_rating_string.replace(',','.').replace(' ',''))
-
-    def __get_year_from_datastr(self, date_string):
-        is_writed_yesterday = 'вчера' in date_string
-        is_writed_today = 'сегодня' in date_string
-        is_writed_in_this_year = date_string.split(' ')[2] == 'в'
-        if is_writed_in_this_year or is_writed_today or is_writed_yesterday:
-            year = datetime.datetime.now().year
-        else:
-            year = int(date_string.split(' ')[2])
-        return year
-
-    def _normalize_views_count(self, views_string):
-        """
-        Transform views count (given as a string) from
-        habrahabr's format to an integer
-        Example: '3k' -> 3000, '10' -> 10, '3,2k' -> 3200
-            :param views_string: view count in habr's format
-            :return: views count
-            :rtype: int
-        """
-        r = re.search(r'([0-9]+\,[0-9]|[0-9]+)(k|m)?',views_string)
-        # if number part of string is float, replace ',' to '.' (different float notation)
-        num_part = float(r.group(1).replace(',','.') if ',' in r.group(1) else r.group(1))
-        if r.group(2) == 'k':
-            mult_part = 1000
-        elif r.group(2) == 'm':
-            mult_part = 1000000
-        else:
-            mult_part = 1
-
+        self.authors_file = authors_file
+        if authors_file is None:
+            return
         try:
-            return int(num_part*mult_part)
-        except ValueError:
-            return None
+            with open(authors_file, 'rb') as fin:
+                persisted = pickle.load(fin)
+        except (FileNotFoundError, EOFError):
+            return
+        now = time.time()
+        for author, (resolved_time, stats) in persisted.items():
+            if now - resolved_time <= cache.TTL['author']:
+                self.authors[author] = stats
+        logger.info(f'load stats of {len(self.authors)} authors')
+
+    def save_authors(self):
+        if self.authors_file is None:
+            return
+        now = time.time()
+        try:
+            with open(self.authors_file, 'rb') as fin:
+                persisted = pickle.load(fin)
+        except (FileNotFoundError, EOFError):
+            persisted = {}
+        for author, stats in self.authors.items():
+            if author not in persisted or now - persisted[author][0] > cache.TTL['author']:
+                persisted[author] = (now, stats)
+        os.makedirs(os.path.dirname(self.authors_file) or '.', exist_ok=True)
+        with NamedTemporaryFile(dir=os.path.dirname(self.authors_file) or '.', delete=False) as fout:
+            pickle.dump(persisted, fout)
+        os.replace(fout.name, self.authors_file)
 
-    def _body2text(self, body):
-        """
-        Transform html tree of article body to plain normalize text (ignoring code)
-            :param body: html tree of article body
-            :return: plain text of article
-            :rtype: string
-        """
-        for elem in body.findall('.//code'):
-            elem.getparent().remove(elem)
-        return body.text_content().lower()
+    def finish_bar(self):
+        if self.bar is not None:
+            self.bar.finish()
+
+    def increment_bar(self):
+        if self.bar is None:
+            self.bar = utils.get_bar(None).start()
+        value = self.bar.currval + 1
+        if isinstance(self.bar.maxval, int) and value > self.bar.maxval:
+            # Hub has grown since its count of pages was seen
+            self.bar.maxval = value
+        self.bar.update(value)
 
     def parse(self, response):
-        for habr_post in response.css('a[class="post__title_link"]::attr(href)').extract():
+        new_posts = 0
+        habr_posts = response.css('a[class="post__title_link"]::attr(href)').extract()
+        for habr_post in habr_posts:
+            if store.post_key(response.urljoin(habr_post)) in self.known_keys:
+                continue
+            new_posts += 1
             yield response.follow(habr_post, self.parse_article, dont_filter=True)
 
-        next_page = response.css('a[id="next_page"]::attr(href)').extract_first()
-        if next_page is not None:
-            yield response.follow(next_page, callback=self.parse, dont_filter=True)
+        if self.stop_on_known:
+            # Early stop needs pages in order, so they are followed one by one
+            if new_posts == 0:
+                logger.info(f'stop crawling at {response.url}: all posts on page are already saved')
+                return
+            next_page = response.css('a[id="next_page"]::attr(href)').extract_first()
+            if next_page is not None:
+                yield response.follow(next_page, callback=self.parse, dont_filter=True)
+            return
+
+        page = response.meta.get('listing_page')
+        if page is None:
+            # The first page shows count of pages, so the rest of them are requested at once,
+            # with priority over articles to find all articles early
+            last_page_link = _last_page_link(response.selector.root)
+            self.last_page = 1 if last_page_link is None else int(_PAGE_NUMBER_RE.search(last_page_link).group(1))
+            self.page_size = len(habr_posts)
+            logger.info(f'{self.name} hub has {self.last_page} listing pages')
+            if self.bar is None:
+                self.bar = utils.get_bar(self.last_page * self.page_size).start()
+            for page in range(2, self.last_page + 1):
+                page_link = _PAGE_NUMBER_RE.sub(f'page{page}/', last_page_link)
+                yield response.follow(page_link, callback=self.parse, dont_filter=True,
+                    priority=1, meta={'listing_page': page})
+        elif page == self.last_page and page > 1 and isinstance(self.bar.maxval, int):
+            self.bar.maxval = max(self.bar.currval, (page - 1) * self.page_size + len(habr_posts))
 
     def parse_article(self, response):
-        post = {}
-
-        # year
-        # TODO year filter
-        raw_data = response.css('span[class="post__time"]::text').extract_first().lstrip()
-        post['year'] = self.__get_year_from_datastr(raw_data)
-
-        # title
-        post['title'] = response.css(\
-            'h1[class="post__title post__title_full"] span[class="post__title-text"]::text').extract_first()
-
-        # body and body length
-        post_text_root = response.css('div[class="post__text post__text-html js-mediator-article"]')[0].root
-        post['body'] = self._body2text(post_text_root)
-        post['body length'] = len(post['body']) 
-
-        # company rating
-        raw_company_rating = response.css('sup[class="page-header__stats-value page-header__stats-value_branding"]::text').extract_first()
-        post['company rating'] = self.__normalize_company_rating(raw_company_rating)
-
-        # rating
-        raw_rating = response.css('span[class*="voting-wjt__counter"]::text').extract_first()
-        post['rating'] = self.__normalize_rating(raw_rating)
-
-        # comments
-        post['comments'] = int(response.css('strong[class="comments-section__head-counter"]::text').extract_first())
-
-        # views
-        raw_views = response.css('span[class="post-stats__views-count"]::text').extract_first()
-        post['views'] = self._normalize_views_count(raw_views)
-
-        # bookmarks
-        post['bookmarks'] = int(response.css('span[class="bookmark__counter js-favs_count"]::text').extract_first())
+        post, author = self.extract_post(response)
 
         # author karma, rating, follower
-        author = response.css('span[class="user-info__nickname user-info__nickname_small"]::text').extract_first()
-        request = scrapy.Request(f'https://habrahabr.ru/users/{author}', callback=self.parse_author, dont_filter=True)
-        request.meta['post'] = post
-        yield request
+        if author in self.authors:
+            post.update(self.authors[author])
+            yield post
+        elif author in self.pending_authors:
+            # Author page is already requested, post will be yielded with its response
+            self.pending_authors[author].append(post)
+        else:
+            self.pending_authors[author] = [post]
+            # Author page is on the same site as the article
+            request = scrapy.Request(response.urljoin(f'/users/{author}'), callback=self.parse_author,
+                errback=self.author_failed, dont_filter=True)
+            request.meta['author'] = author
+            yield request
+
+    def extract_post(self, response):
+        """
+        Extract post data, except author stats, from article page
+            :param response: article page response
+            :return: post data and nickname of post author
+        """
+        return extractor.extract_post(response.selector.root, response.url)
 
     def parse_author(self, response):
-        post = response.meta['post']
-        author_parameters = response.css('div[class *="stacked-counter__value"]::text').extract()
-        if len(author_parameters) == 3:
-            post['author karma'] = self._normalize_views_count(author_parameters[0])
-            post['author rating'] = self._normalize_views_count(author_parameters[1])
-            post['author followers'] = self._normalize_views_count(author_parameters[2])
-        else:
-            author_status = response.css('sup[class="author-info__status"]::text').extract_first()
-            if author_status == 'read-only':
-                post['author karma'] = 0
-                post['author rating'] = 0
-                post['author followers'] = 0
-            else:
-                raise RuntimeError(f'problem with tags of data showings: {author_parameters}, {author_status}')
+        author = response.meta['author']
+        posts = self.pending_authors.pop(author)
+        stats = self.extract_author_stats(response)
+        self.authors[author] = stats
+        for post in posts:
+            post.update(stats)
+            yield post
+
+    def extract_author_stats(self, response):
+        """
+        Extract author karma, rating and followers from author page
+            :param response: author page response
+            :return: dict with author stats post fields
+        """
+        return extractor.extract_author_stats(response.selector.root)
 
-        yield post
+    def author_failed(self, failure):
+        author = failure.request.meta['author']
+        posts = self.pending_authors.pop(author, [])
+        logger.warning(f'failed to get stats of author {author}, drop {len(posts)} posts: {repr(failure.value)}')
 
 class HabrArticleSpider(scrapy.Spider):
     def __init__(self, article_page):
@@ -179,54 +292,98 @@ class HabrArticleSpider(scrapy.Spider):
         tmp = HabrHubSpider("",None)
         yield from tmp.parse_article(response)
 
-def _get_hub_last_page(hub):
+_PAGE_NUMBER_RE = re.compile(r'page(\d+)/?$')
+
+def _last_page_link(data):
     """
-    Get last page of target hub
-        :param hub: hub name
+    Get link to last page of target hub from its listing page
+        :param data: html tree of listing page
+        :return: href of last page or None if page has no pagination
     """
-    url = 'https://habrahabr.ru/hub/'+hub+'/all/page1'
-    data = document_fromstring(urlopen(url).read())
     last_page_xpath = './/a[@class="toggle-menu__item-link toggle-menu__item-link_pagination toggle-menu__item-link_bordered"]'
     last_page_element = data.find(last_page_xpath)
     if last_page_element is  None:
         # Hub too small, that link to last page in direct page link, so get last
         hub_pages_xpath = './/a[@class="toggle-menu__item-link toggle-menu__item-link_pagination"]'
-        last_page_element = data.xpath(hub_pages_xpath)[-1]
-    last_page = int(last_page_element.attrib["href"].lstrip(f'/hub/{hub}/all/page').rstrip('/'))
-    return last_page
-
-def _hub_articles_count(hub):
-    last_page = _get_hub_last_page(hub)
-    url = 'https://habrahabr.ru/hub/'+hub+'/all/page'+str(last_page)
-    data = document_fromstring(urlopen(url).read())
-    return (last_page-1)*10 + len(data.findall('.//a[@class="post__title_link"]'))
-
-def save_hub_to_db(hub_name, file_path, max_year=None, operations=1, start_index=1):
-    with contextlib.suppress(FileNotFoundError):
-        os.remove(file_path)
+        hub_pages = data.xpath(hub_pages_xpath)
+        if not hub_pages:
+            return None
+        last_page_element = hub_pages[-1]
+    href = last_page_element.attrib['href']
+    return href if _PAGE_NUMBER_RE.search(href) else None
+
+def _load_crawl_checkpoint(checkpoint_path):
+    try:
+        with open(checkpoint_path, 'rb') as fin:
+            return pickle.load(fin)
+    except FileNotFoundError:
+        return None
+
+def _save_crawl_checkpoint(checkpoint_path, hub_name, complete):
+    with open(checkpoint_path, 'wb') as fout:
+        pickle.dump({'hub': hub_name, 'complete': complete}, fout)
+
+def save_hub_to_db(hub_name, file_path, max_year=None, operations=1, start_index=1, incremental=False,
+        base_url=None, crawler_settings=None, share_bodies=True):
+    """
+    Crawl hub posts into post store. Crawl state is checkpointed next to
+    the store, so crawl interrupted before its end is resumed on the next call
+        :param hub_name: name of target hub
+        :param file_path: path to post store
+        :param incremental: if True, keep saved posts and crawl only new ones,
+        stopping at first listing page without new posts
+        :param base_url: root of crawled site, BASE_URL by default
+        :param crawler_settings: dict of additional scrapy settings of crawl (e.g. CONCURRENT_REQUESTS,
+        AUTOTHROTTLE_ENABLED or RETRY_TIMES), they override defaults of _crawler_settings
+        :param share_bodies: if True, keep post bodies in article store shared with data files
+        of other hubs in the same directory (see store.ArticleStore), else in the data file itself
+        :return: True if crawl has ended, False if it was interrupted (it is resumed on next call then)
+    """
+    checkpoint_path = file_path + CHECKPOINT_SUFFIX
+    checkpoint = _load_crawl_checkpoint(checkpoint_path)
+    resume = checkpoint is not None and checkpoint['hub'] == hub_name and not checkpoint['complete']
+    if resume:
+        logger.info(f'resume interrupted crawl of {hub_name} into {file_path}')
+    elif not incremental:
+        for path in (file_path, file_path + store.INDEX_SUFFIX):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+    with store.PostStore(file_path) as post_store:
+        known_keys = set(post_store.keys())
+    # Early stop is valid only if the previous crawl has saved every older post
+    stop_on_known = incremental and not resume
+    _save_crawl_checkpoint(checkpoint_path, hub_name, complete=False)
 
     print(f'[{start_index}/{operations}]')
 
-    bar = utils.get_bar(_hub_articles_count(hub_name)).start()
-
-    new_thread = CrawlerThread(HabrHubSpider, Settings({
-        'FEED_FORMAT': 'pickle',
-        'FEED_URI': f'./{file_path}',
-        'LOG_LEVEL': 'ERROR',
-        'RETRY_TIMES': 10
-    }), hub_name, bar)
-
-    new_thread.start()
-    new_thread.join()
+    # Without saved posts spider creates bar by count of pages, seen on the first listing page
+    bar = utils.get_bar(None).start() if known_keys else None
+
+    new_thread = CrawlerThread(HabrHubSpider, _crawler_settings(
+        ITEM_PIPELINES={'habrating.parser.PostStorePipeline': 300},
+        POST_STORE_PATH=file_path,
+        ARTICLE_STORE_PATH=store.article_store_path(file_path) if share_bodies else None,
+        **(crawler_settings or {})
+    ), hub_name, bar, known_keys, stop_on_known, base_url)
+
+    with metrics.stage('crawl', hub=hub_name, incremental=incremental) as crawl_stage:
+        new_thread.start()
+        new_thread.join()
+        with store.PostStore(file_path) as post_store:
+            crawl_stage.items = len(post_store) - len(known_keys)
+    if new_thread.exitcode == 0:
+        _save_crawl_checkpoint(checkpoint_path, hub_name, complete=True)
+        return True
+    logger.warning(f'crawl of {hub_name} was interrupted, it will be resumed on next run')
+    return False
 
 def parse_article(url):
     tmp_file = NamedTemporaryFile()
-    new_thread = CrawlerThread(HabrArticleSpider, Settings({
-        'FEED_FORMAT': 'pickle',
-        'FEED_URI': f'{tmp_file.name}',
-        'LOG_LEVEL': 'ERROR',
-        'RETRY_TIMES': 10
-    }), url)
+    new_thread = CrawlerThread(HabrArticleSpider, _crawler_settings(
+        FEED_FORMAT='pickle',
+        FEED_URI=f'{tmp_file.name}'
+    ), url)
     new_thread.start()
     new_thread.join()
     return pickle.load(tmp_file)
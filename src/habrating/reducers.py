@@ -0,0 +1,88 @@
+import numpy as np
+from scipy import sparse as sp
+
+class FeatureSelection:
+    """
+    Reduction of features, which keeps only columns most related to rating
+    """
+    kind = 'select'
+
+    def __init__(self, columns):
+        """
+            :param columns: indices of kept columns
+        """
+        self.columns = columns
+
+    def transform(self, X):
+        """
+        Reduce features
+            :param X: features data (dense array or scipy.sparse matrix)
+        """
+        return X[:, self.columns]
+
+    def arrays(self):
+        "Return dict with all arrays of reduction"
+        return {'columns': self.columns}
+
+class TextProjection:
+    """
+    Reduction of features, which projects word count columns onto few components
+    (truncated SVD) and keeps other (numeric) columns as is
+    """
+    kind = 'svd'
+
+    def __init__(self, components):
+        """
+            :param components: components matrix, one row per component, one column per word
+        """
+        self.components = components
+
+    def transform(self, X):
+        """
+        Reduce features
+            :param X: features data (dense array or scipy.sparse matrix)
+            :return: dense array
+        """
+        text_columns = self.components.shape[1]
+        projected = X[:, :text_columns] @ self.components.T
+        other = X[:, text_columns:]
+        if sp.issparse(other):
+            other = other.toarray()
+        return np.hstack([np.asarray(projected), other]).astype(np.float32)
+
+    def arrays(self):
+        "Return dict with all arrays of reduction"
+        return {'components': self.components}
+
+REDUCERS = {cls.kind: cls for cls in [FeatureSelection, TextProjection]}
+
+def fit_reducer(X, y, kind, n_features, text_columns):
+    """
+    Fit reduction of features
+        :param X: training features data (dense array or scipy.sparse matrix)
+        :param y: training answers
+        :param kind: 'select' to keep n_features columns with the best univariate F-score against rating,
+        'svd' to project word count columns onto n_features components by truncated SVD
+        :param n_features: count of kept columns or components
+        :param text_columns: count of word count columns at the start of X rows (body and title)
+    """
+    if kind == 'select':
+        from sklearn.feature_selection import SelectKBest, f_regression
+        # Constant columns (words absent in training posts) have undefined score, they are never selected
+        with np.errstate(invalid='ignore', divide='ignore'):
+            selector = SelectKBest(f_regression, k=min(n_features, X.shape[1])).fit(X, y)
+        return FeatureSelection(selector.get_support(indices=True).astype('<i4'))
+    if kind == 'svd':
+        from sklearn.decomposition import TruncatedSVD
+        svd = TruncatedSVD(n_components=min(n_features, text_columns - 1), random_state=0)
+        svd.fit(X[:, :text_columns])
+        return TextProjection(svd.components_.astype('<f4'))
+    raise ValueError(f'unknown reduction {kind}')
+
+def from_arrays(kind, arrays):
+    """
+    Create reduction from its arrays
+        :param kind: kind of reduction
+        :param arrays: dict with arrays (as returned by arrays method of reduction)
+    """
+    return REDUCERS[kind](**arrays)
@@ -0,0 +1,291 @@
+import argparse
+import asyncio
+import collections
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import aiohttp
+import numpy as np
+
+from . import db
+from . import fetcher
+from . import logger
+from . import model
+
+class MicroBatcher:
+    """
+    Collects predictions requested concurrently from one model into single predict_by_posts calls
+    """
+    def __init__(self, hub_model, max_batch_size=32, max_wait=0.01):
+        """
+            :param hub_model: loaded HabrHubRatingRegressor
+            :param max_batch_size: maximal count of posts in one predict_by_posts call
+            :param max_wait: maximal time in seconds to wait for more posts after the first one of batch
+        """
+        self.model = hub_model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches = 0
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name=f'MicroBatcher-{hub_model.hub_name}', daemon=True)
+        self.thread.start()
+
+    def submit(self, post):
+        """
+        Request prediction for post
+            :param post: dict in default format (with 'title', 'body', etc. fields)
+            :return: concurrent.futures.Future with predicted rating
+        """
+        future = Future()
+        self.queue.put((post, future))
+        return future
+
+    def predict(self, posts):
+        """
+        Predict ratings of posts, waiting for result
+            :param posts: list of dicts in default format
+        """
+        futures = [self.submit(post) for post in posts]
+        return [future.result() for future in futures]
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                predictions = self.model.predict_by_posts([post for post, _ in batch])
+            except Exception as e:
+                logger.exception(e)
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            for (_, future), prediction in zip(batch, predictions):
+                future.set_result(float(prediction))
+
+class LatencyStats:
+    """
+    Thread-safe counter of served requests and their recent latencies
+    """
+    def __init__(self, window=10000):
+        """
+            :param window: count of last requests used for latency percentiles
+        """
+        self.started = time.monotonic()
+        self.requests = 0
+        self.latencies = collections.deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, latency):
+        with self.lock:
+            self.requests += 1
+            self.latencies.append(latency)
+
+    def report(self):
+        "Return dict with count of requests, requests per second and p50/p99 latency in milliseconds"
+        with self.lock:
+            latencies = np.array(self.latencies)
+            requests = self.requests
+        report = {
+            'requests': requests,
+            'requests_per_sec': requests / (time.monotonic() - self.started),
+            'latency_p50_ms': None,
+            'latency_p99_ms': None
+        }
+        if len(latencies):
+            report['latency_p50_ms'] = float(np.percentile(latencies, 50)) * 1000
+            report['latency_p99_ms'] = float(np.percentile(latencies, 99)) * 1000
+        return report
+
+class FetchError(Exception):
+    """
+    Failure to download article of request, with HTTP status to answer it
+    """
+    def __init__(self, message, status=502):
+        """
+            :param message: short description of failure for client
+            :param status: 404 if site has no such article, 502 for other failures
+        """
+        super().__init__(message)
+        self.status = status
+
+class PredictionService:
+    """
+    Loaded models with their micro-batchers, shared by all server connections
+    """
+    def __init__(self, model_paths, max_batch_size=32, max_wait=0.01):
+        self.batchers = {}
+        for path in model_paths:
+            hub_model = model.load_model(path)
+            logger.info(f'serve model of {hub_model.hub_name} from {path}')
+            self.batchers[hub_model.hub_name] = MicroBatcher(hub_model, max_batch_size, max_wait)
+        self.stats = LatencyStats()
+
+    def predict(self, request):
+        """
+        Predict ratings for request
+            :param request: dict with optional 'model' (hub name, may be omitted if only one model is served)
+            and either 'urls' (list of article urls) or 'posts' (list of dicts in default format)
+            :return: list of predicted ratings
+        """
+        hub_name = request.get('model')
+        if hub_name is None:
+            if len(self.batchers) != 1:
+                raise ValueError(f'"model" is required, served models: {list(self.batchers)}')
+            hub_name = next(iter(self.batchers))
+        if hub_name not in self.batchers:
+            raise ValueError(f'unknown model {hub_name}, served models: {list(self.batchers)}')
+        if 'urls' in request:
+            posts = _fetch_posts(request['urls'])
+        elif 'posts' in request:
+            posts = [_normalize_post(post) for post in request['posts']]
+        else:
+            raise ValueError('request must have "urls" or "posts" field')
+        return self.batchers[hub_name].predict(posts)
+
+    def report(self):
+        report = self.stats.report()
+        report['models'] = list(self.batchers)
+        report['batches'] = {name: batcher.batches for name, batcher in self.batchers.items()}
+        return report
+
+def _fetch_posts(urls):
+    try:
+        return fetcher.get_fetcher().parse_articles(urls)
+    except aiohttp.ClientResponseError as e:
+        raise FetchError(f'article {e.request_info.real_url} answered {e.status}',
+            404 if e.status == 404 else 502) from e
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise FetchError(f'failed to fetch articles: {type(e).__name__}') from e
+
+def _normalize_post(post):
+    # Validate post before it gets into batch, so bad request can't fail predictions of others.
+    # Numeric fields, which client omits, are zeroed like in GUI direct prediction
+    normalized = {'title': str(post['title']), 'body': str(post['body'])}
+    normalized['body length'] = len(normalized['body'])
+    normalized['rating'] = 0
+    for key in db.FEATURE_KEYS:
+        if key != 'body length':
+            normalized[key] = float(post.get(key, 0))
+    return normalized
+
+class PredictionRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP handler: POST /predict with JSON request (see PredictionService.predict), GET /stats
+    """
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send_json(200, self.server.service.report())
+        else:
+            self._send_json(404, {'error': f'unknown path {self.path}'})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send_json(404, {'error': f'unknown path {self.path}'})
+            return
+        start = time.perf_counter()
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            predictions = self.server.service.predict(request)
+        except FetchError as e:
+            logger.warning(f'{e}: {repr(e.__cause__)}')
+            self._send_json(e.status, {'error': str(e)})
+            return
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {'error': repr(e)})
+            return
+        except Exception as e:
+            # Details of internal errors go to log only
+            logger.exception(e)
+            self._send_json(500, {'error': f'internal error: {type(e).__name__}'})
+            return
+        self._send_json(200, {'predictions': predictions})
+        self.server.service.stats.record(time.perf_counter() - start)
+
+    def _send_json(self, code, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def address_string(self):
+        # Unix socket connections have no client address
+        return str(self.client_address[0]) if self.client_address else 'unix'
+
+class PredictionHTTPServer(ThreadingHTTPServer):
+    # Default listen backlog of 5 resets connections under concurrent load
+    request_queue_size = 128
+
+class PredictionUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+def make_server(service, host='127.0.0.1', port=8080, unix_socket=None):
+    """
+    Create HTTP server for prediction service
+        :param service: PredictionService
+        :param host: host to listen on
+        :param port: TCP port to listen on
+        :param unix_socket: path to unix socket. If set, it is used instead of host and port
+    """
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = PredictionUnixHTTPServer(unix_socket, PredictionRequestHandler)
+    else:
+        server = PredictionHTTPServer((host, port), PredictionRequestHandler)
+    server.service = service
+    return server
+
+def main(argv):
+    """
+    Run headless prediction server
+        :param argv: command line arguments (after 'serve')
+        :return: exit code
+    """
+    arg_parser = argparse.ArgumentParser(prog='python -m habrating serve',
+        description='Serve rating predictions of hub models over HTTP')
+    arg_parser.add_argument('models', nargs='+', help='model files to serve')
+    arg_parser.add_argument('--host', default='127.0.0.1')
+    arg_parser.add_argument('--port', type=int, default=8080)
+    arg_parser.add_argument('--unix-socket', help='serve on unix socket instead of TCP port')
+    arg_parser.add_argument('--max-batch-size', type=int, default=32,
+        help='maximal count of posts in one model call')
+    arg_parser.add_argument('--max-wait-ms', type=float, default=10,
+        help='maximal time to wait for more posts before model call')
+    args = arg_parser.parse_args(argv)
+
+    service = PredictionService(args.models, args.max_batch_size, args.max_wait_ms / 1000)
+    server = make_server(service, args.host, args.port, args.unix_socket)
+    print(f'Serving {list(service.batchers)} on {args.unix_socket or f"http://{args.host}:{args.port}"}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info(f'server stats: {service.report()}')
+    return 0
@@ -0,0 +1,304 @@
+import contextlib
+import hashlib
+import os
+import pickle
+import re
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where shared article store is not locked between crawls
+    fcntl = None
+
+from . import blockfile
+from . import logger
+
+INDEX_SUFFIX = '.idx'
+
+# Name of article store shared by hub data files in the same directory
+ARTICLE_STORE_FILE = 'habrating_articles.pickle'
+
+_ARTICLE_ID_RE = re.compile(r'/(\d+)/?(?:[?#].*)?$')
+
+def post_key(post_or_url):
+    """
+    Return store key of article: its id from url when possible, url itself otherwise
+        :param post_or_url: parsed post data with 'url' field, article url or article id
+        :return: store key
+        :rtype: string
+    """
+    if isinstance(post_or_url, dict):
+        post_or_url = post_or_url['url']
+    url = str(post_or_url)
+    match = _ARTICLE_ID_RE.search(url)
+    return match.group(1) if match else url
+
+class PostStore:
+    """
+    Append-only data file of pickled posts (the same stream load_db reads)
+    with sidecar index, mapping article key to offset and length of its record
+    """
+    def __init__(self, path_to_file, key=None):
+        """
+        Open store, creating or updating its index if needed
+            :param path_to_file: path to data file
+            :param key: function returning key of stored record, post_key by default
+        """
+        if blockfile.is_block_file(path_to_file):
+            # Blocks are compressed and followed by their index, so records can't be appended
+            raise ValueError(f'{path_to_file} is in block format, which can only be read; convert it back '
+                f'to plain data file by db.save_db(db.load_db(path), path) to crawl or update it')
+        self.path = path_to_file
+        self.key = key or post_key
+        self.index_path = path_to_file + INDEX_SUFFIX
+        self._index = {}
+        # End of indexed records in data file and position of the next unread entry of index file
+        self._indexed_end = 0
+        self._index_position = 0
+        self._reader = None
+        self._writer = None
+        self._index_writer = None
+        self._load_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        "Close all opened files of store"
+        for stream in (self._reader, self._writer, self._index_writer):
+            if stream is not None:
+                stream.close()
+        self._reader = self._writer = self._index_writer = None
+
+    def _load_index(self):
+        if not os.path.exists(self.path):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.index_path)
+            return
+        if os.path.exists(self.index_path):
+            self._read_index_entries()
+        file_size = os.path.getsize(self.path)
+        if self._indexed_end > file_size:
+            logger.warning(f'index of {self.path} is out of date, rebuild it')
+            self._index = {}
+            self._indexed_end = 0
+            self._index_position = 0
+            with open(self.index_path, 'wb'):
+                pass
+        if self._indexed_end < file_size:
+            # Posts were appended bypassing the store (e.g. by append_db), index them
+            self._index_tail(self._indexed_end)
+
+    def _read_index_entries(self):
+        with open(self.index_path, 'rb') as fin:
+            fin.seek(self._index_position)
+            while True:
+                try:
+                    key, offset, length = pickle.load(fin)
+                except EOFError:
+                    break
+                self._index[key] = (offset, length)
+                self._indexed_end = max(self._indexed_end, offset + length)
+                self._index_position = fin.tell()
+
+    def refresh(self):
+        """
+        Index records appended to data file by other stores (e.g. of other processes) since this
+        store was opened or refreshed. Appends of other stores must be locked out meanwhile
+        """
+        if not os.path.exists(self.path):
+            return
+        if os.path.exists(self.index_path):
+            self._read_index_entries()
+        if self._indexed_end < os.path.getsize(self.path):
+            self._index_tail(self._indexed_end)
+
+    def _index_tail(self, offset):
+        with open(self.path, 'rb') as fin:
+            fin.seek(offset)
+            while True:
+                try:
+                    post = pickle.load(fin)
+                except EOFError:
+                    break
+                end = fin.tell()
+                try:
+                    key = self.key(post)
+                except (KeyError, TypeError):
+                    key = f'#{len(self._index)}'
+                self._write_index_entry(key, offset, end - offset)
+                offset = end
+
+    def _write_index_entry(self, key, offset, length):
+        if self._index_writer is None:
+            self._index_writer = open(self.index_path, 'ab')
+        pickle.dump((key, offset, length), self._index_writer)
+        self._index_writer.flush()
+        self._index[key] = (offset, length)
+        self._indexed_end = max(self._indexed_end, offset + length)
+
+    def _read(self, offset, length):
+        if self._reader is None:
+            self._reader = open(self.path, 'rb')
+        self._reader.seek(offset)
+        return pickle.loads(self._reader.read(length))
+
+    def _lookup_key(self, key):
+        if self.key is post_key:
+            return post_key(key)
+        return key if isinstance(key, str) else self.key(key)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return self._lookup_key(key) in self._index
+
+    def contains(self, key):
+        """
+        Check if article is in store
+            :param key: article url, id or parsed post data
+        """
+        return key in self
+
+    def keys(self):
+        "Return keys of stored articles in insertion order"
+        return list(self._index.keys())
+
+    def get(self, key, default=None):
+        """
+        Read one post from store
+            :param key: article url, id or parsed post data
+            :param default: value returned if article is not in store
+        """
+        entry = self._index.get(self._lookup_key(key))
+        if entry is None:
+            return default
+        return self._read(*entry)
+
+    def range(self, start=None, stop=None):
+        """
+        Read posts from start to stop positions (as slice of list of stored posts)
+            :param start: first position
+            :param stop: position after last one
+        """
+        entries = list(self._index.values())[start:stop]
+        return [self._read(*entry) for entry in entries]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if key.step not in (None, 1):
+                raise ValueError('store slicing supports only step 1')
+            return self.range(key.start, key.stop)
+        post = self.get(key)
+        if post is None:
+            raise KeyError(key)
+        return post
+
+    def __iter__(self):
+        for entry in list(self._index.values()):
+            yield self._read(*entry)
+
+    def append(self, post, replace=False):
+        """
+        Append post to store
+            :param post: parsed post data with 'url' field
+            :param replace: if True, replace already stored article, else refuse to store duplicate
+            :return: True if post was stored
+        """
+        key = self.key(post)
+        if key in self._index and not replace:
+            logger.info(f'refuse to store duplicate of {key}')
+            return False
+        if self._writer is None:
+            self._writer = open(self.path, 'ab')
+        record = pickle.dumps(post)
+        # The file may be appended by other process too (see ArticleStore)
+        offset = self._writer.seek(0, os.SEEK_END)
+        self._writer.write(record)
+        self._writer.flush()
+        self._write_index_entry(key, offset, len(record))
+        return True
+
+class BodyRef:
+    """
+    Reference to article body in shared article store, which replaces body in post of hub data file
+    """
+    def __init__(self, digest):
+        """
+            :param digest: content digest of body
+        """
+        self.digest = digest
+
+def article_store_path(path_to_file):
+    """
+    Return path of article store shared by data file with other data files of its directory
+        :param path_to_file: path to hub data file
+    """
+    return os.path.join(os.path.dirname(path_to_file), ARTICLE_STORE_FILE)
+
+@contextlib.contextmanager
+def _locked(path):
+    if fcntl is None:
+        yield
+        return
+    with open(path + '.lock', 'ab') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+class ArticleStore:
+    """
+    Content-addressed store of article bodies, shared by hub data files (see BodyRef).
+    Body is stored once, however many hubs list its article, and crawls of several hubs
+    may append to the store at the same time
+    """
+    def __init__(self, path_to_file):
+        """
+            :param path_to_file: path to store file
+        """
+        # Index of store may be updated on opening, so other crawls are waited for
+        with _locked(path_to_file):
+            self.posts = PostStore(path_to_file, key=lambda record: record['digest'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.posts.close()
+
+    def __len__(self):
+        return len(self.posts)
+
+    def put(self, body):
+        """
+        Store article body, if it isn't stored yet
+            :param body: text of article body
+            :return: BodyRef to stored body
+        """
+        digest = hashlib.sha1(body.encode('utf-8')).hexdigest()
+        if digest not in self.posts:
+            with _locked(self.posts.path):
+                # Crawls of other hubs may have stored the body since the store was opened
+                self.posts.refresh()
+                if digest not in self.posts:
+                    self.posts.append({'digest': digest, 'body': body})
+        return BodyRef(digest)
+
+    def get(self, ref):
+        """
+        Read article body
+            :param ref: BodyRef or content digest of body
+        """
+        digest = ref.digest if isinstance(ref, BodyRef) else ref
+        record = self.posts.get(digest)
+        if record is None:
+            raise KeyError(f'article body {digest} is missing in {self.posts.path}')
+        return record['body']
@@ -0,0 +1,208 @@
+import collections
+import hashlib
+import os
+import pickle
+import numpy as np
+from scipy import sparse as sp
+
+from . import logger
+
+# Cache of token counts of data file is kept next to it, with this suffix
+CACHE_SUFFIX = '.tokens'
+# Version of cache layout, part of cache key
+_VERSION = 1
+# Parameters of CountVectorizer, which define tokens of text (the rest define vocabulary and dtype)
+_TOKENIZER_PARAMS = ('input', 'encoding', 'decode_error', 'strip_accents', 'lowercase', 'preprocessor',
+    'tokenizer', 'stop_words', 'token_pattern', 'ngram_range', 'analyzer')
+
+def tokenizer_settings(vectorizer=None):
+    """
+    Get tokenizer settings of vectorizer
+        :param vectorizer: CountVectorizer, default one if None
+        :return: dict of parameters of CountVectorizer, which define tokens of text
+    """
+    if vectorizer is None:
+        from sklearn.feature_extraction.text import CountVectorizer
+        vectorizer = CountVectorizer()
+    params = vectorizer.get_params()
+    return {name: params[name] for name in _TOKENIZER_PARAMS}
+
+class FieldCounts:
+    """
+    Counts of terms in one text field of every post of data file
+    """
+    def __init__(self, terms, counts, settings):
+        """
+            :param terms: list of all terms of field, index of term in list is its id
+            :param counts: CSR matrix of counts of terms (columns) in posts (rows)
+            :param settings: tokenizer settings of counts (see tokenizer_settings)
+        """
+        self.terms = terms
+        self.counts = counts
+        self.settings = settings
+        # Count of posts with every term
+        self.document_frequency = np.bincount(counts.indices, minlength=len(terms))
+        # Vocabulary of the last vectorizer of transform and columns of its terms in counts
+        self._selector = (None, None)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_selector'] = (None, None)
+        return state
+
+    @classmethod
+    def count(cls, texts, settings):
+        """
+        Tokenize texts and count their terms
+            :param texts: iterable of texts
+            :param settings: tokenizer settings (see tokenizer_settings)
+        """
+        from sklearn.feature_extraction.text import CountVectorizer
+        analyze = CountVectorizer(**settings).build_analyzer()
+        # New term gets the next id, as in CountVectorizer.fit
+        vocabulary = collections.defaultdict()
+        vocabulary.default_factory = vocabulary.__len__
+        indices, values, indptr = [], [], [0]
+        for text in texts:
+            term_counts = collections.Counter(analyze(text))
+            indices.extend(vocabulary[term] for term in term_counts)
+            values.extend(term_counts.values())
+            indptr.append(len(indices))
+        counts = sp.csr_matrix((np.asarray(values, dtype=np.int32), np.asarray(indices, dtype=np.int32),
+            np.asarray(indptr, dtype=np.int64)), shape=(len(indptr) - 1, len(vocabulary)))
+        counts.sort_indices()
+        return cls(list(vocabulary), counts, settings)
+
+    def fit_vectorizer(self, min_df=1, max_features=None, dtype=np.int8):
+        """
+        Make CountVectorizer with the same vocabulary, as it would have after fit on texts of field
+            :param min_df: minimal count (int) or part (float) of posts with term for term to go to vocabulary
+            :param max_features: maximal size of vocabulary, None if unlimited
+            :param dtype: dtype of vectors of vectorizer
+        """
+        from sklearn.feature_extraction.text import CountVectorizer
+        vectorizer = CountVectorizer(**self.settings, min_df=min_df, max_features=max_features, dtype=dtype)
+        posts = self.counts.shape[0]
+        min_count = min_df if isinstance(min_df, int) else min_df * posts
+        if posts < min_count:
+            raise ValueError('max_df corresponds to < documents than min_df')
+        # The same selection as CountVectorizer.fit does: terms are sorted by name, pruned by
+        # document frequency and limited to max_features most frequent ones. Counts are summed
+        # in dtype of vectorizer, as fit sums its vectors
+        order = np.array(sorted(range(len(self.terms)), key=self.terms.__getitem__), dtype=np.int64)
+        mask = self.document_frequency[order] >= min_count
+        if max_features is not None and mask.sum() > max_features:
+            frequency = np.bincount(self.counts.indices, weights=self.counts.data.astype(dtype),
+                minlength=len(self.terms)).astype(np.int64)[order]
+            mask_indices = (-frequency[mask]).argsort()[:max_features]
+            limited_mask = np.zeros(len(mask), dtype=bool)
+            limited_mask[np.where(mask)[0][mask_indices]] = True
+            mask = limited_mask
+        if not mask.any():
+            raise ValueError('After pruning, no terms remain. Try a lower min_df or a higher max_df.')
+        vectorizer.vocabulary_ = {self.terms[term_id]: column for column, term_id in enumerate(order[mask])}
+        vectorizer.fixed_vocabulary_ = False
+        return vectorizer
+
+    def transform(self, vectorizer, start=0, stop=None):
+        """
+        Get vectors of posts of data file without tokenization of their texts
+            :param vectorizer: CountVectorizer with tokenizer settings of counts
+            :param start: index of first post
+            :param stop: index after last post, None for the end of data file
+            :return: CSR matrix equal to vectorizer.transform of texts of posts
+        """
+        vocabulary, columns = self._selector
+        if vocabulary is not vectorizer.vocabulary_:
+            ids = {term: term_id for term_id, term in enumerate(self.terms)}
+            # Column of every term of counts in vectors, -1 for terms out of vocabulary
+            columns = np.full(len(self.terms), -1, dtype=np.int64)
+            for term, column in vectorizer.vocabulary_.items():
+                if term in ids:
+                    columns[ids[term]] = column
+            self._selector = (vectorizer.vocabulary_, columns)
+        rows = self.counts[start:stop]
+        row_columns = columns[rows.indices]
+        kept = row_columns >= 0
+        kept_before = np.concatenate([[0], np.cumsum(kept)])
+        vectors = sp.csr_matrix((rows.data[kept].astype(vectorizer.dtype), row_columns[kept], kept_before[rows.indptr]),
+            shape=(rows.shape[0], len(vectorizer.vocabulary_)))
+        vectors.sort_indices()
+        return vectors
+
+class TokenCounts:
+    """
+    Token counts of bodies and titles of posts of data file
+    """
+    def __init__(self, key, body, title):
+        """
+            :param key: cache key (see cache_key)
+            :param body: FieldCounts of bodies
+            :param title: FieldCounts of titles
+        """
+        self.key = key
+        self.body = body
+        self.title = title
+
+    def __len__(self):
+        return self.body.counts.shape[0]
+
+    def fit_vectorizers(self, cutoff=2, text_max_size=20000, title_max_size=500):
+        """
+        Make vectorizers for post body and title, as db._fit_text_transformers does on texts
+            :param cutoff: minimal entries count for a word to go to dict
+            :param text_max_size: maximal size of body vocabulary
+            :param title_max_size: maximal size of title vocabulary
+        """
+        return (self.body.fit_vectorizer(cutoff, text_max_size),
+            self.title.fit_vectorizer(cutoff, title_max_size))
+
+def cache_key(path_to_file, settings):
+    """
+    Get key of token counts of data file: hash of its content and tokenizer settings
+        :param path_to_file: path to data file
+        :param settings: tokenizer settings (see tokenizer_settings)
+    """
+    digest = hashlib.sha1(f'{_VERSION} {sorted(settings.items())!r}'.encode('utf-8'))
+    with open(path_to_file, 'rb') as fin:
+        for chunk in iter(lambda: fin.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def token_counts(path_to_file, settings=None):
+    """
+    Get token counts of data file from its cache. If there is no cache for the current
+    content of data file and tokenizer settings, posts are tokenized and cache is rewritten
+        :param path_to_file: path to data file
+        :param settings: tokenizer settings, the ones of default CountVectorizer if None
+        :return: TokenCounts
+    """
+    from . import db
+    if settings is None:
+        settings = tokenizer_settings()
+    key = cache_key(path_to_file, settings)
+    cache_path = path_to_file + CACHE_SUFFIX
+    try:
+        with open(cache_path, 'rb') as fin:
+            cached = pickle.load(fin)
+        if cached.key == key:
+            return cached
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f'token cache {cache_path} is broken, counting tokens again: {repr(e)}')
+
+    titles = []
+    def bodies():
+        # One pass over data file for both fields, titles are short
+        for post in db.iter_db(path_to_file):
+            titles.append(post['title'])
+            yield post['body']
+    body = FieldCounts.count(bodies(), settings)
+    title = FieldCounts.count(titles, settings)
+    counts = TokenCounts(key, body, title)
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as fout:
+        pickle.dump(counts, fout, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+    return counts
@@ -1,10 +1,18 @@
-import progressbar
-
-def get_bar(maxval):
+def get_bar(maxval, title=None):
     """
     Return customized progress bar
-        :param maxval: maxval for bar
+        :param maxval: maxval for bar. If None, bar only counts processed entries
+        :param title: optional prefix for unknown length bar
     """
+    import progressbar
+    if maxval is None:
+        widgets = [
+        '[', progressbar.Timer(), '] ',
+        progressbar.Counter(format='[processed %s entries]')
+        ]
+        if title:
+            widgets.insert(0, title)
+        return progressbar.ProgressBar(maxval=progressbar.UnknownLength, widgets=widgets)
     widgets=[
     '[', progressbar.Timer(), '] ',
     '[', progressbar.SimpleProgress(), '] ',
@@ -12,3 +20,18 @@ def get_bar(maxval):
     ' [', progressbar.ETA(format="ETA: %S"), '] ',
     ]
     return progressbar.ProgressBar(maxval=maxval, widgets=widgets)
+
+def batches(iterable, batch_size):
+    """
+    Split iterable into lists of batch_size items (the last one may be shorter)
+        :param iterable: source of items
+        :param batch_size: count of items in one batch
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import os
+import tempfile
+import threading
+import unittest
+import sys
+from unittest import mock
+import colour_runner.runner as crr
+sys.path.append('../src')
+
+from habrating import cache
+
+class TestPageClass(unittest.TestCase):
+    def test_page_class(self):
+        self.assertEqual(cache.page_class('https://habr.com/hub/python/page3/'), 'listing')
+        self.assertEqual(cache.page_class('https://habr.com/users/alice'), 'author')
+        self.assertEqual(cache.page_class('https://habr.com/post/123456/'), 'article')
+        self.assertEqual(cache.page_class('https://habr.com/company/habr/blog/123456'), 'article')
+        self.assertEqual(cache.page_class('https://habr.com/about/'), 'other')
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.cache = cache.ResponseCache(self.cache_dir.name)
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def test_put_get(self):
+        url = 'https://habr.com/post/1/'
+        self.assertIsNone(self.cache.get(url))
+        self.cache.put(url, b'<html></html>', 200, {'Content-Type': 'text/html'}, 'https://habr.com/post/1')
+        entry = self.cache.get(url)
+        self.assertEqual(entry['body'], b'<html></html>')
+        self.assertEqual(entry['status'], 200)
+        self.assertEqual(entry['headers'], {'Content-Type': 'text/html'})
+        self.assertEqual(entry['url'], 'https://habr.com/post/1')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        # Entry is on disk, so another cache instance sees it
+        self.assertIsNotNone(cache.ResponseCache(self.cache_dir.name).get(url))
+
+    def test_ttl_by_page_class(self):
+        urls = {page_class: url for page_class, url in [('listing', 'https://habr.com/hub/python/'),
+            ('author', 'https://habr.com/users/alice'), ('article', 'https://habr.com/post/1/')]}
+        with mock.patch.object(cache.time, 'time', return_value=1000.0):
+            for url in urls.values():
+                self.cache.put(url, b'page')
+        # Listing expires after 30 minutes, author page after a day, article after a week
+        for age, alive in [(cache.TTL['listing'] - 1, {'listing', 'author', 'article'}),
+                (cache.TTL['listing'] + 1, {'author', 'article'}),
+                (cache.TTL['author'] + 1, {'article'}),
+                (cache.TTL['article'] + 1, set())]:
+            with mock.patch.object(cache.time, 'time', return_value=1000.0 + age):
+                self.assertEqual({page_class for page_class, url in urls.items()
+                    if self.cache.get(url) is not None}, alive)
+
+    def test_broken_entry(self):
+        url = 'https://habr.com/post/1/'
+        self.cache.put(url, b'page')
+        with open(self.cache._path(url), 'wb') as fout:
+            fout.write(b'\x80')
+        self.assertIsNone(self.cache.get(url))
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_atomic_writes(self):
+        url = 'https://habr.com/post/1/'
+        bodies = [bytes([value]) * 100000 for value in range(1, 5)]
+        stop = threading.Event()
+        seen = []
+        def read():
+            while not stop.is_set():
+                entry = self.cache.get(url)
+                if entry is not None:
+                    seen.append(entry['body'])
+        reader = threading.Thread(target=read)
+        reader.start()
+        try:
+            for _ in range(20):
+                for body in bodies:
+                    self.cache.put(url, body)
+        finally:
+            stop.set()
+            reader.join()
+        # Readers see whole entries only and no temporary files are left
+        self.assertTrue(all(body in bodies for body in seen))
+        self.assertEqual(os.listdir(os.path.dirname(self.cache._path(url))), [os.path.basename(self.cache._path(url))])
+
+if __name__ == '__main__':
+    unittest.main(testRunner=crr.ColourTextTestRunner, verbosity=2)
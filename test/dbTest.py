@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import os
+import unittest
+import sys
+import tempfile
+import colour_runner.runner as crr
+sys.path.append('../src')
+
+from habrating import blockfile, db, store, tokencache
+
+def make_posts():
+    posts = []
+    for i in range(6):
+        posts.append({
+            'year': 2017,
+            'title': f'заголовок номер {i}',
+            'body': f'текст статьи номер {i} про python и про данные ' * (i + 1),
+            'body length': 10 * i,
+            'company rating': 0.0,
+            'rating': i - 2,
+            'comments': i,
+            'views': 100 * i,
+            'bookmarks': i,
+            'author karma': 1.5 * i,
+            'author rating': 2 * i,
+            'author followers': 3 * i
+        })
+    return posts
+
+class TestIterDb(unittest.TestCase):
+    def test_batches(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'hub.pickle')
+            db.save_db(make_posts(), path)
+            self.assertEqual(list(db.iter_db(path)), make_posts())
+            self.assertEqual([len(batch) for batch in db.iter_db(path, batch_size=4)], [4, 2])
+            self.assertEqual(db.load_db(path), make_posts())
+
+class TestBlockDb(unittest.TestCase):
+    def test_block_format(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'hub.pickle')
+            db.save_db(make_posts(), path, block_size=4, codec='lzma')
+            self.assertTrue(blockfile.is_block_file(path))
+            self.assertEqual([count for _, _, count in blockfile.read_index(path)['blocks']], [4, 2])
+            self.assertEqual(list(db.iter_db(path)), make_posts())
+            self.assertEqual(db.load_db(path, workers=2), make_posts())
+            with self.assertRaises(ValueError):
+                store.PostStore(path)
+
+    def test_block_vec_db(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            text_path = os.path.join(tmp, 'hub.pickle')
+            space_path = os.path.join(tmp, 'space_hub.pickle')
+            db.save_db(make_posts(), text_path, block_size=2)
+            X = {}
+            for workers in (1, 2):
+                vec_path = os.path.join(tmp, f'vec_hub{workers}.pickle')
+                db.cvt_text_db_to_vec_db(text_path, vec_path, space_path, batch_size=2, workers=workers, block_size=2)
+                X[workers], y = db.cvt_db_to_DataFrames(vec_path, workers=2)
+                self.assertEqual(sorted(y), [i - 2 for i in range(6)])
+            self.assertTrue(blockfile.is_block_file(os.path.join(tmp, 'vec_hub2.pickle.part0')))
+            self.assertEqual(sorted(map(tuple, X[1])), sorted(map(tuple, X[2])))
+
+class TestTokenCache(unittest.TestCase):
+    def test_vectorizers_from_counts(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'hub.pickle')
+            db.save_db(make_posts(), path)
+            token_counts = tokencache.token_counts(path)
+            self.assertTrue(os.path.exists(path + tokencache.CACHE_SUFFIX))
+            for cutoff, text_max_size in [(1, 5), (2, 20000), (1, None)]:
+                fitted = db._fit_text_transformers(make_posts(), cutoff, text_max_size, 3)
+                cached = db._fit_text_transformers(token_counts, cutoff, text_max_size, 3)
+                for fitted_vectorizer, cached_vectorizer, field in zip(fitted, cached, ['body', 'title']):
+                    self.assertEqual(cached_vectorizer.vocabulary_, fitted_vectorizer.vocabulary_)
+                    texts = [post[field] for post in make_posts()]
+                    vectors = getattr(token_counts, field).transform(cached_vectorizer, 1, 4)
+                    self.assertTrue((vectors.toarray() == fitted_vectorizer.transform(texts[1:4]).toarray()).all())
+
+    def test_cache_key(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'hub.pickle')
+            db.save_db(make_posts(), path)
+            key = tokencache.token_counts(path).key
+            self.assertEqual(tokencache.token_counts(path).key, key)
+            db.save_db(make_posts()[1:], path)
+            token_counts = tokencache.token_counts(path)
+            self.assertNotEqual(token_counts.key, key)
+            self.assertEqual(len(token_counts), 5)
+
+class TestPostStore(unittest.TestCase):
+    def test_random_access_and_duplicates(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'hub.pickle')
+            posts = make_posts()
+            for i, post in enumerate(posts):
+                post['url'] = f'https://habrahabr.ru/post/{1000 + i}/'
+            with store.PostStore(path) as post_store:
+                for post in posts:
+                    self.assertTrue(post_store.append(post))
+                self.assertFalse(post_store.append(posts[0]))
+                replaced = dict(posts[1], rating=100)
+                self.assertTrue(post_store.append(replaced, replace=True))
+            post_store = store.PostStore(path)
+            self.assertEqual(len(post_store), 6)
+            self.assertTrue(post_store.contains('https://habrahabr.ru/post/1003/'))
+            self.assertIn(1005, post_store)
+            self.assertNotIn('https://habrahabr.ru/post/999/', post_store)
+            self.assertEqual(post_store.get(1001)['rating'], 100)
+            self.assertEqual([post['rating'] for post in post_store[2:4]], [0, 1])
+            post_store.close()
+            self.assertEqual([post['rating'] for post in db.load_db(path)], [-2, 100, 0, 1, 2, 3])
+
+    def test_index_unindexed_tail(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'hub.pickle')
+            posts = make_posts()
+            for i, post in enumerate(posts):
+                post['url'] = f'https://habrahabr.ru/post/{1000 + i}/'
+            db.save_db(posts[:3], path)
+            with store.PostStore(path) as post_store:
+                self.assertEqual(post_store.keys(), ['1000', '1001', '1002'])
+            db.append_db(posts[3], path)
+            with store.PostStore(path) as post_store:
+                self.assertEqual(post_store.get('1003'), posts[3])
+
+class TestArticleStore(unittest.TestCase):
+    def test_shared_bodies(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            first, second = os.path.join(tmp, 'first.pickle'), os.path.join(tmp, 'second.pickle')
+            db.save_db(make_posts(), first)
+            db.save_db(make_posts()[3:] + [dict(make_posts()[0], body='другой текст')], second)
+            self.assertEqual(db.share_bodies(first), 6)
+            self.assertEqual(db.share_bodies(second), 1)
+            with store.ArticleStore(store.article_store_path(first)) as article_store:
+                self.assertEqual(len(article_store), 7)
+            self.assertEqual(db.load_db(first), make_posts())
+            self.assertEqual(list(db.iter_db(second))[-1]['body'], 'другой текст')
+            with store.PostStore(first) as post_store:
+                self.assertIsInstance(post_store.range(0, 1)[0]['body'], store.BodyRef)
+
+    def test_concurrent_writers(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, store.ARTICLE_STORE_FILE)
+            first, second = store.ArticleStore(path), store.ArticleStore(path)
+            with first, second:
+                first.put('общий текст')
+                second.put('общий текст')
+                second.put('текст второго')
+                first.put('текст второго')
+                self.assertEqual(second.get(first.put('общий текст')), 'общий текст')
+            with open(path, 'rb') as fin:
+                records = list(db._iter_pickle_stream(fin))
+            self.assertEqual(len(records), 2)
+            with store.ArticleStore(path) as article_store:
+                self.assertEqual(len(article_store), 2)
+
+class TestSparseVectorize(unittest.TestCase):
+    def test_sparse_equals_dense(self):
+        body_vectorizer, title_vectorizer = db._fit_text_transformers(make_posts(), cutoff=1)
+        dense_posts, sparse_posts = make_posts(), make_posts()
+        for post in dense_posts:
+            db.vectorize_post(post, body_vectorizer, title_vectorizer)
+        for post in sparse_posts:
+            db.vectorize_post(post, body_vectorizer, title_vectorizer, sparse=True)
+        X_dense, y_dense = db.cvt_to_DataFrames(dense_posts)
+        X_sparse, y_sparse = db.cvt_to_DataFrames(sparse_posts)
+        self.assertEqual(X_sparse.format, 'csr')
+        self.assertEqual(X_sparse.shape, X_dense.shape)
+        self.assertTrue((X_sparse.toarray() == X_dense).all())
+        self.assertTrue((y_sparse == y_dense).all())
+
+    def test_sparse_vec_db(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            text_path = os.path.join(tmp, 'hub.pickle')
+            vec_path = os.path.join(tmp, 'vec_hub.pickle')
+            space_path = os.path.join(tmp, 'space_hub.pickle')
+            db.save_db(make_posts(), text_path)
+            db.cvt_text_db_to_vec_db(text_path, vec_path, space_path, sparse=True)
+            X, y = db.cvt_db_to_DataFrames(vec_path)
+            self.assertEqual(X.format, 'csr')
+            self.assertEqual(X.shape[0], 6)
+            self.assertEqual(list(y), [i - 2 for i in range(6)])
+
+class TestShardedVecDb(unittest.TestCase):
+    def test_parallel_conversion(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            text_path = os.path.join(tmp, 'hub.pickle')
+            vec_path = os.path.join(tmp, 'vec_hub.pickle')
+            space_path = os.path.join(tmp, 'space_hub.pickle')
+            db.save_db(make_posts(), text_path)
+            db.cvt_text_db_to_vec_db(text_path, vec_path, space_path, batch_size=2, workers=2)
+            self.assertTrue(os.path.exists(vec_path + '.part1'))
+            ratings = sorted(post['rating'] for post in db.load_db(vec_path))
+            self.assertEqual(ratings, [i - 2 for i in range(6)])
+            X, y = db.cvt_db_to_DataFrames(vec_path)
+            self.assertEqual(X.shape[0], 6)
+
+    def test_worker_vectorization(self):
+        # Without token cache (and with hashing space, which has none) posts are vectorized by workers
+        for feature_space, token_cache in [('count', False), ('hashing', False), ('hashing', True)]:
+            with self.subTest(feature_space=feature_space, token_cache=token_cache), \
+                    tempfile.TemporaryDirectory() as tmp:
+                text_path = os.path.join(tmp, 'hub.pickle')
+                space_path = os.path.join(tmp, 'space_hub.pickle')
+                db.save_db(make_posts(), text_path)
+                features = {}
+                for workers in (1, 2):
+                    vec_path = os.path.join(tmp, f'vec_hub{workers}.pickle')
+                    db.cvt_text_db_to_vec_db(text_path, vec_path, space_path, batch_size=2, workers=workers,
+                        feature_space=feature_space, token_cache=token_cache)
+                    # Shards keep posts in order of their workers
+                    posts = sorted(db.load_db(vec_path), key=lambda post: post['rating'])
+                    features[workers] = db.cvt_to_DataFrames(posts)
+                self.assertFalse(os.path.exists(text_path + tokencache.CACHE_SUFFIX))
+                self.assertTrue(os.path.exists(os.path.join(tmp, 'vec_hub2.pickle.part1')))
+                self.assertTrue((features[2][0] == features[1][0]).all())
+                self.assertTrue((features[2][1] == features[1][1]).all())
+
+if __name__ == '__main__':
+    unittest.main(testRunner=crr.ColourTextTestRunner, verbosity=2)
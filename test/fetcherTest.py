@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import asyncio
+import collections
+import tempfile
+import threading
+import unittest
+import sys
+import zlib
+import colour_runner.runner as crr
+import aiohttp
+from aiohttp import web
+from scrapy import Request
+from scrapy.downloadermiddlewares.httpcompression import HttpCompressionMiddleware
+from scrapy.http import HtmlResponse
+from scrapy.settings import Settings
+from scrapy.utils.test import get_crawler
+sys.path.append('../src')
+
+from habrating import cache, extractor, fetcher, parser
+from habrTest import ARTICLE_PAGE
+
+AUTHOR_PAGE = '<html><body>' + ''.join(f'<div class="stacked-counter__value">{value}</div>'
+    for value in ('12,5', '3k', '40')) + '</body></html>'
+
+class LocalSite:
+    """
+    Local aiohttp server with gzip-compressed articles of author alice, which counts requests
+    by path. Path /flaky/<id>/ answers 503 to the first request, /broken/<id>/ always answers 503
+    """
+    def __init__(self):
+        self.requests = collections.Counter()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        app = web.Application()
+        app.router.add_get('/users/{author}', self._author)
+        app.router.add_get('/{kind}/{id}/', self._article)
+        self._runner = web.AppRunner(app)
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+
+    async def _start(self):
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.port}{path}'
+
+    async def _article(self, request):
+        self.requests[request.path] += 1
+        kind = request.match_info['kind']
+        if kind == 'broken' or (kind == 'flaky' and self.requests[request.path] == 1):
+            raise web.HTTPServiceUnavailable()
+        response = web.Response(text=ARTICLE_PAGE, content_type='text/html')
+        response.enable_compression(web.ContentCoding.gzip)
+        return response
+
+    async def _author(self, request):
+        self.requests[request.path] += 1
+        # Slow enough for concurrent articles to wait for the same request
+        await asyncio.sleep(0.2)
+        return web.Response(text=AUTHOR_PAGE, content_type='text/html')
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+class TestArticleFetcher(unittest.TestCase):
+    def setUp(self):
+        self.site = LocalSite()
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.fetcher = fetcher.ArticleFetcher(concurrency=4, timeout=5, retries=2)
+        self.fetcher.cache = cache.ResponseCache(self.cache_dir.name)
+
+    def tearDown(self):
+        self.fetcher.close()
+        self.site.close()
+        self.cache_dir.cleanup()
+
+    def test_parse_articles(self):
+        urls = [self.site.url(f'/post/{post_id}/') for post_id in range(3)]
+        posts = self.fetcher.parse_articles(urls)
+        self.assertEqual([post['url'] for post in posts], urls)
+        self.assertEqual(posts[0]['views'], 3200)
+        self.assertEqual(posts[0]['author rating'], 3000)
+        # Articles of the same author share one request of author page
+        self.assertEqual(self.site.requests['/users/alice'], 1)
+        # Repeated call is served by cache and memoized author stats
+        self.assertEqual(self.fetcher.parse_articles(urls[:1]), posts[:1])
+        self.assertEqual(sum(self.site.requests.values()), 4)
+
+    def test_retries(self):
+        post, = self.fetcher.parse_articles([self.site.url('/flaky/1/')])
+        self.assertEqual(post['rating'], -3)
+        self.assertEqual(self.site.requests['/flaky/1/'], 2)
+        with self.assertRaises(aiohttp.ClientResponseError) as raised:
+            self.fetcher.parse_articles([self.site.url('/broken/1/')])
+        self.assertEqual(raised.exception.status, 503)
+        self.assertEqual(self.site.requests['/broken/1/'], self.fetcher.retries + 1)
+
+    def test_read_crawl_cache(self):
+        storage = parser.ResponseCacheStorage(Settings({'HABR_CACHE_DIR': self.cache_dir.name}))
+        cached_url, redirect_url = self.site.url('/post/1/'), self.site.url('/post/2/')
+        # Crawls cache responses before they are decompressed, and redirects too
+        storage.store_response(None, Request(cached_url), HtmlResponse(cached_url, status=200,
+            headers={'Content-Encoding': 'deflate'}, body=zlib.compress(ARTICLE_PAGE.encode('utf-8'))))
+        storage.store_response(None, Request(redirect_url), HtmlResponse(redirect_url, status=301,
+            headers={'Location': cached_url}, body=b''))
+        posts = self.fetcher.parse_articles([cached_url, redirect_url])
+        self.assertEqual([post['title'] for post in posts], ['Заголовок'] * 2)
+        self.assertEqual(self.site.requests['/post/1/'], 0)
+        self.assertEqual(self.site.requests['/post/2/'], 1)
+
+    def test_write_crawl_cache(self):
+        url = self.site.url('/post/1/')
+        post, = self.fetcher.parse_articles([url])
+        storage = parser.ResponseCacheStorage(Settings({'HABR_CACHE_DIR': self.cache_dir.name}))
+        request = Request(url)
+        response = storage.retrieve_response(None, request)
+        self.assertNotIn(b'Content-Encoding', response.headers)
+        # Cached response goes through the same middleware as downloaded one
+        crawler = get_crawler()
+        response = HttpCompressionMiddleware.from_crawler(crawler).process_response(request, response)
+        self.assertEqual(extractor.extract_post(response.selector.root, response.url)[0]['title'], post['title'])
+
+    def test_close(self):
+        self.fetcher.parse_articles([self.site.url('/post/1/')])
+        self.fetcher.close()
+        self.assertIsNone(self.fetcher._session)
+        self.assertFalse(self.fetcher._thread.is_alive())
+        self.assertFalse(self.fetcher._loop.is_running())
+
+if __name__ == '__main__':
+    unittest.main(testRunner=crr.ColourTextTestRunner, verbosity=2)
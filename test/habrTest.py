@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
 # encoding: utf-8
 
+import os
+import tempfile
 import unittest
 import sys
+from unittest import mock
 import colour_runner.runner as crr
 sys.path.append('../src')
 
-from habrating import parser, db
+from habrating import parser, db, extractor
 
 class TestViewsNormalize(unittest.TestCase):
     def test1(self):
@@ -26,5 +29,57 @@ class TestViewsNormalize(unittest.TestCase):
         e = 20000
         self.assertEqual(parser._normalize_views_count(s),e)
 
+ARTICLE_PAGE = """<html><body>
+<sup class="page-header__stats-value page-header__stats-value_branding">12,5</sup>
+<span class="post__time">5 марта 2017 в 10:00</span>
+<h1 class="post__title post__title_full"><span class="post__title-text">Заголовок</span></h1>
+<div class="post__text post__text-html js-mediator-article">Текст <code>print(1)</code> после кода
+<p>Абзац<code>x</code> конец</p></div>
+<span class="voting-wjt__counter voting-wjt__counter_positive">–3</span>
+<strong class="comments-section__head-counter">7</strong>
+<span class="post-stats__views-count">3,2k</span>
+<span class="bookmark__counter js-favs_count">12</span>
+<span class="user-info__nickname user-info__nickname_small">alice</span>
+<span class="voting-wjt__counter">+100</span>
+</body></html>"""
+
+class TestExtractor(unittest.TestCase):
+    def test_post_fields(self):
+        post, author = extractor.extract_post(extractor.parse_html(ARTICLE_PAGE.encode('utf-8')), 'url')
+        self.assertEqual(author, 'alice')
+        self.assertEqual(post, {
+            'url': 'url',
+            'year': 2017,
+            'title': 'Заголовок',
+            'body': 'текст  после кода\nабзац конец',
+            'body length': 29,
+            'company rating': 12.5,
+            'rating': -3,
+            'comments': 7,
+            'views': 3200,
+            'bookmarks': 12
+        })
+
+    def test_author_stats(self):
+        page = '<html><body>' + ''.join(f'<div class="stacked-counter__value">{value}</div>'
+            for value in ('12,5', '3k', '40')) + '</body></html>'
+        stats = extractor.extract_author_stats(extractor.parse_html(page.encode('utf-8')))
+        self.assertEqual(stats, {'author karma': 12, 'author rating': 3000, 'author followers': 40})
+
+class TestSaveHub(unittest.TestCase):
+    def test_interrupted_crawl(self):
+        class InterruptedCrawl:
+            def __init__(self, *args):
+                self.exitcode = 1
+            def start(self):
+                pass
+            def join(self):
+                pass
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'hub.pickle')
+            with mock.patch.object(parser, 'CrawlerThread', InterruptedCrawl):
+                self.assertFalse(parser.save_hub_to_db('hub', path))
+            self.assertFalse(parser._load_crawl_checkpoint(path + parser.CHECKPOINT_SUFFIX)['complete'])
+
 if __name__ == '__main__':
     unittest.main(testRunner=crr.ColourTextTestRunner, verbosity=2) 
\ No newline at end of file
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import json
+import os
+import unittest
+import sys
+import tempfile
+import colour_runner.runner as crr
+sys.path.append('../src')
+
+from habrating import metrics
+
+class TestStages(unittest.TestCase):
+    def setUp(self):
+        self.records = []
+        self.saved_sinks = metrics.sinks[:]
+        metrics.sinks[:] = [self.records.append]
+
+    def tearDown(self):
+        metrics.sinks[:] = self.saved_sinks
+
+    def test_nested_stages(self):
+        with metrics.stage('build', hub='python'):
+            with metrics.stage('vectorize') as vectorize_stage:
+                data = [bytearray(2**20) for _ in range(8)]
+                vectorize_stage.items = len(data)
+        inner, outer = self.records
+        self.assertEqual(inner['path'], 'build/vectorize')
+        self.assertEqual(inner['hub'], 'python')
+        self.assertEqual(inner['items'], 8)
+        self.assertFalse(inner['failed'])
+        self.assertEqual(outer['path'], 'build')
+        self.assertIsNone(outer['items'])
+        self.assertGreaterEqual(outer['wall_sec'], inner['wall_sec'])
+
+    def test_failed_stage_and_file_sink(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'metrics.jsonl')
+            metrics.sinks.append(metrics.FileSink(path))
+            with self.assertRaises(ValueError):
+                with metrics.stage('fit'):
+                    raise ValueError('bad data')
+            with open(path) as fin:
+                records = [json.loads(line) for line in fin]
+        self.assertEqual(len(records), 1)
+        self.assertTrue(records[0]['failed'])
+        self.assertEqual(records[0], self.records[0])
+
+if __name__ == '__main__':
+    unittest.main(testRunner=crr.ColourTextTestRunner, verbosity=2)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import os
+import pickle
+import unittest
+import sys
+import tempfile
+import colour_runner.runner as crr
+import numpy as np
+sys.path.append('../src')
+
+from habrating import db, model
+from dbTest import make_posts
+
+class TestMappedModel(unittest.TestCase):
+    def test_same_predictions(self):
+        posts = make_posts() * 5
+        hub = model.HabrHubRatingRegressor('test')
+        hub.estimator.set_params(n_estimators=5, verbose=0, random_state=0)
+        hub.set_transformers(*db._fit_text_transformers(posts, cutoff=1))
+        vectorized = make_posts() * 5
+        db.vectorize_posts(vectorized, hub.text_transformer, hub.title_transformer)
+        X, y = db.cvt_to_DataFrames(vectorized)
+        hub.fit(X, y)
+        with tempfile.TemporaryDirectory() as tmp:
+            src_path = os.path.join(tmp, 'test.hubmodel64')
+            hub.save(src_path)
+            mapped = model.load_model(model.convert_model(src_path))
+            self.assertEqual(mapped.hub_name, 'test')
+            self.assertTrue(np.array_equal(mapped.predict(X), hub.predict(X)))
+            self.assertTrue(np.array_equal(mapped.predict_by_posts(make_posts()), hub.predict_by_posts(make_posts())))
+
+    def test_hashing_feature_space(self):
+        hub = model.HabrHubRatingRegressor('test')
+        hub.estimator.set_params(n_estimators=5, verbose=0, random_state=0)
+        hub.set_transformers(*db._hashing_text_transformers())
+        vectorized = make_posts() * 5
+        db.vectorize_posts(vectorized, hub.text_transformer, hub.title_transformer, sparse=True)
+        X, y = db.cvt_to_DataFrames(vectorized)
+        hub.fit(X, y)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'test.hubmodel64.mmap')
+            hub.save_mapped(path)
+            mapped = model.load_model(path)
+            self.assertTrue(np.array_equal(mapped.predict_by_posts(make_posts()), hub.predict_by_posts(make_posts())))
+
+class TestIncrementalModel(unittest.TestCase):
+    def test_grow_and_update(self):
+        hub = model.HabrHubRatingRegressor('test')
+        hub.estimator.set_params(verbose=0, random_state=0)
+        hub.set_transformers(*db._fit_text_transformers(make_posts(), cutoff=1))
+        self.assertEqual(hub.partial_fit_posts(make_posts() + make_posts(), batch_size=6, n_estimators=3), 12)
+        self.assertEqual(len(hub.estimator.estimators_), 6)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'test.hubmodel64')
+            hub.save(path)
+            hub.save_mapped(path + '.mmap')
+            self.assertEqual(model.update_model(path, make_posts(), trees_per_batch=2), 6)
+            self.assertEqual(len(model.load_model(path).estimator.estimators_), 8)
+            self.assertEqual(model.update_model(path + '.mmap', make_posts(), trees_per_batch=2), 6)
+            mapped = model.load_model(path + '.mmap')
+            self.assertEqual(len(mapped.estimator.roots), 8)
+            self.assertEqual(model.update_model(path, []), 0)
+            predictions = mapped.predict_by_posts(make_posts())
+            self.assertTrue(np.all(np.isfinite(predictions)))
+
+    def test_fit_after_partial_fit(self):
+        hub = model.HabrHubRatingRegressor('test')
+        hub.estimator.set_params(verbose=0, random_state=0)
+        hub.set_transformers(*db._fit_text_transformers(make_posts(), cutoff=1))
+        hub.partial_fit_posts(make_posts(), n_estimators=3)
+        self.assertFalse(hub.estimator.warm_start)
+        old_trees = list(hub.estimator.estimators_)
+        vectorized = make_posts()
+        db.vectorize_posts(vectorized, hub.text_transformer, hub.title_transformer)
+        hub.fit(*db.cvt_to_DataFrames(vectorized))
+        self.assertEqual(len(hub.estimator.estimators_), 3)
+        self.assertFalse(any(tree in old_trees for tree in hub.estimator.estimators_))
+
+class TestReducedModel(unittest.TestCase):
+    def test_reduction_is_saved(self):
+        for reduction in ['select', 'svd']:
+            hub = model.HabrHubRatingRegressor('test')
+            hub.estimator.set_params(n_estimators=5, verbose=0, random_state=0)
+            hub.set_transformers(*db._fit_text_transformers(make_posts(), cutoff=1))
+            vectorized = make_posts()
+            db.vectorize_posts(vectorized, hub.text_transformer, hub.title_transformer, sparse=True)
+            X, y = db.cvt_to_DataFrames(vectorized)
+            hub.fit_reduced(X, y, reduction, n_features=4)
+            self.assertEqual(hub.reducer.transform(X).shape[1], 4 if reduction == 'select' else 4 + len(db.FEATURE_KEYS))
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'test.hubmodel64')
+                hub.save(path)
+                hub.save_mapped(path + '.mmap')
+                for loaded in [model.load_model(path), model.load_model(path + '.mmap')]:
+                    self.assertEqual(loaded.reducer.kind, reduction)
+                    self.assertTrue(np.allclose(loaded.predict_by_posts(make_posts()), hub.predict_by_posts(make_posts())))
+
+    def test_load_model_without_reduction(self):
+        hub = model.HabrHubRatingRegressor('test')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'test.hubmodel64')
+            with open(path, 'wb') as fout:
+                for item in [None, 'test', None, None]:
+                    pickle.dump(item, fout)
+            hub.load(path)
+            self.assertEqual(hub.hub_name, 'test')
+            self.assertIsNone(hub.reducer)
+
+if __name__ == '__main__':
+    unittest.main(testRunner=crr.ColourTextTestRunner, verbosity=2)
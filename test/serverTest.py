@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import json
+import threading
+import time
+import unittest
+import sys
+import urllib.error
+import urllib.request
+from unittest import mock
+import colour_runner.runner as crr
+import aiohttp
+sys.path.append('../src')
+
+from habrating import server
+
+class FakeModel:
+    "Model, which predicts body length of post and remembers sizes of its batches"
+    def __init__(self, hub_name='test', delay=0.0, error=None):
+        self.hub_name = hub_name
+        self.delay = delay
+        self.error = error
+        self.batch_sizes = []
+
+    def predict_by_posts(self, posts):
+        time.sleep(self.delay)
+        self.batch_sizes.append(len(posts))
+        if self.error is not None:
+            raise self.error
+        return [post['body length'] for post in posts]
+
+def make_post(length):
+    return {'title': 'заголовок', 'body': 'б' * length, 'body length': length}
+
+class TestMicroBatcher(unittest.TestCase):
+    def test_batching(self):
+        hub_model = FakeModel(delay=0.05)
+        batcher = server.MicroBatcher(hub_model, max_batch_size=8, max_wait=0.05)
+        futures = [batcher.submit(make_post(length)) for length in range(20)]
+        self.assertEqual([future.result(timeout=5) for future in futures], list(range(20)))
+        self.assertLessEqual(max(hub_model.batch_sizes), 8)
+        self.assertLess(len(hub_model.batch_sizes), 20)
+        self.assertEqual(batcher.batches, len(hub_model.batch_sizes))
+
+    def test_max_wait(self):
+        hub_model = FakeModel()
+        batcher = server.MicroBatcher(hub_model, max_batch_size=100, max_wait=0.05)
+        start = time.monotonic()
+        self.assertEqual(batcher.predict([make_post(3)]), [3])
+        # Incomplete batch is predicted once max_wait passes
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(hub_model.batch_sizes, [1])
+
+    def test_error_propagation(self):
+        hub_model = FakeModel(error=RuntimeError('broken model'))
+        batcher = server.MicroBatcher(hub_model, max_wait=0.01)
+        futures = [batcher.submit(make_post(length)) for length in range(3)]
+        for future in futures:
+            with self.assertRaises(RuntimeError):
+                future.result(timeout=5)
+        hub_model.error = None
+        self.assertEqual(batcher.predict([make_post(5)]), [5])
+
+class TestLatencyStats(unittest.TestCase):
+    def test_report(self):
+        stats = server.LatencyStats(window=100)
+        self.assertIsNone(stats.report()['latency_p50_ms'])
+        for latency in range(1, 201):
+            stats.record(latency / 1000)
+        report = stats.report()
+        self.assertEqual(report['requests'], 200)
+        # Percentiles are of the last window requests only
+        self.assertAlmostEqual(report['latency_p50_ms'], 150.5)
+        self.assertGreater(report['latency_p99_ms'], 198)
+
+class TestPredictionService(unittest.TestCase):
+    def setUp(self):
+        models = {'first.hubmodel64': FakeModel('first'), 'second.hubmodel64': FakeModel('second')}
+        with mock.patch.object(server.model, 'load_model', models.get):
+            self.service = server.PredictionService(list(models), max_wait=0.01)
+
+    def test_predict_posts(self):
+        request = {'model': 'second', 'posts': [{'title': 't', 'body': 'текст', 'views': '10'}]}
+        self.assertEqual(self.service.predict(request), [5])
+        with self.assertRaises(ValueError):
+            self.service.predict({'posts': []})
+        with self.assertRaises(ValueError):
+            self.service.predict({'model': 'third', 'posts': []})
+        with self.assertRaises(ValueError):
+            self.service.predict({'model': 'first'})
+        self.assertEqual(self.service.report()['models'], ['first', 'second'])
+
+    def test_fetch_errors(self):
+        not_found = aiohttp.ClientResponseError(mock.Mock(real_url='https://habr.com/post/1/'), (), status=404)
+        for error, status in [(not_found, 404), (aiohttp.ClientConnectionError(), 502)]:
+            fake_fetcher = mock.Mock()
+            fake_fetcher.parse_articles.side_effect = error
+            with mock.patch.object(server.fetcher, 'get_fetcher', return_value=fake_fetcher):
+                with self.assertRaises(server.FetchError) as raised:
+                    self.service.predict({'model': 'first', 'urls': ['https://habr.com/post/1/']})
+            self.assertEqual(raised.exception.status, status)
+
+    def test_http_status_of_fetch_error(self):
+        http_server = server.make_server(self.service, port=0)
+        thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            fake_fetcher = mock.Mock()
+            fake_fetcher.parse_articles.side_effect = aiohttp.ClientResponseError(
+                mock.Mock(real_url='https://habr.com/post/1/'), (), status=404)
+            request = urllib.request.Request(f'http://127.0.0.1:{http_server.server_address[1]}/predict',
+                data=json.dumps({'model': 'first', 'urls': ['https://habr.com/post/1/']}).encode('utf-8'))
+            with mock.patch.object(server.fetcher, 'get_fetcher', return_value=fake_fetcher):
+                with self.assertRaises(urllib.error.HTTPError) as raised:
+                    urllib.request.urlopen(request, timeout=5)
+            self.assertEqual(raised.exception.code, 404)
+            self.assertEqual(json.loads(raised.exception.read()),
+                {'error': 'article https://habr.com/post/1/ answered 404'})
+        finally:
+            http_server.shutdown()
+            http_server.server_close()
+
+if __name__ == '__main__':
+    unittest.main(testRunner=crr.ColourTextTestRunner, verbosity=2)